@@ -4,7 +4,23 @@ Provides a web interface to manage streams, categories, and watch history
 """
 
 from django.contrib import admin
-from .models import Category, Stream, WatchHistory
+from django.db.models import Count, Q
+from django.http import QueryDict
+from django.utils.html import format_html, format_html_join
+
+from . import jobs, sharding
+from .models import (
+    BulkJob,
+    Category,
+    ExportWatermark,
+    Person,
+    ProfileReport,
+    Stream,
+    StreamHealth,
+    WatchHistory,
+    WatchHistoryDaily,
+)
+from .paginators import EstimatedCountPaginator
 
 
 @admin.register(Category)
@@ -18,10 +34,28 @@ class CategoryAdmin(admin.ModelAdmin):
     prepopulated_fields = {'slug': ('name',)}
     ordering = ['order', 'name']
     
+    def get_queryset(self, request):
+        """Count active streams in the changelist query instead of per row"""
+        return super().get_queryset(request).annotate(
+            active_stream_count=Count('streams', filter=Q(streams__is_active=True))
+        )
+    
     def stream_count(self, obj):
         """Display count of streams in category"""
-        return obj.streams.filter(is_active=True).count()
+        return obj.active_stream_count
     stream_count.short_description = 'Active Streams'
+    stream_count.admin_order_field = 'active_stream_count'
+
+
+@admin.register(Person)
+class PersonAdmin(admin.ModelAdmin):
+    """
+    Admin interface for cast members and directors
+    People are created from stream cast/director text
+    """
+    list_display = ['name', 'slug', 'created_at']
+    search_fields = ['name', 'slug']
+    readonly_fields = ['created_at']
 
 
 @admin.register(Stream)
@@ -35,7 +69,8 @@ class StreamAdmin(admin.ModelAdmin):
         'quality',
         'duration',
         'rating',
-        'view_count',
+        'plays',
+        'unique_devices',
         'is_featured',
         'is_live',
         'is_active',
@@ -50,6 +85,10 @@ class StreamAdmin(admin.ModelAdmin):
         'created_at'
     ]
     search_fields = ['title', 'description', 'cast', 'director']
+    list_select_related = ['category', 'stats']
+    autocomplete_fields = ['category']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     prepopulated_fields = {'slug': ('title',)}
     readonly_fields = ['view_count', 'created_at', 'updated_at']
     
@@ -74,35 +113,86 @@ class StreamAdmin(admin.ModelAdmin):
     
     actions = ['make_featured', 'remove_featured', 'activate', 'deactivate']
     
+    def _stats(self, obj):
+        try:
+            return obj.stats
+        except Stream.stats.RelatedObjectDoesNotExist:
+            return None
+    
+    def plays(self, obj):
+        """Display total plays from the engagement aggregates"""
+        stats = self._stats(obj)
+        return stats.plays if stats else 0
+    plays.short_description = 'Plays'
+    plays.admin_order_field = 'stats__plays'
+    
+    def unique_devices(self, obj):
+        """Display estimated unique devices from the engagement aggregates"""
+        stats = self._stats(obj)
+        return stats.unique_devices if stats else 0
+    unique_devices.short_description = 'Unique Devices'
+    unique_devices.admin_order_field = 'stats__unique_devices'
+    
+    def _enqueue(self, request, queryset, action, description):
+        """Queue a bulk job and return straight away"""
+        job = jobs.enqueue(action, queryset)
+        self.message_user(
+            request,
+            f'Job #{job.pk} queued: {job.total} stream(s) will be {description}.',
+        )
+    
     def make_featured(self, request, queryset):
         """Mark selected streams as featured"""
-        count = queryset.update(is_featured=True)
-        self.message_user(request, f'{count} stream(s) marked as featured.')
+        self._enqueue(request, queryset, 'make_featured', 'marked as featured')
     make_featured.short_description = 'Mark as featured'
     
     def remove_featured(self, request, queryset):
         """Remove featured status from selected streams"""
-        count = queryset.update(is_featured=False)
-        self.message_user(request, f'{count} stream(s) removed from featured.')
+        self._enqueue(request, queryset, 'remove_featured', 'removed from featured')
     remove_featured.short_description = 'Remove from featured'
     
     def activate(self, request, queryset):
         """Activate selected streams"""
-        count = queryset.update(is_active=True)
-        self.message_user(request, f'{count} stream(s) activated.')
+        self._enqueue(request, queryset, 'activate', 'activated')
     activate.short_description = 'Activate selected streams'
     
     def deactivate(self, request, queryset):
         """Deactivate selected streams"""
-        count = queryset.update(is_active=False)
-        self.message_user(request, f'{count} stream(s) deactivated.')
+        self._enqueue(request, queryset, 'deactivate', 'deactivated')
     deactivate.short_description = 'Deactivate selected streams'
 
 
+class ShardListFilter(admin.SimpleListFilter):
+    """
+    Picks the WatchHistory shard to browse (the queryset itself is switched
+    in WatchHistoryAdmin.get_queryset so change pages use the same shard)
+    """
+    title = 'shard'
+    parameter_name = 'shard'
+    
+    def lookups(self, request, model_admin):
+        if not sharding.is_sharded():
+            return []
+        return [(alias, alias) for alias in sharding.get_shards()]
+    
+    def queryset(self, request, queryset):
+        return queryset
+    
+    def choices(self, changelist):
+        current = self.value() or sharding.get_shards()[0]
+        for lookup, title in self.lookup_choices:
+            yield {
+                'selected': current == lookup,
+                'query_string': changelist.get_query_string({self.parameter_name: lookup}),
+                'display': title,
+            }
+
+
 @admin.register(WatchHistory)
 class WatchHistoryAdmin(admin.ModelAdmin):
     """
     Admin interface for Watch History
+    With WATCH_HISTORY_SHARDS set, one shard is shown at a time
     """
     list_display = [
         'stream',
@@ -111,14 +201,203 @@ class WatchHistoryAdmin(admin.ModelAdmin):
         'completed',
         'watched_at'
     ]
-    list_filter = ['completed', 'watched_at']
-    search_fields = ['stream__title', 'device_id']
+    list_filter = [ShardListFilter, 'completed', 'watched_at']
+    # Exact device match hits the device_id index; titles match by prefix only
+    search_fields = ['=device_id', '^stream__title']
+    list_select_related = ['stream__category']
+    raw_id_fields = ['stream']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     readonly_fields = ['watched_at']
-    date_hierarchy = 'watched_at'
+    # No date_hierarchy: its date links need a DISTINCT scan of the whole table
+    
+    def _shard(self, request):
+        """Shard picked in the changelist filter, kept on change and delete pages"""
+        shard = request.GET.get('shard')
+        if shard is None:
+            shard = QueryDict(request.GET.get('_changelist_filters', '')).get('shard')
+        shards = sharding.get_shards()
+        return shard if shard in shards else shards[0]
+    
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if not sharding.is_sharded():
+            return queryset
+        # Streams are on the default database, so prefetch instead of joining
+        return queryset.using(self._shard(request)).prefetch_related('stream__category')
+    
+    def get_list_select_related(self, request):
+        if sharding.is_sharded():
+            return []  # False would still join the stream column
+        return super().get_list_select_related(request)
+    
+    def get_search_fields(self, request):
+        if sharding.is_sharded():
+            return ['=device_id']
+        return super().get_search_fields(request)
+    
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Try a single term as a device ID first, then as a title prefix
+
+        OR-ing the two in one query keeps the database from using the
+        device_id index, so a search would scan the whole table.
+        """
+        term = search_term.strip()
+        if not term or len(term.split()) > 1:
+            return super().get_search_results(request, queryset, search_term)
+        devices = queryset.filter(device_id=term)
+        if sharding.is_sharded() or devices.exists():
+            return devices, False
+        return queryset.filter(stream__title__istartswith=term), False
+    
+    def get_readonly_fields(self, request, obj=None):
+        readonly_fields = super().get_readonly_fields(request, obj)
+        if obj is not None and sharding.is_sharded():
+            # The device_id decides which shard the row belongs on
+            return [*readonly_fields, 'device_id']
+        return readonly_fields
     
     def watch_duration_formatted(self, obj):
         """Format watch duration in minutes"""
         minutes = obj.watch_duration // 60
         seconds = obj.watch_duration % 60
         return f"{minutes}m {seconds}s"
-    watch_duration_formatted.short_description = 'Duration Watched'
\ No newline at end of file
+    watch_duration_formatted.short_description = 'Duration Watched'
+
+
+@admin.register(WatchHistoryDaily)
+class WatchHistoryDailyAdmin(admin.ModelAdmin):
+    """
+    Admin interface for daily watch history rollups
+    """
+    list_display = ['stream', 'date', 'views', 'total_seconds', 'completions']
+    list_filter = ['date']
+    search_fields = ['^stream__title']
+    list_select_related = ['stream']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    readonly_fields = ['stream', 'date', 'views', 'total_seconds', 'completions']
+
+
+@admin.register(BulkJob)
+class BulkJobAdmin(admin.ModelAdmin):
+    """
+    Admin interface for background bulk jobs (read-only)
+    """
+    list_display = ['id', 'action', 'status', 'progress_display', 'total', 'created_at', 'finished_at']
+    list_filter = ['status', 'action']
+    readonly_fields = [
+        'action',
+        'status',
+        'total',
+        'processed',
+        'last_id',
+        'error',
+        'created_at',
+        'started_at',
+        'finished_at',
+    ]
+    
+    def progress_display(self, obj):
+        """Display percentage processed"""
+        return f"{obj.progress}%"
+    progress_display.short_description = 'Progress'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(StreamHealth)
+class StreamHealthAdmin(admin.ModelAdmin):
+    """
+    Admin interface for stream URL checks (read-only)
+    Filled in by python manage.py check_stream_urls
+    """
+    list_display = [
+        'stream',
+        'url_status',
+        'url_latency_ms',
+        'url_error',
+        'thumbnail_status',
+        'is_dead',
+        'failures',
+        'checked_at',
+    ]
+    list_filter = ['is_dead', 'url_status', 'checked_at']
+    search_fields = ['^stream__title']
+    list_select_related = ['stream']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ExportWatermark)
+class ExportWatermarkAdmin(admin.ModelAdmin):
+    """
+    Admin interface for incremental export progress
+    Deleting a watermark makes the next incremental export start from scratch
+    """
+    list_display = ['name', 'rows_exported', 'last_file', 'updated_at']
+    readonly_fields = ['name', 'positions', 'rows_exported', 'last_file', 'updated_at']
+    
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(ProfileReport)
+class ProfileReportAdmin(admin.ModelAdmin):
+    """
+    Admin interface for profiled requests (read-only)
+    Filter by view to compare runs of one StreamViewSet/WatchHistoryViewSet action
+    """
+    list_display = ['view_name', 'method', 'path', 'status_code', 'duration_ms', 'sql_count', 'sql_time_ms', 'created_at']
+    list_filter = ['view_name', 'method', 'status_code']
+    search_fields = ['path', 'view_name']
+    date_hierarchy = 'created_at'
+    exclude = ['top_functions', 'queries']
+    readonly_fields = [
+        'view_name',
+        'method',
+        'path',
+        'status_code',
+        'duration_ms',
+        'sql_count',
+        'sql_time_ms',
+        'stats_file',
+        'created_at',
+        'top_functions_display',
+        'queries_display',
+    ]
+    
+    def top_functions_display(self, obj):
+        """Slowest functions by cumulative time"""
+        rows = format_html_join(
+            '\n', '<tr><td>{}</td><td>{}</td><td>{}</td><td><code>{}</code></td></tr>',
+            ((row['cumtime_ms'], row['tottime_ms'], row['ncalls'], row['function']) for row in obj.top_functions)
+        )
+        return format_html(
+            '<table><tr><th>cumulative ms</th><th>own ms</th><th>calls</th><th>function</th></tr>{}</table>', rows
+        )
+    top_functions_display.short_description = 'Top functions'
+    
+    def queries_display(self, obj):
+        """Slowest SQL statements"""
+        rows = format_html_join(
+            '\n', '<tr><td>{}</td><td>{}</td><td><code>{}</code></td></tr>',
+            ((query['time_ms'], query['db'], query['sql']) for query in obj.queries)
+        )
+        return format_html('<table><tr><th>ms</th><th>db</th><th>SQL</th></tr>{}</table>', rows)
+    queries_display.short_description = 'Slowest queries'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,188 @@
+"""
+Sune TV - Engagement analytics
+Incremental per-stream and per-category aggregates, updated as watch events arrive
+"""
+
+import hashlib
+import math
+
+from django.db.models import Sum
+
+from .db import serialized_write
+from .sharding import fan_out
+
+# 2^11 registers (2 KB per sketch), about 2.3% standard error
+HLL_PRECISION = 11
+HLL_REGISTERS = 1 << HLL_PRECISION
+
+
+class HyperLogLog:
+    """
+    HyperLogLog sketch for counting unique devices in bounded memory
+
+    Registers are kept in a bytearray so the sketch can be stored as-is in a
+    BinaryField and merged with another sketch register by register.
+    """
+
+    def __init__(self, registers=None):
+        if registers:
+            self.registers = bytearray(registers)
+        else:
+            self.registers = bytearray(HLL_REGISTERS)
+
+    def add(self, value):
+        """Add a value, returning True if the sketch changed"""
+        digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+        x = int.from_bytes(digest, 'big')
+        index = x >> (64 - HLL_PRECISION)
+        remaining = x & ((1 << (64 - HLL_PRECISION)) - 1)
+        rank = (64 - HLL_PRECISION) - remaining.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def merge(self, other):
+        """Fold another sketch into this one"""
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        """Estimated number of distinct values added"""
+        m = HLL_REGISTERS
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small range correction (linear counting)
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return bytes(self.registers)
+
+
+def _apply_event(stats, event):
+    """Add one watch event to a stats row (caller saves it)"""
+    stats.plays += 1
+    stats.total_seconds += event.watch_duration
+    if event.completed:
+        stats.completions += 1
+
+    sketch = HyperLogLog(stats.devices_sketch)
+    if sketch.add(event.device_id):
+        stats.devices_sketch = sketch.to_bytes()
+        stats.unique_devices = sketch.count()
+
+
+def _merge_stats(stats, other):
+    """Fold another partial stats row for the same stream or category into stats"""
+    stats.plays += other.plays
+    stats.total_seconds += other.total_seconds
+    stats.completions += other.completions
+
+    sketch = HyperLogLog(stats.devices_sketch)
+    sketch.merge(HyperLogLog(other.devices_sketch))
+    stats.devices_sketch = sketch.to_bytes()
+    stats.unique_devices = sketch.count()
+
+
+def record_watch_event(event):
+    """
+    Fold a newly created WatchHistory row into the stream and category stats
+
+    Called from the post_save signal, so every ingestion path keeps the
+    aggregates current and reads never have to scan WatchHistory.
+    """
+    from .models import CategoryStats, StreamStats
+
+    with serialized_write():
+        stream_stats, _ = StreamStats.objects.select_for_update().get_or_create(
+            stream_id=event.stream_id
+        )
+        _apply_event(stream_stats, event)
+        stream_stats.save()
+
+        category_stats, _ = CategoryStats.objects.select_for_update().get_or_create(
+            category_id=event.stream.category_id
+        )
+        _apply_event(category_stats, event)
+        category_stats.save()
+
+
+def rebuild_stats():
+    """
+    Recompute every stats row from the watch history
+
+    Used to backfill the aggregates for history recorded before they existed.
+    Retained raw events are counted along with the WatchHistoryDaily rollups
+    of pruned days. Rollups have no device IDs, so the current sketches are
+    merged back in to keep the devices of pruned events. Each shard is
+    scanned in parallel into partial stats that are then merged; memory is
+    one sketch per stream and per category for each shard.
+    """
+    from .models import CategoryStats, Stream, StreamStats, WatchHistory, WatchHistoryDaily
+
+    category_of = dict(Stream.objects.values_list('id', 'category_id'))
+
+    def shard_stats(alias):
+        stream_stats = {}
+        category_stats = {}
+        events = WatchHistory.objects.using(alias).order_by().only(
+            'stream_id', 'device_id', 'watch_duration', 'completed'
+        )
+        for event in events.iterator(chunk_size=5000):
+            category_id = category_of.get(event.stream_id)
+            if category_id is None:
+                continue  # Stream deleted
+            if event.stream_id not in stream_stats:
+                stream_stats[event.stream_id] = StreamStats(stream_id=event.stream_id)
+            if category_id not in category_stats:
+                category_stats[category_id] = CategoryStats(category_id=category_id)
+            _apply_event(stream_stats[event.stream_id], event)
+            _apply_event(category_stats[category_id], event)
+        return stream_stats, category_stats
+
+    stream_stats = {}
+    category_stats = {}
+    for partial_streams, partial_categories in fan_out(shard_stats):
+        for totals, partials in ((stream_stats, partial_streams), (category_stats, partial_categories)):
+            for key, partial in partials.items():
+                if key in totals:
+                    _merge_stats(totals[key], partial)
+                else:
+                    totals[key] = partial
+
+    def stats_for(stream_id, category_id):
+        if stream_id not in stream_stats:
+            stream_stats[stream_id] = StreamStats(stream_id=stream_id)
+        if category_id not in category_stats:
+            category_stats[category_id] = CategoryStats(category_id=category_id)
+        return stream_stats[stream_id], category_stats[category_id]
+
+    rollups = WatchHistoryDaily.objects.order_by().values('stream_id').annotate(
+        views=Sum('views'), total_seconds=Sum('total_seconds'), completions=Sum('completions')
+    )
+    for row in rollups:
+        category_id = category_of.get(row['stream_id'])
+        if category_id is None:
+            continue
+        for stats in stats_for(row['stream_id'], category_id):
+            stats.plays += row['views']
+            stats.total_seconds += row['total_seconds']
+            stats.completions += row['completions']
+
+    for model, totals, key_field in (
+        (StreamStats, stream_stats, 'stream_id'),
+        (CategoryStats, category_stats, 'category_id'),
+    ):
+        for key, sketch in model.objects.values_list(key_field, 'devices_sketch'):
+            if key in totals and sketch:
+                _merge_stats(totals[key], model(devices_sketch=sketch))
+
+    with serialized_write():
+        StreamStats.objects.all().delete()
+        CategoryStats.objects.all().delete()
+        StreamStats.objects.bulk_create(stream_stats.values(), batch_size=1000)
+        CategoryStats.objects.bulk_create(category_stats.values(), batch_size=1000)
+
+    return len(stream_stats), len(category_stats)
@@ -1,12 +1,10 @@
 from django.apps import AppConfig
 
+
 class StreamsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'streams'
     verbose_name = 'Sune TV Streams'
 
-
-
-
-
-
+    def ready(self):
+        from . import signals  # noqa: F401
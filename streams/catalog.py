@@ -0,0 +1,341 @@
+"""
+Sune TV - Shared catalog payloads
+Anonymous catalog responses are built once and cached under a catalog version
+that is bumped whenever categories or streams change
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.db import connections
+from django.db.models import Count, F, Q, Window
+from django.db.models.functions import RowNumber
+
+CATALOG_VERSION_KEY = 'catalog:version'
+
+
+def _version_file_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'a'):
+            pass
+        return os.stat(path).st_mtime_ns
+
+
+def catalog_version():
+    """Current catalog version, part of every catalog cache key"""
+    path = settings.CATALOG_VERSION_FILE
+    if path:
+        return _version_file_ns(path)
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, 1, timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY, 1)
+    return version
+
+
+def bump_catalog_version():
+    """Invalidate every cached catalog payload at once, in every process"""
+    path = settings.CATALOG_VERSION_FILE
+    if path:
+        # Never move backwards, even if two bumps land on the same clock tick
+        version = max(time.time_ns(), _version_file_ns(path) + 1)
+        os.utime(path, ns=(version, version))
+        return
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.add(CATALOG_VERSION_KEY, 1, timeout=None)
+
+
+# How each cached() call was served, for this process (see cache_metrics())
+_metrics = Counter()
+
+# Keys being built in this process -> Event set when the build finishes
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+# Longest a build may hold the cross-process lock, and how often waiters poll
+BUILD_LOCK_TIMEOUT = 30
+BUILD_POLL_INTERVAL = 0.05
+
+
+def cache_metrics():
+    """
+    Counts of cached() outcomes in this process since it started:
+    hit (fresh payload), stale (out-of-date payload served while another
+    request rebuilds it), collapsed (waited for another request's build),
+    built
+    """
+    return dict(_metrics)
+
+
+def _store(store, key, version, value, timeout):
+    # Kept past its freshness so it can be served stale while being rebuilt
+    entry = (version, time.time() + timeout, value)
+    store.set(key, entry, timeout + settings.CATALOG_STALE_TIMEOUT)
+
+
+def _wait_for_build(store, key, version, lock_key):
+    """Poll for another process's build; None if it gave up"""
+    deadline = time.monotonic() + BUILD_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(BUILD_POLL_INTERVAL)
+        entry = store.get(key)
+        if entry is not None and entry[0] >= version:
+            return entry
+        if store.get(lock_key) is None:
+            return None
+    return None
+
+
+def _build(store, key, version, builder, timeout, stale):
+    """Build and store a payload unless another process is already doing so"""
+    lock_key = f'{key}:lock'
+    if not store.add(lock_key, 1, BUILD_LOCK_TIMEOUT):
+        if stale is not None:
+            _metrics['stale'] += 1
+            return stale[2]
+        entry = _wait_for_build(store, key, version, lock_key)
+        if entry is not None:
+            _metrics['collapsed'] += 1
+            return entry[2]
+        # The other builder failed or is too slow, build it here after all
+    try:
+        value = builder()
+        _store(store, key, version, value, timeout)
+        _metrics['built'] += 1
+        return value
+    finally:
+        store.delete(lock_key)
+
+
+def cached(name, builder, timeout=None, cache_alias=DEFAULT_CACHE_ALIAS):
+    """
+    Return the cached payload for name, building it on a miss
+
+    Builds are single-flight: within a process one request builds a key while
+    the others wait for its result, and across processes (with a shared cache)
+    an add() lock picks the builder. While a payload that is only past its
+    timeout is still cached, the other requests get it straight away instead
+    of waiting; one from an older catalog version describes streams that have
+    since changed, so they wait for the new one.
+    """
+    timeout = timeout or settings.CATALOG_CACHE_TIMEOUT
+    store = caches[cache_alias]
+    key = f'catalog:{name}'
+    version = catalog_version()
+
+    entry = store.get(key)
+    if entry is not None and entry[0] == version and entry[1] > time.time():
+        _metrics['hit'] += 1
+        return entry[2]
+    stale = entry if entry is not None and entry[0] == version else None
+
+    while True:
+        with _in_flight_lock:
+            done = _in_flight.get(key)
+            if done is None:
+                done = _in_flight[key] = threading.Event()
+                break
+
+        if stale is not None:
+            _metrics['stale'] += 1
+            return stale[2]
+        done.wait(BUILD_LOCK_TIMEOUT)
+        entry = store.get(key)
+        if entry is not None and entry[0] >= version:
+            _metrics['collapsed'] += 1
+            return entry[2]
+        # The build failed, try it here
+
+    try:
+        return _build(store, key, version, builder, timeout, stale)
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
+        done.set()
+
+
+def active_categories():
+    """Active categories with their active stream count annotated"""
+    from .models import Category
+
+    # Meta.ordering is ignored by aggregate queries, so order explicitly
+    return Category.objects.filter(is_active=True).annotate(
+        active_stream_count=Count('streams', filter=Q(streams__is_active=True))
+    ).order_by('order', 'name')
+
+
+def build_categories(categories=None):
+    """Active categories with stream counts (categories list payload)"""
+    from .serializers import CategorySerializer
+
+    if categories is None:
+        categories = active_categories()
+    return CategorySerializer(categories, many=True).data
+
+
+def build_featured():
+    """Up to 5 featured streams for the hero banner"""
+    from .models import Stream
+    from .serializers import StreamListSerializer
+
+    streams = Stream.objects.filter(is_featured=True, is_active=True).select_related('category')[:5]
+    return StreamListSerializer(streams, many=True).data
+
+
+def build_trending():
+    """Top 20 streams by view count"""
+    from .models import Stream
+    from .serializers import StreamListSerializer
+
+    streams = Stream.objects.filter(is_active=True).select_related('category').order_by('-view_count')[:20]
+    return StreamListSerializer(streams, many=True).data
+
+
+def build_live():
+    """All live streams"""
+    from .models import Stream
+    from .serializers import StreamListSerializer
+
+    streams = Stream.objects.filter(is_live=True, is_active=True).select_related('category')
+    return StreamListSerializer(streams, many=True).data
+
+
+def build_search(query):
+    """Active streams matching query in title, description, cast or director"""
+    from .models import Stream
+    from .serializers import StreamListSerializer
+
+    streams = Stream.objects.filter(
+        Q(title__icontains=query) |
+        Q(description__icontains=query) |
+        Q(cast__icontains=query) |
+        Q(director__icontains=query),
+        is_active=True
+    ).select_related('category')
+    return StreamListSerializer(streams, many=True).data
+
+
+def search_results(query):
+    """
+    Cached search results; queries differing only in case share an entry
+
+    They go in the separate, size-capped 'search' cache, so one-off queries
+    can't push catalog payloads out of the default cache.
+    """
+    query = query.strip()
+    digest = hashlib.blake2b(query.lower().encode(), digest_size=16).hexdigest()
+    return cached(f'search:{digest}', lambda: build_search(query), cache_alias='search')
+
+
+def build_by_category(categories=None):
+    """
+    Up to 10 active streams for each active category
+
+    All sections come from one windowed query rather than one query per
+    category. Returns (category_id, section) pairs so callers can
+    personalise the order; section is the dict sent to clients.
+    """
+    from .models import Category, Stream
+    from .serializers import StreamListSerializer
+
+    if categories is None:
+        categories = Category.objects.filter(is_active=True)
+    categories = list(categories)
+
+    streams = Stream.objects.filter(
+        category__in=categories,
+        is_active=True
+    ).select_related('category').annotate(
+        position=Window(RowNumber(), partition_by=F('category_id'), order_by=F('created_at').desc())
+    ).filter(position__lte=10).order_by('category_id', 'position')  # Limit to 10 streams per category
+
+    by_category = defaultdict(list)
+    for stream in streams:
+        by_category[stream.category_id].append(stream)
+
+    sections = []
+    for category in categories:
+        if by_category[category.id]:
+            sections.append((category.id, {
+                'category': category.name,
+                'streams': StreamListSerializer(by_category[category.id], many=True).data,
+            }))
+    return sections
+
+
+def by_category_sections():
+    """Cached (category_id, section) pairs for the by_category feed"""
+    return cached('by_category', build_by_category)
+
+
+def _run_section(builder):
+    """Build one section in a worker thread, releasing its DB connection"""
+    try:
+        return builder()
+    finally:
+        connections.close_all()
+
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.HOME_BUILD_WORKERS,
+            thread_name_prefix='home-build',
+        )
+    return _executor
+
+
+def build_home():
+    """
+    Every home screen section in one document
+
+    Categories are fetched once and shared by the categories and by_category
+    sections; the stream sections are independent and, with
+    HOME_BUILD_WORKERS > 1, built concurrently on separate DB connections.
+    """
+    def categories_and_sections():
+        categories = list(active_categories())
+        return build_categories(categories), build_by_category(categories)
+
+    builders = {
+        'categories': categories_and_sections,
+        'featured': build_featured,
+        'trending': build_trending,
+        'live': build_live,
+    }
+    if settings.HOME_BUILD_WORKERS > 1:
+        executor = _get_executor()
+        futures = {name: executor.submit(_run_section, builder) for name, builder in builders.items()}
+        results = {name: future.result() for name, future in futures.items()}
+    else:
+        results = {name: builder() for name, builder in builders.items()}
+
+    categories, sections = results.pop('categories')
+    return {
+        'version': catalog_version(),
+        'categories': categories,
+        'featured': results['featured'],
+        'by_category': sections,
+        'trending': results['trending'],
+        'live': results['live'],
+    }
+
+
+def home_document():
+    """Cached home document (by_category still as (category_id, section) pairs)"""
+    return cached('home', build_home)
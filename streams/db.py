@@ -0,0 +1,23 @@
+"""
+Sune TV - Database write helpers
+Keeps SQLite deployments from failing with "database is locked"
+"""
+
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+
+@contextmanager
+def serialized_write(using=DEFAULT_DB_ALIAS):
+    """
+    Run a block of writes in a single transaction
+
+    With SQLITE_TUNING (see settings) the transaction opens with
+    BEGIN IMMEDIATE, which takes SQLite's write lock up front: writers in
+    every worker process queue on it for up to the busy timeout, while WAL
+    lets readers carry on. Without it, a transaction that reads first can
+    fail with "database is locked" when it tries to write.
+    """
+    with transaction.atomic(using=using):
+        yield
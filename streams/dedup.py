@@ -0,0 +1,94 @@
+"""
+Sune TV - Duplicate watch event detection
+Clients may send an event_id with each watch event so retries can be
+recognised. A per-process Bloom filter remembers recent IDs; only events it
+may have seen are looked up, and the unique constraint on (device_id,
+event_id) catches everything else.
+"""
+
+import hashlib
+import math
+import threading
+
+from django.conf import settings
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over string keys
+
+    Bit positions come from double hashing one blake2b digest, so each key
+    costs a single hash however many positions are set.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RotatingBloomFilter:
+    """
+    Two Bloom filter generations, so memory stays bounded
+
+    When the current generation is full it becomes the previous one and a
+    fresh filter takes its place; lookups check both. Keys are remembered
+    for between one and two generations' worth of events.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.current = BloomFilter(capacity, error_rate)
+        self.previous = None
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def add(self, key):
+        with self._lock:
+            if self.count >= self.capacity:
+                self.previous = self.current
+                self.current = BloomFilter(self.capacity, self.error_rate)
+                self.count = 0
+            self.current.add(key)
+            self.count += 1
+
+    def __contains__(self, key):
+        previous = self.previous
+        return key in self.current or (previous is not None and key in previous)
+
+
+_seen = None
+
+
+def _get_filter():
+    global _seen
+    if _seen is None:
+        _seen = RotatingBloomFilter(settings.EVENT_DEDUP_CAPACITY, settings.EVENT_DEDUP_ERROR_RATE)
+    return _seen
+
+
+def _key(device_id, event_id):
+    return f'{device_id}\x00{event_id}'
+
+
+def may_have_seen(device_id, event_id):
+    """False means the event is certainly new to this process"""
+    return _key(device_id, event_id) in _get_filter()
+
+
+def remember(device_id, event_id):
+    _get_filter().add(_key(device_id, event_id))
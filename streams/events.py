@@ -0,0 +1,234 @@
+"""
+Sune TV - Live status events
+Pushes stream is_live / is_featured / is_active changes to clients over
+Server-Sent Events instead of having them poll /api/streams/live/
+
+Events are published from model signals and bulk jobs to an in-process
+broker. With EVENTS_REDIS_URL set they go through Redis pub/sub instead, so
+every worker receives events published by any process.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Stream fields whose changes are pushed to clients
+STATUS_FIELDS = ('is_live', 'is_featured', 'is_active')
+
+REDIS_CHANNEL = 'events:streams'
+REDIS_ID_KEY = 'events:streams:last_id'
+
+# Numbering and publishing in one script keeps event IDs in channel order
+# when several processes publish at once
+PUBLISH_SCRIPT = """
+local event_id = redis.call('INCR', KEYS[1])
+redis.call('PUBLISH', ARGV[1], event_id .. '\\n' .. ARGV[2] .. '\\n' .. ARGV[3])
+return event_id
+"""
+
+# Client reconnect delay (ms) sent at the start of every stream
+RETRY_MS = 3000
+
+
+class EventBroker:
+    """
+    Ring buffer of recent events that connections read by event ID
+
+    Connections hold no queue of their own: each one keeps the ID of the last
+    event it sent and waits on a per-event-loop asyncio.Event that is swapped
+    out whenever something is published. An idle connection costs one
+    suspended coroutine, however busy the broker is.
+    """
+
+    def __init__(self, size):
+        self._events = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._wakeups = {}  # event loop -> asyncio.Event
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    def append(self, event_id, name, data):
+        """Buffer an event (data is already JSON) and wake waiting connections"""
+        with self._lock:
+            if event_id is None:
+                event_id = self._last_id + 1
+            elif event_id <= self._last_id:
+                return
+            self._last_id = event_id
+            self._events.append((event_id, name, data))
+            loops = list(self._wakeups)
+
+        for loop in loops:
+            try:
+                loop.call_soon_threadsafe(self._wake, loop)
+            except RuntimeError:
+                # The loop has been closed
+                with self._lock:
+                    self._wakeups.pop(loop, None)
+
+    def _wake(self, loop):
+        with self._lock:
+            wakeup = self._wakeups.pop(loop, None)
+        if wakeup is not None:
+            wakeup.set()
+
+    def since(self, last_id):
+        """
+        Events after last_id, oldest first
+
+        Returns None when some of them are no longer buffered (or last_id is
+        from another process lifetime), so the client has to resync.
+        """
+        with self._lock:
+            if last_id == self._last_id:
+                return []
+            if last_id > self._last_id or not self._events or self._events[0][0] > last_id + 1:
+                return None
+            events = []
+            for event in reversed(self._events):
+                if event[0] <= last_id:
+                    break
+                events.append(event)
+        events.reverse()
+        return events
+
+    async def wait(self, last_id, timeout):
+        """Events after last_id, waiting up to timeout seconds for one to arrive"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            wakeup = None
+            if last_id == self._last_id:
+                wakeup = self._wakeups.get(loop)
+                if wakeup is None:
+                    wakeup = self._wakeups[loop] = asyncio.Event()
+
+        if wakeup is not None:
+            try:
+                async with asyncio.timeout(timeout):
+                    await wakeup.wait()
+            except TimeoutError:
+                pass
+        return self.since(last_id)
+
+
+_broker = None
+_redis_client = None
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = EventBroker(settings.EVENTS_BUFFER_SIZE)
+    return _broker
+
+
+def _redis():
+    """Redis client for cross-process delivery, or None when not configured"""
+    global _redis_client
+    if not settings.EVENTS_REDIS_URL:
+        return None
+    if _redis_client is None:
+        import redis
+
+        _redis_client = redis.Redis.from_url(settings.EVENTS_REDIS_URL)
+    return _redis_client
+
+
+def publish(name, data):
+    """Send an event to every connected client"""
+    payload = json.dumps(data, separators=(',', ':'))
+    client = _redis()
+    if client is None:
+        get_broker().append(None, name, payload)
+    else:
+        client.eval(PUBLISH_SCRIPT, 1, REDIS_ID_KEY, REDIS_CHANNEL, name, payload)
+
+
+def publish_stream_changes(ids, changes):
+    """
+    Publish changed status flags for the given streams once the current
+    transaction commits
+
+    A failed publish never fails the save that triggered it.
+    """
+    changes = {field: value for field, value in changes.items() if field in STATUS_FIELDS or field == 'deleted'}
+    if ids and changes:
+        data = {'ids': list(ids), **changes}
+        transaction.on_commit(lambda: publish('stream', data), robust=True)
+
+
+def status_of(stream):
+    """Current status flags, ignoring deferred fields"""
+    return {field: stream.__dict__.get(field) for field in STATUS_FIELDS}
+
+
+def _listen():
+    """Feed events from Redis into this process's broker"""
+    broker = get_broker()
+    while True:
+        try:
+            pubsub = _redis().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(REDIS_CHANNEL)
+            for message in pubsub.listen():
+                event_id, name, data = message['data'].decode().split('\n', 2)
+                broker.append(int(event_id), name, data)
+        except Exception:
+            logger.exception('Live events listener lost its Redis connection, retrying')
+            time.sleep(1)
+
+
+def ensure_listener():
+    """Start the Redis listener thread on first use (no-op without Redis)"""
+    global _listener
+    if not settings.EVENTS_REDIS_URL:
+        return
+    with _listener_lock:
+        if _listener is None or not _listener.is_alive():
+            _listener = threading.Thread(target=_listen, name='live-events', daemon=True)
+            _listener.start()
+
+
+def _format(event_id, name, data):
+    return f'id: {event_id}\nevent: {name}\ndata: {data}\n\n'
+
+
+async def event_stream(last_id=None):
+    """
+    Server-Sent Events body for one client
+
+    Starts with a ready event carrying the current event ID, or replays
+    everything after last_id when resuming. A reset event means events were
+    missed and the client should refetch /api/streams/live/. A comment line
+    is sent every EVENTS_HEARTBEAT seconds to keep idle connections open.
+    """
+    ensure_listener()
+    broker = get_broker()
+
+    yield f'retry: {RETRY_MS}\n\n'
+    if last_id is None:
+        last_id = broker.last_id
+        yield _format(last_id, 'ready', '{}')
+
+    while True:
+        events = await broker.wait(last_id, settings.EVENTS_HEARTBEAT)
+        if events is None:
+            last_id = broker.last_id
+            yield _format(last_id, 'reset', '{}')
+        elif not events:
+            yield ': ping\n\n'
+        else:
+            last_id = events[-1][0]
+            yield ''.join(_format(*event) for event in events)
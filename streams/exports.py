@@ -0,0 +1,159 @@
+"""
+Sune TV - Watch history export for offline analytics
+Streams watch events, with their stream and category attributes, to gzipped
+CSV or Parquet one fixed-size chunk at a time, so memory stays flat however
+many rows are exported
+
+Parquet needs pyarrow, which is optional.
+"""
+
+import csv
+import gzip
+import os
+import tempfile
+
+from .sharding import get_shards
+
+# (column, type) in output order
+COLUMNS = [
+    ('id', 'int64'),
+    ('shard', 'string'),
+    ('event_id', 'string'),
+    ('device_id', 'string'),
+    ('watched_at', 'timestamp'),
+    ('watch_duration', 'int64'),
+    ('completed', 'bool'),
+    ('stream_id', 'int64'),
+    ('stream_title', 'string'),
+    ('category_id', 'int64'),
+    ('category_name', 'string'),
+    ('quality', 'string'),
+    ('language', 'string'),
+    ('release_year', 'int64'),
+    ('duration_seconds', 'int64'),
+]
+
+EVENT_FIELDS = ['id', 'event_id', 'device_id', 'watched_at', 'watch_duration', 'completed', 'stream_id']
+STREAM_FIELDS = ['title', 'category_id', 'category__name', 'quality', 'language', 'release_year', 'duration_seconds']
+
+# Catalog columns for events whose stream has been deleted
+MISSING_STREAM = (None,) * len(STREAM_FIELDS)
+
+
+class CsvExportWriter:
+    """Gzipped CSV with a header row"""
+    extension = '.csv.gz'
+    watched_at = [name for name, _ in COLUMNS].index('watched_at')
+
+    def __init__(self, path):
+        self.file = gzip.open(path, 'wt', newline='', encoding='utf-8', compresslevel=6)
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([name for name, _ in COLUMNS])
+
+    def write_rows(self, rows):
+        for row in rows:
+            row = list(row)
+            row[self.watched_at] = row[self.watched_at].isoformat()
+            self.writer.writerow(row)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetExportWriter:
+    """Parquet file with one row group per chunk"""
+    extension = '.parquet'
+
+    def __init__(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        types = {
+            'int64': pa.int64(),
+            'string': pa.string(),
+            'bool': pa.bool_(),
+            'timestamp': pa.timestamp('us', tz='UTC'),
+        }
+        self.pa = pa
+        self.schema = pa.schema([(name, types[type_name]) for name, type_name in COLUMNS])
+        self.writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+
+    def write_rows(self, rows):
+        arrays = [
+            self.pa.array(column, type=field.type)
+            for column, field in zip(zip(*rows), self.schema)
+        ]
+        self.writer.write_batch(self.pa.record_batch(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+WRITERS = {
+    'csv': CsvExportWriter,
+    'parquet': ParquetExportWriter,
+}
+
+
+def stream_attributes():
+    """stream_id -> catalog columns (the catalog is small next to the history)"""
+    from .models import Stream
+
+    rows = Stream.objects.order_by().values_list('id', *STREAM_FIELDS)
+    return {row[0]: row[1:] for row in rows.iterator(chunk_size=5000)}
+
+
+def export_watch_history(path, fmt='csv', since=None, until=None, positions=None, chunk_size=10000):
+    """
+    Write watch events from every shard to path
+
+    Events are read in ID order through a server-side cursor (a chunked
+    fetch on SQLite) and written a chunk at a time. positions maps a shard
+    alias to the last ID already exported, for incremental runs; events moved
+    by reshard_watch_history get new IDs and are exported again.
+
+    The file is written under a temporary name and renamed once complete.
+    Returns (rows written, positions after this export).
+    """
+    from .models import WatchHistory
+
+    attributes = stream_attributes()
+    positions = dict(positions or {})
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(fd)
+
+    writer = WRITERS[fmt](tmp_path)
+    rows = 0
+    try:
+        for alias in get_shards():
+            events = WatchHistory.objects.using(alias).order_by('pk')
+            if alias in positions:
+                events = events.filter(pk__gt=positions[alias])
+            if since is not None:
+                events = events.filter(watched_at__gte=since)
+            if until is not None:
+                events = events.filter(watched_at__lt=until)
+
+            chunk = []
+            for event in events.values_list(*EVENT_FIELDS).iterator(chunk_size=chunk_size):
+                chunk.append((event[0], alias, *event[1:], *attributes.get(event[-1], MISSING_STREAM)))
+                if len(chunk) >= chunk_size:
+                    writer.write_rows(chunk)
+                    rows += len(chunk)
+                    positions[alias] = chunk[-1][0]
+                    chunk = []
+            if chunk:
+                writer.write_rows(chunk)
+                rows += len(chunk)
+                positions[alias] = chunk[-1][0]
+    except BaseException:
+        writer.close()
+        os.remove(tmp_path)
+        raise
+
+    writer.close()
+    os.replace(tmp_path, path)
+    return rows, positions
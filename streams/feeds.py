@@ -0,0 +1,161 @@
+"""
+Sune TV - Personalised home feed
+Reorders the shared by_category feed per device using its watch history
+"""
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .db import serialized_write
+from .sharding import history_for
+
+# Completed titles remembered per device (most recent first)
+MAX_COMPLETED = 200
+
+# Reads refresh last_seen_at at most this often
+TOUCH_INTERVAL = timedelta(hours=1)
+
+
+def _cache_key(device_id):
+    return f'feed:device:{device_id}'
+
+
+def _rank(feed):
+    """Order categories by seconds watched, highest first"""
+    affinity = feed.category_affinity
+    feed.ranked_categories = [
+        int(category_id)
+        for category_id in sorted(affinity, key=lambda category_id: -affinity[category_id])
+    ]
+
+
+def record_watch_event(event):
+    """
+    Fold a new watch event into the device's feed
+
+    Only the affinity for the event's category and the completed list change,
+    so this stays cheap no matter how long the device's history is.
+    """
+    from .models import DeviceFeed
+
+    with serialized_write():
+        feed, _ = DeviceFeed.objects.select_for_update().get_or_create(device_id=event.device_id)
+        category_id = str(event.stream.category_id)
+        feed.category_affinity[category_id] = (
+            feed.category_affinity.get(category_id, 0) + max(event.watch_duration, 1)
+        )
+        if event.completed and event.stream_id not in feed.completed_streams:
+            feed.completed_streams = [event.stream_id] + feed.completed_streams[:MAX_COMPLETED - 1]
+        _rank(feed)
+        feed.last_seen_at = timezone.now()
+        feed.save()
+        transaction.on_commit(
+            lambda: cache.set(_cache_key(feed.device_id), feed, settings.CATALOG_CACHE_TIMEOUT)
+        )
+
+
+def rebuild_device_feed(device_id):
+    """Recompute a device's feed from its full watch history"""
+    from .models import DeviceFeed, Stream
+
+    history = history_for(device_id)
+    # Sum per stream on the device's shard, then map streams to categories
+    # from the catalog on the default database
+    totals = history.order_by().values('stream_id').annotate(seconds=Sum('watch_duration'))
+    seconds = {row['stream_id']: row['seconds'] or 0 for row in totals}
+    affinity = defaultdict(int)
+    for stream_id, category_id in Stream.objects.filter(pk__in=seconds).values_list('pk', 'category_id'):
+        affinity[str(category_id)] += seconds[stream_id]
+    affinity = dict(affinity)
+    completed = list(
+        history.filter(completed=True)
+        .values_list('stream_id', flat=True)
+        .order_by('-watched_at')[:MAX_COMPLETED * 2]
+    )
+
+    feed = DeviceFeed(device_id=device_id, category_affinity=affinity)
+    feed.completed_streams = list(dict.fromkeys(completed))[:MAX_COMPLETED]
+    _rank(feed)
+    with serialized_write():
+        feed, _ = DeviceFeed.objects.update_or_create(
+            device_id=device_id,
+            defaults={
+                'category_affinity': feed.category_affinity,
+                'completed_streams': feed.completed_streams,
+                'ranked_categories': feed.ranked_categories,
+            },
+        )
+    cache.set(_cache_key(device_id), feed, settings.CATALOG_CACHE_TIMEOUT)
+    return feed
+
+
+def get_device_feed(device_id):
+    """The stored feed for a device, or None for unknown devices"""
+    from .models import DeviceFeed
+
+    feed = cache.get(_cache_key(device_id))
+    if feed is False:
+        return None
+    if feed is None:
+        feed = DeviceFeed.objects.filter(device_id=device_id).first()
+        if feed is None:
+            # Remember unknown devices too; their first watch event replaces this
+            cache.set(_cache_key(device_id), False, settings.CATALOG_CACHE_TIMEOUT)
+            return None
+        cache.set(_cache_key(device_id), feed, settings.CATALOG_CACHE_TIMEOUT)
+
+    now = timezone.now()
+    if now - feed.last_seen_at > TOUCH_INTERVAL:
+        DeviceFeed.objects.filter(pk=feed.pk).update(last_seen_at=now)
+        feed.last_seen_at = now
+        cache.set(_cache_key(device_id), feed, settings.CATALOG_CACHE_TIMEOUT)
+    return feed
+
+
+def personalize(sections, feed):
+    """
+    Reorder shared (category_id, section) pairs for a device
+
+    Categories the device watches most come first, the rest keep their
+    usual order, and titles it has finished are dropped.
+    """
+    rank = {category_id: index for index, category_id in enumerate(feed.ranked_categories)}
+    completed = set(feed.completed_streams)
+
+    ordered = sorted(sections, key=lambda pair: rank.get(pair[0], len(rank)))
+    result = []
+    for _, section in ordered:
+        if completed:
+            streams = [stream for stream in section['streams'] if stream['id'] not in completed]
+            if not streams:
+                continue
+            section = {**section, 'streams': streams}
+        result.append(section)
+    return result
+
+
+def evict_inactive_feeds(idle_days=None, max_feeds=None):
+    """
+    Drop feeds for devices not seen recently, then the least recently seen
+    ones beyond max_feeds. Returns the number of feeds deleted.
+    """
+    from .models import DeviceFeed
+
+    idle_days = settings.DEVICE_FEED_IDLE_DAYS if idle_days is None else idle_days
+    max_feeds = settings.DEVICE_FEED_MAX if max_feeds is None else max_feeds
+
+    cutoff = timezone.now() - timedelta(days=idle_days)
+    deleted, _ = DeviceFeed.objects.filter(last_seen_at__lt=cutoff).delete()
+
+    overflow = DeviceFeed.objects.count() - max_feeds
+    if overflow > 0:
+        oldest = DeviceFeed.objects.order_by('last_seen_at').values_list('pk', flat=True)[:overflow]
+        extra, _ = DeviceFeed.objects.filter(pk__in=list(oldest)).delete()
+        deleted += extra
+    return deleted
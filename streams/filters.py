@@ -0,0 +1,27 @@
+"""
+Sune TV - API filters
+"""
+
+from django_filters import rest_framework as filters
+
+from .models import Stream
+
+
+class StreamFilter(filters.FilterSet):
+    """
+    Filters for StreamViewSet
+    e.g. ?category=1&duration_seconds__lte=1800&cast=tom-hanks
+    """
+    cast = filters.CharFilter(field_name='cast_members__slug', label='Cast member (person slug)')
+    director = filters.CharFilter(field_name='directors__slug', label='Director (person slug)')
+    
+    class Meta:
+        model = Stream
+        fields = {
+            'category': ['exact'],
+            'quality': ['exact'],
+            'is_featured': ['exact'],
+            'is_live': ['exact'],
+            # e.g. ?duration_seconds__lte=1800 for "under 30 minutes"
+            'duration_seconds': ['exact', 'gte', 'lte', 'gt', 'lt'],
+        }
@@ -0,0 +1,288 @@
+"""
+Sune TV - Category icon derivatives
+Resizes uploaded category icons to the ICON_SIZES tiles in WebP and JPEG, so
+clients don't download full-size uploads for small tiles
+
+Variants are content-addressed by the SHA-256 of the source image (stored as
+Category.icon_hash), so a new upload gets new URLs and old ones can be cached
+forever. They are generated in a worker pool when an icon is uploaded, or on
+the first request for them, and kept under ICON_CACHE_ROOT:
+    <hash[:2]>/<hash>-<size>.<ext>
+The cache is capped at ICON_CACHE_MAX_BYTES; least recently used variants
+are evicted first and regenerated if requested again.
+
+Sources Pillow can't decode (not an image, or over its decompression bomb
+limit) are remembered by hash, so they aren't decoded again on every request.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# format -> (Pillow format, file extension, content type)
+FORMATS = {
+    'webp': ('WEBP', 'webp', 'image/webp'),
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg'),
+}
+
+# Cache hits only bump a variant's mtime (its LRU position) this often
+TOUCH_INTERVAL = 3600
+
+# Eviction removes variants until the cache is this fraction of the cap
+EVICT_TO = 0.9
+
+
+def file_digest(f):
+    """SHA-256 of a Django File (an upload or an opened stored file), read in chunks"""
+    digest = hashlib.sha256()
+    for chunk in f.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def render_variant(source, size, fmt):
+    """Encode image bytes as a size x size (at most) thumbnail, keeping the aspect ratio"""
+    from PIL import Image, ImageOps
+
+    pil_format = FORMATS[fmt][0]
+    with Image.open(BytesIO(source)) as image:
+        image.draft('RGB', (size, size))  # Lets JPEG sources decode at a reduced scale
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        if pil_format == 'JPEG' or not has_alpha:
+            if has_alpha:
+                # JPEG has no transparency - flatten onto white
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, 'white')
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            else:
+                image = image.convert('RGB')
+        else:
+            image = image.convert('RGBA')
+
+        out = BytesIO()
+        if pil_format == 'WEBP':
+            image.save(out, 'WEBP', quality=settings.ICON_QUALITY, method=4)
+        else:
+            image.save(out, 'JPEG', quality=settings.ICON_QUALITY, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+class IconCache:
+    """
+    Size-capped directory of icon variants with LRU eviction
+
+    The modification time of a variant is its last use. Each process keeps a
+    running estimate of the cache size and scans the directory to evict once
+    the estimate goes over the cap, so several processes can share the cache.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = str(root)
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def path(self, digest, size, fmt):
+        return os.path.join(self.root, digest[:2], f'{digest}-{size}.{FORMATS[fmt][1]}')
+
+    def open(self, path):
+        """Open a cached variant and mark it used, or return None when it isn't cached"""
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            if time.time() - os.fstat(f.fileno()).st_mtime > TOUCH_INTERVAL:
+                os.utime(path)
+        except OSError:
+            pass
+        return f
+
+    def put(self, path, data):
+        """Store a variant atomically (readers never see a partial file)"""
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += len(data)
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def _entries(self):
+        """(path, size, mtime) of every cached variant"""
+        entries = []
+        try:
+            directories = list(os.scandir(self.root))
+        except FileNotFoundError:
+            return entries
+        for directory in directories:
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def evict(self):
+        """Remove least recently used variants until the cache is under EVICT_TO of the cap"""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * EVICT_TO
+        if total > target:
+            for path, size, _ in sorted(entries, key=lambda entry: entry[2]):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self.evictions += 1
+                if total <= target:
+                    break
+        with self._lock:
+            self._size = total
+
+
+_cache = None
+_executor = None
+_executor_lock = threading.Lock()
+
+# Variants being generated, so concurrent requests for one wait on a single job
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+# Hashes of source images that failed to decode
+_undecodable = set()
+
+
+class UndecodableIcon(Exception):
+    """The source image isn't an image Pillow can (safely) decode"""
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = IconCache(settings.ICON_CACHE_ROOT, settings.ICON_CACHE_MAX_BYTES)
+    return _cache
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Pillow releases the GIL while resizing and encoding
+            _executor = ThreadPoolExecutor(max_workers=settings.ICON_WORKERS, thread_name_prefix='icons')
+    return _executor
+
+
+def _generate(storage, name, digest, variants):
+    """Render variants [(size, fmt)] of one source image into the cache"""
+    cache = get_cache()
+    with storage.open(name, 'rb') as f:
+        source = f.read()
+    for size, fmt in variants:
+        path = cache.path(digest, size, fmt)
+        if not os.path.exists(path):
+            cache.put(path, render_variant(source, size, fmt))
+
+
+def _submit(storage, name, digest, size, fmt):
+    """Future for one variant, shared with any request already generating it"""
+    key = (digest, size, fmt)
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is not None:
+            return future
+        future = _inflight[key] = _get_executor().submit(_generate, storage, name, digest, [(size, fmt)])
+
+    def done(_):
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+    # Outside the lock - the callback runs right away if the job has already finished
+    future.add_done_callback(done)
+    return future
+
+
+def all_variants():
+    return [(size, fmt) for size in settings.ICON_SIZES for fmt in FORMATS]
+
+
+def pregenerate(category):
+    """Queue every variant of a category's icon (called when one is uploaded)"""
+    if category.icon and category.icon_hash:
+        _get_executor().submit(_generate, category.icon.storage, category.icon.name, category.icon_hash, all_variants())
+
+
+def open_variant(category, size, fmt):
+    """
+    Open one variant of a category's icon, generating it if needed
+
+    Returns an open binary file, or None when the category has no icon.
+    Raises UndecodableIcon when the source can't be decoded, and OSError when
+    it can't be read.
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    if not category.icon or not category.icon_hash:
+        return None
+    if category.icon_hash in _undecodable:
+        raise UndecodableIcon(category.icon_hash)
+    cache = get_cache()
+    path = cache.path(category.icon_hash, size, fmt)
+    for _ in range(2):
+        f = cache.open(path)
+        if f is not None:
+            return f
+        try:
+            _submit(category.icon.storage, category.icon.name, category.icon_hash, size, fmt).result()
+        except (Image.DecompressionBombError, UnidentifiedImageError) as e:
+            # A new upload gets a new hash, so this never needs forgetting
+            logger.warning('Icon %s (%s) cannot be decoded: %s', category.icon.name, category.icon_hash, e)
+            _undecodable.add(category.icon_hash)
+            raise UndecodableIcon(category.icon_hash) from e
+    # Evicted again before it could be read
+    return None
+
+
+def variant_urls(category, build_url):
+    """
+    {size: {format: url}} for a category's icon ({} without one)
+
+    build_url(slug, size, fmt) returns the variant endpoint URL; the icon
+    hash is added as a version so the URL changes with the image.
+    """
+    if not category.icon or not category.icon_hash:
+        return {}
+    version = category.icon_hash[:12]
+    return {
+        str(size): {fmt: f'{build_url(category.slug, size, fmt)}?v={version}' for fmt in FORMATS}
+        for size in settings.ICON_SIZES
+    }
@@ -0,0 +1,143 @@
+"""
+Sune TV - Background bulk jobs
+A small DB-backed queue so admin bulk actions don't run inside the request
+
+Queueing a job copies the IDs of the selected streams into BulkJobTarget
+with one INSERT ... SELECT, so they never pass through the request. The
+runner works through them in ID order. Every batch checks that the job is
+still held by the runner that claimed it, so a runner whose job was taken
+over as stale stops.
+"""
+
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .db import serialized_write
+
+# Field changes applied to the selected streams by each bulk action
+BULK_ACTIONS = {
+    'make_featured': {'is_featured': True},
+    'remove_featured': {'is_featured': False},
+    'activate': {'is_active': True},
+    'deactivate': {'is_active': False},
+}
+
+# Post-batch hook, sent after each committed batch with
+# sender=Stream, ids=[...] and changes={field: value}
+bulk_update_applied = Signal()
+
+
+def enqueue(action, queryset):
+    """Queue a bulk action for the streams in queryset and return the job"""
+    from .models import BulkJob, BulkJobTarget
+
+    if action not in BULK_ACTIONS:
+        raise ValueError(f'Unknown bulk action: {action}')
+
+    selection = queryset.order_by().values('pk')
+    sql, params = selection.query.get_compiler(using=queryset.db).as_sql()
+    connection = connections[queryset.db]
+    quote = connection.ops.quote_name
+    with serialized_write(queryset.db):
+        job = BulkJob.objects.create(action=action)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {quote(BulkJobTarget._meta.db_table)} ({quote("job_id")}, {quote("stream_id")}) '
+                f'SELECT DISTINCT %s, selection.* FROM ({sql}) selection',
+                [job.pk, *params],
+            )
+            job.total = cursor.rowcount
+        job.save(update_fields=['total'])
+    return job
+
+
+class JobTakenOver(Exception):
+    """The job was claimed by another runner after this one stalled"""
+
+
+def claim_next_job():
+    """
+    Take the oldest pending job, or a running job whose runner stopped
+    making progress. Returns None when the queue is empty.
+    """
+    from .models import BulkJob
+
+    stale_before = timezone.now() - timedelta(seconds=settings.BULK_JOB_STALE_AFTER)
+    claimable = (
+        Q(status=BulkJob.STATUS_PENDING) |
+        Q(status=BulkJob.STATUS_RUNNING, updated_at__lt=stale_before)
+    )
+
+    for job in BulkJob.objects.filter(claimable).order_by('created_at')[:10]:
+        # Claiming is a conditional UPDATE, so two runners can't take the same job
+        claimed = BulkJob.objects.filter(claimable, pk=job.pk).update(
+            status=BulkJob.STATUS_RUNNING,
+            runner=uuid.uuid4().hex,
+            started_at=job.started_at or timezone.now(),
+            updated_at=timezone.now(),
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def _batches(job, batch_size):
+    """Lists of stream IDs still to process, ascending, read one batch at a time"""
+    from .models import BulkJobTarget
+
+    targets = BulkJobTarget.objects.filter(job=job).order_by('stream_id').values_list('stream_id', flat=True)
+    while batch := list(targets.filter(stream_id__gt=job.last_id)[:batch_size]):
+        yield batch
+
+
+def _update_held(job, **fields):
+    """Save fields on the job if this runner still holds it, or raise JobTakenOver"""
+    from .models import BulkJob
+
+    fields['updated_at'] = timezone.now()
+    if not BulkJob.objects.filter(pk=job.pk, runner=job.runner).update(**fields):
+        raise JobTakenOver(f'Job #{job.pk} was taken over by another runner')
+    for name, value in fields.items():
+        setattr(job, name, value)
+
+
+def run_job(job, batch_size=None, log=None):
+    """
+    Apply a job's changes in batches, resuming after job.last_id
+
+    Each batch and its progress update commit together, so a crashed runner
+    picks up at the first unprocessed batch. Raises JobTakenOver, without
+    touching the batch, once another runner has claimed the job.
+    """
+    from .models import BulkJob, Stream
+
+    batch_size = batch_size or settings.BULK_JOB_BATCH_SIZE
+    changes = BULK_ACTIONS[job.action]
+
+    try:
+        for batch in _batches(job, batch_size):
+            started = time.monotonic()
+            with serialized_write():
+                # Job row first, so a takeover waits for (or aborts) this batch
+                _update_held(job, processed=job.processed + len(batch), last_id=batch[-1])
+                Stream.objects.filter(pk__in=batch).update(**changes, updated_at=timezone.now())
+            if log:
+                log(f'Job #{job.pk}: {job.processed}/{job.total} '
+                    f'(batch held the write lock for {(time.monotonic() - started) * 1000:.1f} ms)')
+            bulk_update_applied.send(sender=Stream, ids=batch, changes=changes)
+    except JobTakenOver:
+        raise
+    except Exception as exc:
+        _update_held(job, status=BulkJob.STATUS_FAILED, error=str(exc), finished_at=timezone.now())
+        raise
+
+    _update_held(job, status=BulkJob.STATUS_COMPLETED, finished_at=timezone.now())
+    return job
@@ -0,0 +1,52 @@
+"""
+Sune TV - Personalised feed maintenance
+Backfills feeds for recently active devices and evicts idle ones
+
+Run with: python manage.py build_device_feeds [--days 7] [--evict-only]
+"""
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from streams.feeds import evict_inactive_feeds, rebuild_device_feed
+from streams.models import WatchHistory
+from streams.sharding import get_shards
+
+
+class Command(BaseCommand):
+    help = 'Rebuild personalised feeds for active devices and evict idle ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=7,
+            help='Rebuild feeds for devices with watch events in this many days',
+        )
+        parser.add_argument(
+            '--evict-only',
+            action='store_true',
+            help='Only evict idle feeds',
+        )
+
+    def handle(self, *args, **options):
+        if not options['evict_only']:
+            since = timezone.now() - timedelta(days=options['days'])
+            rebuilt = 0
+            for alias in get_shards():
+                devices = (
+                    WatchHistory.objects.using(alias)
+                    .filter(watched_at__gte=since)
+                    .order_by()
+                    .values_list('device_id', flat=True)
+                    .distinct()
+                )
+                for device_id in devices.iterator(chunk_size=2000):
+                    rebuild_device_feed(device_id)
+                    rebuilt += 1
+            self.stdout.write(f'Rebuilt {rebuilt} feed(s).')
+
+        evicted = evict_inactive_feeds()
+        self.stdout.write(self.style.SUCCESS(f'Evicted {evicted} idle feed(s).'))
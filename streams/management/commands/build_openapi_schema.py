@@ -0,0 +1,50 @@
+"""
+Sune TV - Build the OpenAPI schema
+Generates the schema once at deploy time so /swagger.json never introspects
+the viewsets at request time
+
+Run with: python manage.py build_openapi_schema [--url https://api.sunetv.com]
+"""
+
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Write the OpenAPI schema to OPENAPI_SCHEMA_PATH'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            default=None,
+            help='Public base URL of the API, used for the schema host and scheme',
+        )
+        parser.add_argument(
+            '--output',
+            default=settings.OPENAPI_SCHEMA_PATH,
+            help='Where to write the schema (default: OPENAPI_SCHEMA_PATH)',
+        )
+
+    def handle(self, *args, **options):
+        from drf_yasg.codecs import OpenAPICodecJson
+        from drf_yasg.generators import OpenAPISchemaGenerator
+
+        from sune_backend.openapi import api_info
+
+        generator = OpenAPISchemaGenerator(info=api_info, url=options['url'])
+        schema = generator.get_schema(request=None, public=True)
+        body = OpenAPICodecJson(validators=[], pretty=False).encode(schema)
+
+        # Write then rename so workers never serve a half-written file
+        output = options['output']
+        directory = os.path.dirname(output) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, output)
+
+        self.stdout.write(self.style.SUCCESS(f'Wrote OpenAPI schema ({len(body)} bytes) to {output}'))
@@ -0,0 +1,148 @@
+"""
+Sune TV - Check stream and thumbnail URLs
+Records status, latency and errors per stream in StreamHealth, and can queue
+a bulk job to deactivate streams whose URL keeps failing
+
+Run with: python manage.py check_stream_urls [--streams 1,2,3] [--include-inactive]
+              [--concurrency 200] [--per-host 8] [--timeout 10] [--skip-thumbnails]
+              [--deactivate-dead [--failures 2]]
+
+Deactivation goes through the bulk job queue (python manage.py run_jobs).
+"""
+
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from streams.db import serialized_write
+from streams.jobs import enqueue
+from streams.linkcheck import CheckResult, check_streams
+from streams.models import Stream, StreamHealth
+
+HEALTH_FIELDS = [
+    'url_status',
+    'url_latency_ms',
+    'url_error',
+    'thumbnail_status',
+    'thumbnail_latency_ms',
+    'thumbnail_error',
+    'is_dead',
+    'failures',
+    'checked_at',
+]
+
+
+class Command(BaseCommand):
+    help = 'Check stream and thumbnail URLs concurrently and record their health'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--streams',
+            default=None,
+            help='Comma-separated stream IDs to check (default: every active stream)',
+        )
+        parser.add_argument('--include-inactive', action='store_true', help='Check inactive streams too')
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=settings.STREAM_CHECK_CONCURRENCY,
+            help='Requests in flight at once',
+        )
+        parser.add_argument(
+            '--per-host',
+            type=int,
+            default=settings.STREAM_CHECK_PER_HOST,
+            help='Requests in flight to any one host',
+        )
+        parser.add_argument(
+            '--timeout',
+            type=float,
+            default=settings.STREAM_CHECK_TIMEOUT,
+            help='Seconds allowed per request, from connecting to the response headers',
+        )
+        parser.add_argument('--skip-thumbnails', action='store_true', help='Only check stream URLs')
+        parser.add_argument(
+            '--deactivate-dead',
+            action='store_true',
+            help='Queue a bulk job deactivating streams whose URL failed --failures checks in a row',
+        )
+        parser.add_argument('--failures', type=int, default=2, help='Consecutive failed checks before deactivating')
+
+    def handle(self, *args, **options):
+        streams = Stream.objects.all() if options['include_inactive'] else Stream.objects.filter(is_active=True)
+        if options['streams']:
+            try:
+                stream_ids = [int(pk) for pk in options['streams'].split(',') if pk.strip()]
+            except ValueError:
+                raise CommandError('--streams must be a comma-separated list of IDs')
+            streams = streams.filter(pk__in=stream_ids)
+        if options['concurrency'] < 1 or options['per_host'] < 1:
+            raise CommandError('--concurrency and --per-host must be at least 1')
+
+        targets = list(streams.order_by('pk').values_list('pk', 'url', 'thumbnail'))
+        previous_failures = dict(
+            StreamHealth.objects.filter(failures__gt=0).values_list('stream_id', 'failures')
+        )
+        totals = {'checked': 0, 'dead': 0, 'dead_thumbnails': 0}
+
+        def save_results(results):
+            now = timezone.now()
+            rows = []
+            for stream_id, url_result, thumbnail_result in results:
+                dead = not url_result.ok
+                if thumbnail_result is None:
+                    thumbnail_result = CheckResult()
+                else:
+                    totals['dead_thumbnails'] += not thumbnail_result.ok
+                rows.append(StreamHealth(
+                    stream_id=stream_id,
+                    url_status=url_result.status,
+                    url_latency_ms=url_result.latency_ms,
+                    url_error=url_result.error,
+                    thumbnail_status=thumbnail_result.status,
+                    thumbnail_latency_ms=thumbnail_result.latency_ms,
+                    thumbnail_error=thumbnail_result.error,
+                    is_dead=dead,
+                    failures=previous_failures.get(stream_id, 0) + 1 if dead else 0,
+                    checked_at=now,
+                ))
+                totals['checked'] += 1
+                totals['dead'] += dead
+            with serialized_write():
+                StreamHealth.objects.bulk_create(
+                    rows, update_conflicts=True, unique_fields=['stream'], update_fields=HEALTH_FIELDS
+                )
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{totals["checked"]}/{len(targets)} checked, {totals["dead"]} dead')
+
+        started = time.monotonic()
+        asyncio.run(check_streams(
+            targets,
+            sync_to_async(save_results),
+            concurrency=options['concurrency'],
+            per_host=options['per_host'],
+            timeout=options['timeout'],
+            check_thumbnails=not options['skip_thumbnails'],
+        ))
+        elapsed = time.monotonic() - started
+
+        urls = len(targets) * (1 if options['skip_thumbnails'] else 2)
+        self.stdout.write(self.style.SUCCESS(
+            f'Checked {totals["checked"]} stream(s) in {elapsed:.1f}s '
+            f'({urls / elapsed if elapsed else urls:.0f} URLs/s): '
+            f'{totals["dead"]} dead, {totals["dead_thumbnails"]} dead thumbnail(s)'
+        ))
+
+        if options['deactivate_dead']:
+            dead = Stream.objects.filter(is_active=True, health__failures__gte=options['failures'])
+            if options['streams']:
+                dead = dead.filter(pk__in=stream_ids)
+            if dead.exists():
+                job = enqueue('deactivate', dead)
+                self.stdout.write(f'Queued job {job.pk} to deactivate {job.total} stream(s) (python manage.py run_jobs)')
+            else:
+                self.stdout.write(f'No active streams have failed {options["failures"]} check(s) in a row')
@@ -0,0 +1,34 @@
+"""
+Sune TV - Issue a profiling token
+Requests sent with the token in the X-Profile-Token header are always profiled
+(needs PROFILING_ENABLED)
+
+Run with: python manage.py profiling_token <staff username>
+"""
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from streams.profiling import TOKEN_HEADER, make_token
+
+
+class Command(BaseCommand):
+    help = 'Print a signed token that forces profiling of API requests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='Staff user the token is issued to')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        try:
+            user = User.objects.get(**{User.USERNAME_FIELD: options['username']}, is_staff=True)
+        except User.DoesNotExist:
+            raise CommandError(f'No staff user named {options["username"]}')
+
+        if not settings.PROFILING_ENABLED:
+            self.stderr.write(self.style.WARNING('PROFILING_ENABLED is off; the token has no effect until it is set'))
+
+        token = make_token(user.get_username())
+        self.stdout.write(f'{TOKEN_HEADER}: {token}')
+        self.stdout.write(f'Valid for {settings.PROFILING_TOKEN_MAX_AGE} seconds')
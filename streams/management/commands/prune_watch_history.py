@@ -0,0 +1,113 @@
+"""
+Sune TV - Watch history retention
+Rolls raw watch events up into daily per-stream aggregates, then deletes them
+one day at a time. The table is not partitioned: each day is a DELETE over a
+watched_at index range, so a run costs time in proportion to the rows it
+expires rather than dropping a partition.
+
+Run with: python manage.py prune_watch_history [--days 90] [--dry-run]
+"""
+
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, Min, Q, Sum
+from django.utils import timezone
+
+from streams.db import serialized_write
+from streams.models import WatchHistory, WatchHistoryDaily
+from streams.sharding import fan_out, get_shards
+
+
+class Command(BaseCommand):
+    help = 'Roll up and delete watch history older than the retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.WATCH_HISTORY_RETENTION_DAYS,
+            help='Keep raw events for this many days (default: WATCH_HISTORY_RETENTION_DAYS)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report the days that would be rolled up without changing anything',
+        )
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        cutoff = today - timedelta(days=options['days'])
+
+        shard_oldest = fan_out(
+            lambda alias: WatchHistory.objects.using(alias).aggregate(oldest=Min('watched_at'))['oldest']
+        )
+        oldest = min((value for value in shard_oldest if value is not None), default=None)
+        if oldest is None or timezone.localdate(oldest) >= cutoff:
+            self.stdout.write('Nothing to prune.')
+            return
+
+        day = timezone.localdate(oldest)
+        total_events = 0
+        while day < cutoff:
+            if options['dry_run']:
+                count = sum(fan_out(lambda alias: self._events_on(day, alias).count()))
+                if count:
+                    self.stdout.write(f'{day}: {count} event(s) would be rolled up')
+            else:
+                count = sum(self.rollup_day(day, alias) for alias in get_shards())
+                if count:
+                    self.stdout.write(f'{day}: rolled up {count} event(s)')
+            total_events += count
+            day += timedelta(days=1)
+
+        verb = 'Would prune' if options['dry_run'] else 'Pruned'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {total_events} event(s) older than {cutoff}.'))
+
+    def _events_on(self, day, alias):
+        """Raw events for one calendar day on one shard (range scan on the watched_at index)"""
+        start = timezone.make_aware(datetime.combine(day, time.min))
+        return WatchHistory.objects.using(alias).filter(
+            watched_at__gte=start,
+            watched_at__lt=start + timedelta(days=1),
+        )
+
+    def rollup_day(self, day, alias):
+        """
+        Fold one day of a shard's events into WatchHistoryDaily and delete them
+
+        On the default database both happen in the same transaction so an
+        interrupted run never counts a day twice. On other shards the delete
+        commits straight after the rollup.
+        """
+        events = self._events_on(day, alias)
+        with serialized_write(alias), serialized_write():
+            totals = (
+                events.order_by()
+                .values('stream_id')
+                .annotate(
+                    views=Count('id'),
+                    total_seconds=Sum('watch_duration'),
+                    completions=Count('id', filter=Q(completed=True)),
+                )
+            )
+            for row in totals:
+                updated = WatchHistoryDaily.objects.filter(
+                    stream_id=row['stream_id'],
+                    date=day,
+                ).update(
+                    views=F('views') + row['views'],
+                    total_seconds=F('total_seconds') + (row['total_seconds'] or 0),
+                    completions=F('completions') + row['completions'],
+                )
+                if not updated:
+                    WatchHistoryDaily.objects.create(
+                        stream_id=row['stream_id'],
+                        date=day,
+                        views=row['views'],
+                        total_seconds=row['total_seconds'] or 0,
+                        completions=row['completions'],
+                    )
+            deleted, _ = events.delete()
+        return deleted
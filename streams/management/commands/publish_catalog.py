@@ -0,0 +1,47 @@
+"""
+Sune TV - Publish the static catalog
+Renders catalog payloads to precompressed JSON files for nginx/CDN serving
+
+Run with: python manage.py publish_catalog [--streams 1,2,3] [--root /srv/catalog]
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from streams.publisher import CatalogPublisher
+
+
+class Command(BaseCommand):
+    help = 'Render catalog JSON files to CATALOG_PUBLISH_ROOT'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--streams',
+            default=None,
+            help='Comma-separated stream IDs to republish (default: everything)',
+        )
+        parser.add_argument(
+            '--root',
+            default=None,
+            help='Output directory (default: CATALOG_PUBLISH_ROOT)',
+        )
+
+    def handle(self, *args, **options):
+        stream_ids = None
+        if options['streams']:
+            try:
+                stream_ids = [int(pk) for pk in options['streams'].split(',') if pk.strip()]
+            except ValueError:
+                raise CommandError('--streams must be a comma-separated list of IDs')
+
+        started = time.monotonic()
+        publisher = CatalogPublisher(root=options['root']).publish(stream_ids)
+        elapsed = time.monotonic() - started
+
+        rendered = publisher.written + publisher.unchanged
+        self.stdout.write(self.style.SUCCESS(
+            f'Published version {publisher.manifest["version"]} to {publisher.root}: '
+            f'{publisher.written} file(s) written, {publisher.unchanged} unchanged, '
+            f'{elapsed:.2f}s ({rendered / elapsed if elapsed else rendered:.0f} payloads/s)'
+        ))
@@ -0,0 +1,20 @@
+"""
+Sune TV - Rebuild engagement stats
+Recomputes stream and category aggregates from the watch history and its daily rollups
+
+Run with: python manage.py rebuild_stats
+"""
+
+from django.core.management.base import BaseCommand
+
+from streams.analytics import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute stream and category engagement stats from watch history'
+
+    def handle(self, *args, **options):
+        streams, categories = rebuild_stats()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt stats for {streams} stream(s) and {categories} category(ies).'
+        ))
@@ -0,0 +1,127 @@
+"""
+Sune TV - Move watch history between shards
+After WATCH_HISTORY_SHARDS changes, moves every device's events to the shard
+the current list assigns it. Only the hash slot ranges whose owner changed
+move.
+
+Run with: python manage.py reshard_watch_history --from default [--batch-size 2000] [--dry-run]
+
+Steps:
+1. Run `migrate --database <alias>` for each new shard.
+2. Deploy the new WATCH_HISTORY_SHARDS. New events go straight to their new
+   shard from then on.
+3. Run this command with the previous list, while the site stays up.
+Until its range has moved, a device's older history is missing from reads.
+Re-running is safe: rows already on the right shard are left alone, and
+events an interrupted run copied but did not delete are not copied again.
+"""
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from streams.db import serialized_write
+from streams.models import WatchHistory
+from streams.sharding import SLOTS, copy_history, get_shards, shard_for, shard_for_slot
+
+
+class Command(BaseCommand):
+    help = 'Move watch history to the shards set in WATCH_HISTORY_SHARDS'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--from',
+            dest='old_shards',
+            required=True,
+            help='Comma-separated WATCH_HISTORY_SHARDS before the change',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Events read and moved per batch (default: 2000)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report what would move without changing anything',
+        )
+
+    def handle(self, *args, **options):
+        old_shards = [alias.strip() for alias in options['old_shards'].split(',') if alias.strip()]
+        unknown = [alias for alias in old_shards if alias not in settings.DATABASES]
+        if unknown:
+            raise CommandError(f'Unknown database alias(es): {", ".join(unknown)}')
+        new_shards = get_shards()
+
+        ranges = self._moved_ranges(old_shards, new_shards)
+        if not ranges:
+            self.stdout.write('Shard assignment is unchanged, nothing to move.')
+            return
+        for first, last, source, target in ranges:
+            self.stdout.write(f'Slots {first}-{last}: {source} -> {target}')
+
+        total = 0
+        for source in dict.fromkeys(old_shards):
+            moved = self.move_from(source, new_shards, options['batch_size'], options['dry_run'])
+            if moved:
+                verb = 'would move' if options['dry_run'] else 'moved'
+                self.stdout.write(f'{source}: {verb} {moved} event(s)')
+            total += moved
+
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {total} event(s).'))
+
+    def _moved_ranges(self, old_shards, new_shards):
+        """Contiguous slot ranges whose shard changed, as (first, last, source, target)"""
+        ranges = []
+        for slot in range(SLOTS):
+            source = shard_for_slot(slot, old_shards)
+            target = shard_for_slot(slot, new_shards)
+            if source == target:
+                continue
+            if ranges and ranges[-1][1] == slot - 1 and ranges[-1][2:] == (source, target):
+                ranges[-1] = (ranges[-1][0], slot, source, target)
+            else:
+                ranges.append((slot, slot, source, target))
+        return ranges
+
+    def move_from(self, source, new_shards, batch_size, dry_run):
+        """
+        Move the events on one database that now belong elsewhere
+
+        Each batch is copied to its target shards before it is deleted from
+        the source, so an interrupted run never loses events. Copies of the
+        last batch it left on the target are skipped by copy_history() when
+        the command is run again.
+        """
+        moved = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                WatchHistory.objects.using(source)
+                .filter(pk__gt=last_pk)
+                .order_by('pk')[:batch_size]
+            )
+            if not batch:
+                return moved
+            last_pk = batch[-1].pk
+
+            by_target = defaultdict(list)
+            for event in batch:
+                target = shard_for(event.device_id, new_shards)
+                if target != source:
+                    by_target[target].append(event)
+            if not by_target:
+                continue
+
+            moving = [event.pk for events in by_target.values() for event in events]
+            moved += len(moving)
+            if dry_run:
+                continue
+            for target, events in by_target.items():
+                with serialized_write(target):
+                    copy_history(events, target)
+            with serialized_write(source):
+                WatchHistory.objects.using(source).filter(pk__in=moving).delete()
@@ -0,0 +1,63 @@
+"""
+Sune TV - Background job runner
+Processes bulk jobs queued from the admin; no external broker needed
+
+Run with: python manage.py run_jobs [--once] [--interval 2] [--batch-size 500]
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from streams.jobs import JobTakenOver, claim_next_job, run_job
+
+
+class Command(BaseCommand):
+    help = 'Process queued bulk jobs in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once the queue is empty instead of polling',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=2.0,
+            help='Seconds to wait between polls when the queue is empty',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Streams updated per transaction (default: BULK_JOB_BATCH_SIZE)',
+        )
+
+    def handle(self, *args, **options):
+        log = self.stdout.write if options['verbosity'] > 1 else None
+
+        while True:
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
+                continue
+
+            started = time.monotonic()
+            try:
+                run_job(job, batch_size=options['batch_size'], log=log)
+            except JobTakenOver as exc:
+                self.stderr.write(self.style.WARNING(f'{exc}; leaving it to that runner'))
+                continue
+            except Exception as exc:
+                self.stderr.write(self.style.ERROR(f'Job #{job.pk} failed: {exc}'))
+                continue
+
+            elapsed = time.monotonic() - started
+            rate = job.total / elapsed if elapsed else job.total
+            self.stdout.write(self.style.SUCCESS(
+                f'Job #{job.pk} ({job.action}) completed: {job.total} stream(s) '
+                f'in {elapsed:.2f}s ({rate:.0f}/s)'
+            ))
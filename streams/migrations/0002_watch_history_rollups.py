@@ -0,0 +1,45 @@
+# Generated by Django 6.0.2 on 2026-10-19 01:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WatchHistoryDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('total_seconds', models.BigIntegerField(default=0, help_text='Seconds watched')),
+                ('completions', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Daily Watch Rollup',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='watchhistory',
+            index=models.Index(fields=['device_id', '-watched_at'], name='streams_wat_device__a67e2c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='watchhistory',
+            index=models.Index(fields=['watched_at'], name='streams_wat_watched_d80719_idx'),
+        ),
+        migrations.AddField(
+            model_name='watchhistorydaily',
+            name='stream',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='streams.stream'),
+        ),
+        migrations.AddConstraint(
+            model_name='watchhistorydaily',
+            constraint=models.UniqueConstraint(fields=('stream', 'date'), name='unique_stream_daily_rollup'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 6.0.2 on 2026-10-19 01:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0002_watch_history_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('plays', models.PositiveIntegerField(default=0)),
+                ('total_seconds', models.BigIntegerField(default=0, help_text='Seconds watched')),
+                ('completions', models.PositiveIntegerField(default=0)),
+                ('unique_devices', models.PositiveIntegerField(default=0, help_text='Estimated distinct devices')),
+                ('devices_sketch', models.BinaryField(default=b'')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='streams.category')),
+            ],
+            options={
+                'verbose_name_plural': 'Category Stats',
+            },
+        ),
+        migrations.CreateModel(
+            name='StreamStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('plays', models.PositiveIntegerField(default=0)),
+                ('total_seconds', models.BigIntegerField(default=0, help_text='Seconds watched')),
+                ('completions', models.PositiveIntegerField(default=0)),
+                ('unique_devices', models.PositiveIntegerField(default=0, help_text='Estimated distinct devices')),
+                ('devices_sketch', models.BinaryField(default=b'')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('stream', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='streams.stream')),
+            ],
+            options={
+                'verbose_name_plural': 'Stream Stats',
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 6.0.2 on 2026-10-19 01:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0004_bulk_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StreamSimilarity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('source', models.CharField(choices=[('cowatch', 'Co-watch similarity'), ('metadata', 'Category and people overlap')], default='cowatch', max_length=10)),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='streams.stream')),
+                ('stream', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_streams', to='streams.stream')),
+            ],
+            options={
+                'verbose_name_plural': 'Stream Similarities',
+                'ordering': ['stream', 'rank'],
+                'constraints': [models.UniqueConstraint(fields=('stream', 'rank'), name='unique_stream_similarity_rank')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 6.0.2 on 2026-10-19 01:45
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0005_stream_similarity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceFeed',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(help_text='Android device ID', max_length=255, unique=True)),
+                ('category_affinity', models.JSONField(default=dict, help_text='Seconds watched per category ID')),
+                ('ranked_categories', models.JSONField(default=list, help_text='Category IDs, most watched first')),
+                ('completed_streams', models.JSONField(default=list, help_text='Recently completed stream IDs')),
+                ('last_seen_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0.2 on 2026-10-19 01:50
+
+from django.db import migrations, models
+
+from streams.utils import parse_duration
+
+
+def backfill_duration_seconds(apps, schema_editor):
+    """Parse duration for existing streams in batches"""
+    Stream = apps.get_model('streams', 'Stream')
+    batch = []
+    for stream in Stream.objects.only('id', 'duration').iterator(chunk_size=2000):
+        stream.duration_seconds = parse_duration(stream.duration)
+        if stream.duration_seconds is not None:
+            batch.append(stream)
+        if len(batch) >= 2000:
+            Stream.objects.bulk_update(batch, ['duration_seconds'])
+            batch = []
+    if batch:
+        Stream.objects.bulk_update(batch, ['duration_seconds'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0006_device_feeds'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stream',
+            name='duration_seconds',
+            field=models.PositiveIntegerField(blank=True, db_index=True, editable=False, help_text='Parsed from duration on save, for filtering and sorting', null=True),
+        ),
+        migrations.RunPython(backfill_duration_seconds, migrations.RunPython.noop),
+    ]
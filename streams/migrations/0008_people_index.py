@@ -0,0 +1,110 @@
+# Generated by Django 6.0.2 on 2026-10-19 01:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils.text import slugify
+
+from streams.utils import split_people
+
+
+def backfill_people(apps, schema_editor):
+    """Parse cast and director for existing streams into credits"""
+    Stream = apps.get_model('streams', 'Stream')
+    Person = apps.get_model('streams', 'Person')
+    StreamCast = apps.get_model('streams', 'StreamCast')
+    StreamDirector = apps.get_model('streams', 'StreamDirector')
+
+    person_ids = {}
+
+    def person_id(name):
+        slug = slugify(name, allow_unicode=True)[:255]
+        if not slug:
+            return None
+        if slug not in person_ids:
+            person, _ = Person.objects.get_or_create(slug=slug, defaults={'name': name})
+            person_ids[slug] = person.pk
+        return person_ids[slug]
+
+    cast_credits = []
+    director_credits = []
+    for stream in Stream.objects.only('id', 'cast', 'director').iterator(chunk_size=2000):
+        seen = set()
+        for name in split_people(stream.cast):
+            pk = person_id(name)
+            if pk and pk not in seen:
+                seen.add(pk)
+                cast_credits.append(StreamCast(stream_id=stream.pk, person_id=pk, billing_order=len(seen) - 1))
+        for pk in {person_id(name) for name in split_people(stream.director)} - {None}:
+            director_credits.append(StreamDirector(stream_id=stream.pk, person_id=pk))
+
+        if len(cast_credits) >= 5000:
+            StreamCast.objects.bulk_create(cast_credits)
+            cast_credits = []
+        if len(director_credits) >= 5000:
+            StreamDirector.objects.bulk_create(director_credits)
+            director_credits = []
+
+    StreamCast.objects.bulk_create(cast_credits)
+    StreamDirector.objects.bulk_create(director_credits)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0007_stream_duration_seconds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Person',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('slug', models.SlugField(allow_unicode=True, max_length=255, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name_plural': 'People',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='StreamCast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('billing_order', models.PositiveSmallIntegerField(default=0)),
+                ('person', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cast_credits', to='streams.person')),
+                ('stream', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cast_credits', to='streams.stream')),
+            ],
+            options={
+                'ordering': ['stream', 'billing_order'],
+            },
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='cast_members',
+            field=models.ManyToManyField(blank=True, related_name='cast_streams', through='streams.StreamCast', to='streams.person'),
+        ),
+        migrations.CreateModel(
+            name='StreamDirector',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('person', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='director_credits', to='streams.person')),
+                ('stream', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='director_credits', to='streams.stream')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='directors',
+            field=models.ManyToManyField(blank=True, related_name='directed_streams', through='streams.StreamDirector', to='streams.person'),
+        ),
+        migrations.AddConstraint(
+            model_name='streamcast',
+            constraint=models.UniqueConstraint(fields=('stream', 'person'), name='unique_stream_cast_member'),
+        ),
+        migrations.AddConstraint(
+            model_name='streamdirector',
+            constraint=models.UniqueConstraint(fields=('stream', 'person'), name='unique_stream_director'),
+        ),
+        migrations.RunPython(backfill_people, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 6.0.2 on 2026-10-19 01:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0008_people_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileReport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.CharField(max_length=500)),
+                ('view_name', models.CharField(db_index=True, help_text='e.g. StreamViewSet.by_category', max_length=200)),
+                ('status_code', models.PositiveSmallIntegerField()),
+                ('duration_ms', models.FloatField()),
+                ('sql_count', models.PositiveIntegerField(default=0)),
+                ('sql_time_ms', models.FloatField(default=0)),
+                ('top_functions', models.JSONField(default=list, help_text='Slowest functions by cumulative time')),
+                ('queries', models.JSONField(default=list, help_text='Slowest SQL statements')),
+                ('stats_file', models.CharField(blank=True, help_text='Raw pstats file (snakeviz, flameprof)', max_length=500)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
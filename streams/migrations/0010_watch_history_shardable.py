@@ -0,0 +1,19 @@
+# Generated by Django 6.0.2 on 2026-10-19 01:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0009_profile_report'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='watchhistory',
+            name='stream',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='watch_history', to='streams.stream'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 6.0.2 on 2026-10-19 02:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0010_watch_history_shardable'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='watchhistory',
+            name='event_id',
+            field=models.CharField(blank=True, help_text='Client-generated ID, so retried events are only recorded once', max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='watchhistory',
+            constraint=models.UniqueConstraint(condition=models.Q(('event_id__isnull', False)), fields=('device_id', 'event_id'), name='unique_watch_event'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 6.0.2 on 2026-10-19 02:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0011_watch_event_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('positions', models.JSONField(default=dict)),
+                ('rows_exported', models.BigIntegerField(default=0, help_text='Total rows over all runs')),
+                ('last_file', models.CharField(blank=True, max_length=500)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
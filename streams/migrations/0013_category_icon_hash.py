@@ -0,0 +1,33 @@
+# Generated by Django 6.0.2 on 2026-10-19 02:13
+
+from django.db import migrations, models
+
+from streams.icons import file_digest
+
+
+def backfill_icon_hash(apps, schema_editor):
+    """Hash existing icons (categories whose file is missing keep no variants)"""
+    Category = apps.get_model('streams', 'Category')
+    for category in Category.objects.exclude(icon='').exclude(icon__isnull=True):
+        try:
+            with category.icon.open('rb') as f:
+                category.icon_hash = file_digest(f)
+        except OSError:
+            continue
+        category.save(update_fields=['icon_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0012_export_watermark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='icon_hash',
+            field=models.CharField(blank=True, editable=False, help_text='SHA-256 of the icon, addressing its resized variants', max_length=64),
+        ),
+        migrations.RunPython(backfill_icon_hash, migrations.RunPython.noop),
+    ]
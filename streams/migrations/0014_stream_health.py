@@ -0,0 +1,33 @@
+# Generated by Django 6.0.2 on 2026-10-19 02:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0013_category_icon_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StreamHealth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_status', models.PositiveSmallIntegerField(blank=True, help_text='HTTP status (empty when no response)', null=True)),
+                ('url_latency_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('url_error', models.CharField(blank=True, max_length=200)),
+                ('thumbnail_status', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('thumbnail_latency_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('thumbnail_error', models.CharField(blank=True, max_length=200)),
+                ('is_dead', models.BooleanField(db_index=True, default=False, help_text='Stream URL failed its latest check')),
+                ('failures', models.PositiveIntegerField(default=0, help_text='Consecutive failed checks of the stream URL')),
+                ('checked_at', models.DateTimeField()),
+                ('stream', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='health', to='streams.stream')),
+            ],
+            options={
+                'verbose_name_plural': 'Stream Health',
+            },
+        ),
+    ]
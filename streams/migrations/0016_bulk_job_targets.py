@@ -0,0 +1,34 @@
+# Generated by Django 6.0.2 on 2026-10-19 04:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0014_stream_health'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='bulkjob',
+            name='object_ids',
+        ),
+        migrations.AddField(
+            model_name='bulkjob',
+            name='runner',
+            field=models.CharField(blank=True, help_text='Token of the runner that claimed the job', max_length=32),
+        ),
+        migrations.CreateModel(
+            name='BulkJobTarget',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stream_id', models.BigIntegerField()),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='targets', to='streams.bulkjob')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('job', 'stream_id'), name='unique_bulk_job_target')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 6.0.2 on 2026-10-19 04:30
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streams', '0016_bulk_job_targets'),
+    ]
+
+    operations = [
+        # The column is unchanged; only the Python-side default is. Altering it
+        # for real would make SQLite rebuild the whole watch history table.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='watchhistory',
+                    name='watched_at',
+                    field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+                ),
+            ],
+        ),
+    ]
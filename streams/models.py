@@ -1,6 +1,12 @@
 from django.db import models
+from django.db.models import F
+from django.utils import timezone
 from django.utils.text import slugify
 
+from . import icons
+from .db import serialized_write
+from .utils import parse_duration
+
 
 class Category(models.Model):
     """
@@ -11,6 +17,10 @@ class Category(models.Model):
     slug = models.SlugField(max_length=100, unique=True, blank=True)
     description = models.TextField(blank=True)
     icon = models.ImageField(upload_to='categories/', blank=True, null=True)
+    icon_hash = models.CharField(
+        max_length=64, blank=True, editable=False,
+        help_text="SHA-256 of the icon, addressing its resized variants"
+    )
     order = models.IntegerField(default=0, help_text="Display order (lower numbers first)")
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -23,6 +33,12 @@ class Category(models.Model):
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
+        if not self.icon:
+            self.icon_hash = ''
+        elif not self.icon._committed:
+            # A new upload - hash it before it is written to storage
+            self.icon_hash = icons.file_digest(self.icon)
+            self._icon_uploaded = True
         super().save(*args, **kwargs)
     
     def __str__(self):
@@ -53,12 +69,33 @@ class Stream(models.Model):
     
     # Metadata
     duration = models.CharField(max_length=50, blank=True, help_text="e.g., '2h 15m' or '45m'")
+    duration_seconds = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        db_index=True,
+        editable=False,
+        help_text="Parsed from duration on save, for filtering and sorting"
+    )
     release_year = models.IntegerField(blank=True, null=True)
     rating = models.DecimalField(max_digits=3, decimal_places=1, blank=True, null=True, help_text="Rating out of 10")
     
     # Additional Info
     director = models.CharField(max_length=255, blank=True)
     cast = models.TextField(blank=True, help_text="Comma-separated list of actors")
+    
+    # Normalised from cast/director on save (see people.py)
+    cast_members = models.ManyToManyField(
+        'Person',
+        through='StreamCast',
+        related_name='cast_streams',
+        blank=True
+    )
+    directors = models.ManyToManyField(
+        'Person',
+        through='StreamDirector',
+        related_name='directed_streams',
+        blank=True
+    )
     language = models.CharField(max_length=50, blank=True, default="English")
     
     # Streaming Details
@@ -98,30 +135,353 @@ class Stream(models.Model):
         # Use banner as thumbnail fallback if not provided
         if not self.banner and self.thumbnail:
             self.banner = self.thumbnail
+        self.duration_seconds = parse_duration(self.duration)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'duration' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'duration_seconds'}
         super().save(*args, **kwargs)
     
     def __str__(self):
         return f"{self.title} ({self.category.name})"
     
     def increment_views(self):
-        """Increment view count"""
-        self.view_count += 1
-        self.save(update_fields=['view_count'])
+        """Increment view count atomically in the database"""
+        with serialized_write():
+            Stream.objects.filter(pk=self.pk).update(view_count=F('view_count') + 1)
+        self.refresh_from_db(fields=['view_count'])
 
 
 class WatchHistory(models.Model):
     """
     Track user watch history (optional - for future analytics)
     """
-    stream = models.ForeignKey(Stream, on_delete=models.CASCADE, related_name='watch_history')
+    # No database-level constraint: rows may live on a shard database without
+    # the streams table (see streams.sharding)
+    stream = models.ForeignKey(Stream, on_delete=models.CASCADE, related_name='watch_history', db_constraint=False)
     device_id = models.CharField(max_length=255, help_text="Android device ID")
-    watched_at = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add, so copies moved between shards keep their time
+    watched_at = models.DateTimeField(default=timezone.now, editable=False)
     watch_duration = models.IntegerField(default=0, help_text="Seconds watched")
     completed = models.BooleanField(default=False)
+    event_id = models.CharField(
+        max_length=64,
+        blank=True,
+        null=True,
+        help_text="Client-generated ID, so retried events are only recorded once"
+    )
     
     class Meta:
         ordering = ['-watched_at']
         verbose_name_plural = "Watch Histories"
+        indexes = [
+            models.Index(fields=['device_id', '-watched_at']),
+            models.Index(fields=['watched_at']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['device_id', 'event_id'],
+                condition=models.Q(event_id__isnull=False),
+                name='unique_watch_event',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.device_id} watched {self.stream.title}"
+
+
+class WatchHistoryDaily(models.Model):
+    """
+    Daily per-stream rollup of watch history
+    Raw events are folded in here before the retention policy deletes them
+    """
+    stream = models.ForeignKey(Stream, on_delete=models.CASCADE, related_name='daily_rollups')
+    date = models.DateField()
+    views = models.PositiveIntegerField(default=0)
+    total_seconds = models.BigIntegerField(default=0, help_text="Seconds watched")
+    completions = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-date']
+        verbose_name = "Daily Watch Rollup"
+        constraints = [
+            models.UniqueConstraint(fields=['stream', 'date'], name='unique_stream_daily_rollup'),
+        ]
+    
+    def __str__(self):
+        return f"{self.stream.title} on {self.date}"
+
+
+class EngagementStats(models.Model):
+    """
+    Running engagement totals, maintained incrementally as watch events arrive
+    Unique devices are estimated from a HyperLogLog sketch (see analytics.py)
+    """
+    plays = models.PositiveIntegerField(default=0)
+    total_seconds = models.BigIntegerField(default=0, help_text="Seconds watched")
+    completions = models.PositiveIntegerField(default=0)
+    unique_devices = models.PositiveIntegerField(default=0, help_text="Estimated distinct devices")
+    devices_sketch = models.BinaryField(default=b'', editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        abstract = True
+    
+    @property
+    def average_watch_duration(self):
+        """Average seconds watched per play"""
+        if not self.plays:
+            return 0
+        return round(self.total_seconds / self.plays, 1)
+    
+    @property
+    def completion_rate(self):
+        """Share of plays that were watched to the end"""
+        if not self.plays:
+            return 0
+        return round(self.completions / self.plays, 4)
+
+
+class StreamStats(EngagementStats):
+    """
+    Engagement aggregates for a single stream
+    """
+    stream = models.OneToOneField(Stream, on_delete=models.CASCADE, related_name='stats')
+    
+    class Meta:
+        verbose_name_plural = "Stream Stats"
+    
+    def __str__(self):
+        return f"Stats for {self.stream.title}"
+
+
+class CategoryStats(EngagementStats):
+    """
+    Engagement aggregates across all streams in a category
+    """
+    category = models.OneToOneField(Category, on_delete=models.CASCADE, related_name='stats')
+    
+    class Meta:
+        verbose_name_plural = "Category Stats"
+    
+    def __str__(self):
+        return f"Stats for {self.category.name}"
+
+
+class BulkJob(models.Model):
+    """
+    Background bulk update of streams, queued from admin actions
+    Processed in chunks by `python manage.py run_jobs`
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    
+    action = models.CharField(max_length=50)
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    last_id = models.BigIntegerField(default=0, help_text="Resume cursor - highest ID already processed")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    runner = models.CharField(max_length=32, blank=True, help_text="Token of the runner that claimed the job")
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"Job #{self.pk}: {self.action} ({self.status})"
+    
+    @property
+    def progress(self):
+        """Percentage of selected objects processed"""
+        if not self.total:
+            return 100
+        return min(100, round(100 * self.processed / self.total, 1))
+
+
+class BulkJobTarget(models.Model):
+    """
+    Stream selected for a bulk job
+    Copied from the selection inside the database when the job is queued
+    """
+    job = models.ForeignKey(BulkJob, on_delete=models.CASCADE, related_name='targets')
+    # No foreign key: a stream deleted before its batch runs is simply skipped
+    stream_id = models.BigIntegerField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'stream_id'], name='unique_bulk_job_target'),
+        ]
+    
+    def __str__(self):
+        return f"Job #{self.job_id}: stream {self.stream_id}"
+
+
+class StreamSimilarity(models.Model):
+    """
+    Precomputed "more like this" neighbours for a stream
+    Rebuilt offline by `python manage.py build_similar_streams`
+    """
+    SOURCE_COWATCH = 'cowatch'
+    SOURCE_METADATA = 'metadata'
+    SOURCE_CHOICES = [
+        (SOURCE_COWATCH, 'Co-watch similarity'),
+        (SOURCE_METADATA, 'Category and people overlap'),
+    ]
+    
+    stream = models.ForeignKey(Stream, on_delete=models.CASCADE, related_name='similar_streams')
+    similar = models.ForeignKey(Stream, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES, default=SOURCE_COWATCH)
+    
+    class Meta:
+        ordering = ['stream', 'rank']
+        verbose_name_plural = "Stream Similarities"
+        constraints = [
+            models.UniqueConstraint(fields=['stream', 'rank'], name='unique_stream_similarity_rank'),
+        ]
+    
+    def __str__(self):
+        return f"{self.stream_id} -> {self.similar_id} ({self.score:.3f})"
+
+
+class DeviceFeed(models.Model):
+    """
+    Compact personalisation state for one device's home feed
+    Updated incrementally from watch events, see feeds.py
+    """
+    device_id = models.CharField(max_length=255, unique=True, help_text="Android device ID")
+    category_affinity = models.JSONField(default=dict, help_text="Seconds watched per category ID")
+    ranked_categories = models.JSONField(default=list, help_text="Category IDs, most watched first")
+    completed_streams = models.JSONField(default=list, help_text="Recently completed stream IDs")
+    last_seen_at = models.DateTimeField(default=timezone.now, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Feed for {self.device_id}"
+
+
+class Person(models.Model):
+    """
+    Cast member or director, normalised from Stream.cast / Stream.director
+    """
+    name = models.CharField(max_length=255)
+    slug = models.SlugField(max_length=255, unique=True, allow_unicode=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['name']
+        verbose_name_plural = "People"
+    
+    def __str__(self):
+        return self.name
+
+
+class StreamCast(models.Model):
+    """
+    Cast credit for a stream, in billing order
+    """
+    stream = models.ForeignKey(Stream, on_delete=models.CASCADE, related_name='cast_credits')
+    person = models.ForeignKey(Person, on_delete=models.CASCADE, related_name='cast_credits')
+    billing_order = models.PositiveSmallIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['stream', 'billing_order']
+        constraints = [
+            models.UniqueConstraint(fields=['stream', 'person'], name='unique_stream_cast_member'),
+        ]
+    
+    def __str__(self):
+        return f"{self.person.name} in {self.stream.title}"
+
+
+class StreamDirector(models.Model):
+    """
+    Director credit for a stream
+    """
+    stream = models.ForeignKey(Stream, on_delete=models.CASCADE, related_name='director_credits')
+    person = models.ForeignKey(Person, on_delete=models.CASCADE, related_name='director_credits')
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['stream', 'person'], name='unique_stream_director'),
+        ]
+    
+    def __str__(self):
+        return f"{self.stream.title} directed by {self.person.name}"
+
+
+class ProfileReport(models.Model):
+    """
+    A profiled API request, recorded by streams.profiling.ProfilingMiddleware
+    The raw cProfile stats are kept on disk in a ring of PROFILING_MAX_REPORTS files
+    """
+    created_at = models.DateTimeField(auto_now_add=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    view_name = models.CharField(max_length=200, db_index=True, help_text="e.g. StreamViewSet.by_category")
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    sql_count = models.PositiveIntegerField(default=0)
+    sql_time_ms = models.FloatField(default=0)
+    top_functions = models.JSONField(default=list, help_text="Slowest functions by cumulative time")
+    queries = models.JSONField(default=list, help_text="Slowest SQL statements")
+    stats_file = models.CharField(max_length=500, blank=True, help_text="Raw pstats file (snakeviz, flameprof)")
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
+
+
+class ExportWatermark(models.Model):
+    """
+    Progress of incremental watch history exports (python manage.py export_watch_history --incremental)
+    positions holds the last exported WatchHistory ID for each shard database
+    """
+    name = models.CharField(max_length=100, unique=True)
+    positions = models.JSONField(default=dict)
+    rows_exported = models.BigIntegerField(default=0, help_text="Total rows over all runs")
+    last_file = models.CharField(max_length=500, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name} ({self.rows_exported} rows)"
+
+
+class StreamHealth(models.Model):
+    """
+    Latest reachability check of a stream's url and thumbnail
+    Updated by `python manage.py check_stream_urls`
+    """
+    stream = models.OneToOneField(Stream, on_delete=models.CASCADE, related_name='health')
+    url_status = models.PositiveSmallIntegerField(blank=True, null=True, help_text="HTTP status (empty when no response)")
+    url_latency_ms = models.PositiveIntegerField(blank=True, null=True)
+    url_error = models.CharField(max_length=200, blank=True)
+    thumbnail_status = models.PositiveSmallIntegerField(blank=True, null=True)
+    thumbnail_latency_ms = models.PositiveIntegerField(blank=True, null=True)
+    thumbnail_error = models.CharField(max_length=200, blank=True)
+    is_dead = models.BooleanField(default=False, db_index=True, help_text="Stream URL failed its latest check")
+    failures = models.PositiveIntegerField(default=0, help_text="Consecutive failed checks of the stream URL")
+    checked_at = models.DateTimeField()
+    
+    class Meta:
+        verbose_name_plural = "Stream Health"
     
     def __str__(self):
-        return f"{self.device_id} watched {self.stream.title}"
\ No newline at end of file
+        return f"Health of {self.stream.title}"
@@ -0,0 +1,49 @@
+"""
+Sune TV - Paginators
+Avoid full-table COUNT(*) on large admin changelists
+"""
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models.query import QuerySet
+from django.utils.functional import cached_property
+
+# Below this many rows an exact count is cheap enough to keep
+ESTIMATE_THRESHOLD = 100000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that trusts the PostgreSQL planner's row estimate
+
+    Unfiltered changelists on big tables read pg_class.reltuples instead of
+    counting every row. Filtered querysets, small tables and other database
+    backends fall back to the exact count.
+    """
+
+    @cached_property
+    def count(self):
+        estimate = self._estimated_count()
+        if estimate is not None:
+            return estimate
+        return super().count
+
+    def _estimated_count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet) or queryset.query.where:
+            return None
+
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+
+        if row is None or row[0] < ESTIMATE_THRESHOLD:
+            return None
+        return int(row[0])
@@ -0,0 +1,21 @@
+"""
+Sune TV - Binary API format
+MessagePack request bodies, sent with Content-Type: application/msgpack
+"""
+
+import msgpack
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class MessagePackParser(BaseParser):
+    """
+    Parses MessagePack request bodies into the same data a JSON body gives
+    """
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False, strict_map_key=False)
+        except (ValueError, msgpack.UnpackException) as exc:
+            raise ParseError(f'MessagePack parse error - {exc}')
@@ -0,0 +1,59 @@
+"""
+Sune TV - People index
+Keeps Person/StreamCast/StreamDirector in sync with the cast and director text
+"""
+
+from django.utils.text import slugify
+
+from .db import serialized_write
+from .utils import split_people
+
+
+def person_slug(name):
+    return slugify(name, allow_unicode=True)[:255]
+
+
+def get_people(names):
+    """Person objects for names, creating missing ones; keyed by slug"""
+    from .models import Person
+
+    wanted = {}
+    for name in names:
+        slug = person_slug(name)
+        if slug:
+            wanted.setdefault(slug, name)
+
+    people = Person.objects.in_bulk(list(wanted), field_name='slug')
+    missing = [Person(name=name, slug=slug) for slug, name in wanted.items() if slug not in people]
+    if missing:
+        Person.objects.bulk_create(missing, ignore_conflicts=True)
+        people = Person.objects.in_bulk(list(wanted), field_name='slug')
+    return people
+
+
+def sync_people(stream):
+    """Rebuild a stream's cast and director credits from its text fields"""
+    from .models import StreamCast, StreamDirector
+
+    cast = split_people(stream.cast)
+    directors = split_people(stream.director)
+
+    # One transaction, so readers never see the credits half rebuilt
+    with serialized_write():
+        people = get_people(cast + directors)
+        StreamCast.objects.filter(stream=stream).delete()
+        StreamDirector.objects.filter(stream=stream).delete()
+
+        credits = []
+        seen = set()
+        for name in cast:
+            person = people.get(person_slug(name))
+            if person and person.pk not in seen:
+                seen.add(person.pk)
+                credits.append(StreamCast(stream=stream, person=person, billing_order=len(credits)))
+        StreamCast.objects.bulk_create(credits)
+
+        director_ids = {people[person_slug(name)].pk for name in directors if person_slug(name) in people}
+        StreamDirector.objects.bulk_create(
+            [StreamDirector(stream=stream, person_id=person_id) for person_id in director_ids]
+        )
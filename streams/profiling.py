@@ -0,0 +1,209 @@
+"""
+Sune TV - On-demand request profiling
+Runs a sample of API requests (or ones carrying a staff-signed token) under
+cProfile, recording the SQL they issue, and stores a ProfileReport for the admin
+
+Disabled by default. With PROFILING_ENABLED off the middleware removes itself
+at startup, so requests pay nothing.
+
+Only one request per process is profiled at a time: since Python 3.12 a
+second cProfile profiler can't be enabled while one is running, so requests
+picked while another is being profiled are served unprofiled. Reports are
+saved by a background thread, after the response has been returned.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .db import serialized_write
+
+TOKEN_HEADER = 'X-Profile-Token'
+TOKEN_SALT = 'streams.profiling'
+
+# Rows kept per report
+TOP_FUNCTIONS = 30
+TOP_QUERIES = 20
+
+# Held while a request is being profiled
+_profiling = threading.Lock()
+
+_saver = None
+_saver_lock = threading.Lock()
+
+
+def make_token(username):
+    """Signed token a staff member sends in X-Profile-Token to force profiling"""
+    return signing.dumps({'user': username}, salt=TOKEN_SALT)
+
+
+def _token_is_valid(token):
+    try:
+        signing.loads(token, salt=TOKEN_SALT, max_age=settings.PROFILING_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def view_name(request):
+    """ViewSet.action (or view name) of the resolved request"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return ''
+    view = getattr(match.func, 'cls', None)
+    if view is None:
+        return match.view_name or match._func_path
+    actions = getattr(match.func, 'actions', None) or {}
+    action = actions.get(request.method.lower())
+    return f'{view.__name__}.{action}' if action else view.__name__
+
+
+class QueryRecorder:
+    """execute_wrapper that times every statement run during the request"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'sql': sql,
+                'time_ms': round((time.perf_counter() - started) * 1000, 3),
+                'many': many,
+                'db': context['connection'].alias,
+            })
+
+    @property
+    def total_ms(self):
+        return round(sum(query['time_ms'] for query in self.queries), 3)
+
+    def slowest(self, limit):
+        queries = sorted(self.queries, key=lambda query: -query['time_ms'])[:limit]
+        return [{**query, 'sql': query['sql'][:2000]} for query in queries]
+
+
+def top_functions(profiler, limit):
+    """The slowest functions by cumulative time as plain dicts"""
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = []
+    for (filename, line, function), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({
+            'function': pstats.func_std_string((filename, line, function)),
+            'ncalls': ncalls,
+            'tottime_ms': round(tottime * 1000, 3),
+            'cumtime_ms': round(cumtime * 1000, 3),
+        })
+    rows.sort(key=lambda row: -row['cumtime_ms'])
+    return rows[:limit]
+
+
+class ProfilingMiddleware:
+    """
+    Profiles /api/ requests picked by PROFILING_SAMPLE_RATE or a valid
+    X-Profile-Token header (see `python manage.py profiling_token`)
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def should_profile(self, request):
+        if not request.path.startswith('/api/'):
+            return False
+        token = request.headers.get(TOKEN_HEADER)
+        if token:
+            return _token_is_valid(token)
+        rate = settings.PROFILING_SAMPLE_RATE
+        return rate > 0 and random.random() < rate
+
+    def __call__(self, request):
+        if not self.should_profile(request) or not _profiling.acquire(blocking=False):
+            return self.get_response(request)
+
+        try:
+            recorder = QueryRecorder()
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiling tool (a debugger, coverage) is active
+                return self.get_response(request)
+            started = time.perf_counter()
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(recorder))
+                try:
+                    response = self.get_response(request)
+                finally:
+                    profiler.disable()
+            duration_ms = (time.perf_counter() - started) * 1000
+        finally:
+            _profiling.release()
+
+        details = {
+            'method': request.method,
+            'path': request.get_full_path()[:500],
+            'view_name': view_name(request)[:200],
+            'status_code': response.status_code,
+            'duration_ms': round(duration_ms, 3),
+        }
+        queue_report(details, profiler, recorder)
+        return response
+
+
+def _get_saver():
+    global _saver
+    with _saver_lock:
+        if _saver is None:
+            # One thread, so reports claim ring slots in order
+            _saver = ThreadPoolExecutor(max_workers=1, thread_name_prefix='profiling')
+    return _saver
+
+
+def _save_in_background(details, profiler, recorder):
+    try:
+        save_report(details, profiler, recorder)
+    finally:
+        connections.close_all()
+
+
+def queue_report(details, profiler, recorder):
+    """Save a report on the background thread, off the request path"""
+    return _get_saver().submit(_save_in_background, details, profiler, recorder)
+
+
+def save_report(details, profiler, recorder):
+    """Store the report and its raw stats in the next slot of the ring"""
+    from .models import ProfileReport
+
+    with serialized_write():
+        report = ProfileReport.objects.create(
+            **details,
+            sql_count=len(recorder.queries),
+            sql_time_ms=recorder.total_ms,
+            top_functions=top_functions(profiler, TOP_FUNCTIONS),
+            queries=recorder.slowest(TOP_QUERIES),
+        )
+        # Slots are reused, so the directory never holds more than the ring size
+        size = settings.PROFILING_MAX_REPORTS
+        os.makedirs(settings.PROFILING_ROOT, exist_ok=True)
+        report.stats_file = os.path.join(settings.PROFILING_ROOT, f'{report.pk % size:05d}.prof')
+        profiler.dump_stats(report.stats_file)
+        report.save(update_fields=['stats_file'])
+        ProfileReport.objects.filter(pk__lte=report.pk - size).delete()
+    return report
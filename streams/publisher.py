@@ -0,0 +1,254 @@
+"""
+Sune TV - Static catalog publisher
+Renders anonymous catalog payloads to precompressed JSON files that nginx or
+a CDN can serve without reaching Django
+
+Layout under CATALOG_PUBLISH_ROOT:
+    categories.<hash>.json, featured.<hash>.json, by_category.<hash>.json,
+    trending.<hash>.json, live.<hash>.json
+    streams/<id>.<hash>.json
+    manifest.json - {"version": n, "files": {name: path}}
+Every .json file has a .json.gz sibling (nginx: gzip_static on). File names
+carry a hash of their content, so everything but manifest.json can be cached
+forever; clients find the current files through the manifest. Replaced files
+are kept for CATALOG_PUBLISH_RETAIN seconds for clients holding an older
+manifest.
+
+Web workers and run_jobs may all publish; a lock file in the publish root
+makes them take turns, each starting from the manifest the last one wrote.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows - publishes are only serialized within a process
+    fcntl = None
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from . import catalog
+
+SECTIONS = {
+    'categories': catalog.build_categories,
+    'featured': catalog.build_featured,
+    'by_category': lambda: [section for _, section in catalog.build_by_category()],
+    'trending': catalog.build_trending,
+    'live': catalog.build_live,
+}
+
+MANIFEST = 'manifest.json'
+LOCK_FILE = '.publish.lock'
+
+_publish_lock = threading.Lock()
+
+
+@contextmanager
+def publish_lock(root):
+    """Held for a whole publish, by one thread in one process at a time"""
+    os.makedirs(root, exist_ok=True)
+    with _publish_lock, open(os.path.join(root, LOCK_FILE), 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class CatalogPublisher:
+    """
+    Writes catalog files, skipping any whose content hasn't changed
+
+    Files are written to a temp file and renamed into place, so readers
+    never see a partial file. Use publish(), which holds the publish lock;
+    the other methods expect it to be held.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or settings.CATALOG_PUBLISH_ROOT
+        self.renderer = JSONRenderer()
+        self.written = 0
+        self.unchanged = 0
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        try:
+            with open(os.path.join(self.root, MANIFEST)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        manifest.setdefault('version', 0)
+        manifest.setdefault('files', {})
+        manifest.setdefault('retired', {})  # path -> time it was replaced
+        return manifest
+
+    def _write_file(self, path, body):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+
+    def _retire(self, name):
+        """Stop listing a payload; its files are deleted once they have aged out"""
+        path = self.manifest['files'].pop(name, None)
+        if path is not None:
+            self.manifest['retired'][path] = time.time()
+        return path
+
+    def write(self, name, data):
+        """Render one payload to <name>.<hash>.json and its .gz"""
+        body = self.renderer.render(data)
+        path = f'{name}.{hashlib.sha256(body).hexdigest()[:16]}.json'
+        if self.manifest['files'].get(name) == path:
+            self.unchanged += 1
+            return
+
+        full_path = os.path.join(self.root, path)
+        self._write_file(full_path, body)
+        self._write_file(full_path + '.gz', gzip.compress(body, compresslevel=9, mtime=0))
+        self._retire(name)
+        self.manifest['retired'].pop(path, None)
+        self.manifest['files'][name] = path
+        self.written += 1
+
+    def remove(self, name):
+        """Stop serving a payload"""
+        if self._retire(name) is not None:
+            self.written += 1
+
+    def delete_retired(self):
+        """Delete replaced files older than CATALOG_PUBLISH_RETAIN seconds"""
+        cutoff = time.time() - settings.CATALOG_PUBLISH_RETAIN
+        live = set(self.manifest['files'].values())
+        for path, retired_at in list(self.manifest['retired'].items()):
+            if retired_at > cutoff:
+                continue
+            del self.manifest['retired'][path]
+            if path in live:
+                continue
+            for suffix in ('', '.gz'):
+                try:
+                    os.remove(os.path.join(self.root, path + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def publish_sections(self):
+        for name, builder in SECTIONS.items():
+            self.write(name, builder())
+
+    def publish_streams(self, stream_ids=None, chunk_size=1000):
+        """
+        Render stream detail files - all active streams, or just stream_ids
+
+        Streams that were deleted or deactivated have their files removed.
+        """
+        from .models import Stream
+        from .serializers import StreamDetailSerializer
+
+        streams = Stream.objects.filter(is_active=True).select_related('category')
+        if stream_ids is not None:
+            streams = streams.filter(pk__in=stream_ids)
+
+        published = set()
+        for stream in streams.order_by('pk').iterator(chunk_size=chunk_size):
+            self.write(f'streams/{stream.pk}', StreamDetailSerializer(stream).data)
+            published.add(f'streams/{stream.pk}')
+
+        if stream_ids is None:
+            stale = [name for name in self.manifest['files'] if name.startswith('streams/')]
+        else:
+            stale = [f'streams/{pk}' for pk in stream_ids]
+        for name in stale:
+            if name not in published:
+                self.remove(name)
+
+    def save_manifest(self):
+        """Write the manifest last, once every file it lists is in place"""
+        if not self.written and self.manifest['version']:
+            return
+        self.manifest['version'] += 1
+        self.manifest['generated_at'] = timezone.now().isoformat()
+        body = json.dumps(self.manifest, separators=(',', ':')).encode()
+        self._write_file(os.path.join(self.root, MANIFEST), body)
+
+    def publish(self, stream_ids=None):
+        """Full publish, or incremental when stream_ids is given"""
+        with publish_lock(self.root):
+            # Another process may have published since this one was created
+            self.manifest = self._load_manifest()
+            self.publish_sections()
+            self.publish_streams(stream_ids)
+            self.delete_retired()
+            self.save_manifest()
+        return self
+
+
+def streams_in_categories(category_ids):
+    """IDs of every stream in the given categories (their detail files embed the category)"""
+    from .models import Stream
+
+    return list(Stream.objects.filter(category_id__in=category_ids).values_list('pk', flat=True))
+
+
+# Debounced automatic publishing - changes are collected for
+# CATALOG_PUBLISH_DEBOUNCE seconds after the first one, then published together
+_pending = set()
+_pending_lock = threading.Lock()
+_timer = None
+_deadline = None  # time.monotonic() at which _timer fires
+
+
+def schedule_publish(stream_ids, delay=None):
+    """
+    Queue stream IDs for the next debounced incremental publish
+
+    Every publish re-renders the sections, so schedule_publish([]) with a
+    longer delay refreshes trending as view counts change. The earliest
+    deadline wins: a pending publish is brought forward, never pushed back.
+    """
+    global _timer, _deadline
+
+    if not settings.CATALOG_PUBLISH_ENABLED:
+        return
+    if delay is None:
+        delay = settings.CATALOG_PUBLISH_DEBOUNCE
+    deadline = time.monotonic() + delay
+    with _pending_lock:
+        _pending.update(stream_ids)
+        if _timer is not None:
+            if _deadline <= deadline:
+                return
+            _timer.cancel()
+        _timer = threading.Timer(delay, _publish_pending)
+        _timer.daemon = True
+        _deadline = deadline
+        _timer.start()
+
+
+def _publish_pending():
+    global _timer, _deadline
+
+    with _pending_lock:
+        if threading.current_thread() is not _timer:
+            return  # Cancelled as it fired; the sooner timer publishes
+        stream_ids = list(_pending)
+        _pending.clear()
+        _timer = _deadline = None
+    try:
+        CatalogPublisher().publish(stream_ids)
+    finally:
+        connections.close_all()
@@ -0,0 +1,201 @@
+"""
+Sune TV - "More like this" recommendations
+Item-item cosine similarity over co-watch data, with a metadata fallback
+
+numpy and scipy are only needed to build the table (offline); serving the
+results is a single indexed read of StreamSimilarity.
+"""
+
+import math
+import re
+from array import array
+from collections import defaultdict
+
+from django.conf import settings
+
+from .db import serialized_write
+from .sharding import get_shards
+
+# Streams scored against the whole catalog per block of the similarity product
+BLOCK_SIZE = 2000
+
+
+def _people(stream):
+    """Lower-cased cast and director names for metadata overlap"""
+    names = re.split(r'[,;]', f"{stream['cast']},{stream['director']}")
+    return {name.strip().lower() for name in names if name.strip()}
+
+
+def build_cowatch_matrix(chunk_size=20000):
+    """
+    Read watch history in chunks into a binary device x stream sparse matrix
+
+    Returns (matrix, stream_ids) where column j of the matrix is stream_ids[j].
+    """
+    import numpy as np
+    from scipy import sparse
+
+    from .models import WatchHistory
+
+    device_index = {}
+    stream_index = {}
+    rows = array('q')
+    cols = array('q')
+
+    # A device's events are all on one shard, so shards are simply read in turn
+    for alias in get_shards():
+        events = WatchHistory.objects.using(alias).order_by().values_list('device_id', 'stream_id')
+        for device_id, stream_id in events.iterator(chunk_size=chunk_size):
+            rows.append(device_index.setdefault(device_id, len(device_index)))
+            cols.append(stream_index.setdefault(stream_id, len(stream_index)))
+
+    rows = np.frombuffer(rows, dtype=np.int64) if rows else np.zeros(0, dtype=np.int64)
+    cols = np.frombuffer(cols, dtype=np.int64) if cols else np.zeros(0, dtype=np.int64)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+        shape=(len(device_index), len(stream_index)),
+    )
+    # Repeat views by the same device collapse to a single 1
+    matrix.data[:] = 1.0
+
+    stream_ids = [None] * len(stream_index)
+    for stream_id, index in stream_index.items():
+        stream_ids[index] = stream_id
+    return matrix, stream_ids
+
+
+def cowatch_neighbours(matrix, stream_ids, k):
+    """
+    Top-k cosine neighbours per stream from the co-watch matrix
+
+    Columns are L2-normalised so X^T X gives cosine similarity directly; the
+    product is computed a block of streams at a time to bound memory.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    norms[norms == 0] = 1.0
+    normalised = (matrix @ sparse.diags(1.0 / norms)).tocsc()
+
+    neighbours = {}
+    for start in range(0, len(stream_ids), BLOCK_SIZE):
+        stop = min(start + BLOCK_SIZE, len(stream_ids))
+        block = (normalised[:, start:stop].T @ normalised).tocsr()
+        for offset in range(stop - start):
+            row = block.getrow(offset)
+            index = start + offset
+            mask = row.indices != index
+            indices, scores = row.indices[mask], row.data[mask]
+            if not len(indices):
+                continue
+            if len(indices) > k:
+                top = np.argpartition(-scores, k)[:k]
+                indices, scores = indices[top], scores[top]
+            order = np.argsort(-scores)
+            neighbours[stream_ids[index]] = [
+                (stream_ids[indices[i]], float(scores[i])) for i in order
+            ]
+    return neighbours
+
+
+def metadata_neighbours(stream_ids, k):
+    """
+    Cold-start neighbours from shared cast/director and category
+
+    Candidates are streams sharing a person, then the newest streams in the
+    same category. Score is the cosine of the people sets plus a small bonus
+    for a matching category.
+    """
+    from .models import Stream
+
+    catalog = {
+        row['id']: row
+        for row in Stream.objects.filter(is_active=True)
+        .order_by('-created_at')
+        .values('id', 'category_id', 'cast', 'director')
+    }
+    people = {stream_id: _people(row) for stream_id, row in catalog.items()}
+
+    by_person = defaultdict(list)
+    by_category = defaultdict(list)
+    for stream_id, row in catalog.items():
+        for name in people[stream_id]:
+            by_person[name].append(stream_id)
+        by_category[row['category_id']].append(stream_id)
+
+    neighbours = {}
+    for stream_id in stream_ids:
+        row = catalog.get(stream_id)
+        if row is None:
+            continue
+        candidates = set()
+        for name in people[stream_id]:
+            candidates.update(by_person[name])
+        candidates.update(by_category[row['category_id']][:k * 4])
+        candidates.discard(stream_id)
+
+        scored = []
+        for other in candidates:
+            shared = len(people[stream_id] & people[other])
+            score = 0.0
+            if shared:
+                score = shared / math.sqrt(len(people[stream_id]) * len(people[other]))
+            if catalog[other]['category_id'] == row['category_id']:
+                score += 0.1
+            if score:
+                scored.append((other, score))
+        scored.sort(key=lambda item: -item[1])
+        if scored:
+            neighbours[stream_id] = scored[:k]
+    return neighbours
+
+
+def build_similar_streams(k=None, chunk_size=20000):
+    """
+    Rebuild the StreamSimilarity table
+
+    Each stream gets its active co-watch neighbours first; when that leaves
+    fewer than k, the rest are filled from the metadata overlap. Returns
+    (cowatch_count, metadata_count): streams with any co-watch neighbour and
+    streams topped up from metadata.
+    """
+    from .models import Stream, StreamSimilarity
+
+    k = k or settings.SIMILAR_STREAMS_COUNT
+    matrix, stream_ids = build_cowatch_matrix(chunk_size=chunk_size)
+
+    active = set(Stream.objects.filter(is_active=True).values_list('id', flat=True))
+    cowatch = {
+        stream_id: [(similar_id, score) for similar_id, score in similar if similar_id in active]
+        for stream_id, similar in cowatch_neighbours(matrix, stream_ids, k).items()
+        if stream_id in active
+    }
+    short = [stream_id for stream_id in active if len(cowatch.get(stream_id, ())) < k]
+    metadata = metadata_neighbours(short, k)
+
+    rows = []
+    cowatch_count = metadata_count = 0
+    for stream_id in active:
+        similar = [(similar_id, score, StreamSimilarity.SOURCE_COWATCH)
+                   for similar_id, score in cowatch.get(stream_id, ())]
+        taken = {similar_id for similar_id, _, _ in similar}
+        fill = [(similar_id, score, StreamSimilarity.SOURCE_METADATA)
+                for similar_id, score in metadata.get(stream_id, ()) if similar_id not in taken]
+        fill = fill[:k - len(similar)]
+        cowatch_count += bool(similar)
+        metadata_count += bool(fill)
+        for rank, (similar_id, score, source) in enumerate(similar + fill):
+            rows.append(StreamSimilarity(
+                stream_id=stream_id,
+                similar_id=similar_id,
+                rank=rank,
+                score=score,
+                source=source,
+            ))
+
+    with serialized_write():
+        StreamSimilarity.objects.all().delete()
+        StreamSimilarity.objects.bulk_create(rows, batch_size=2000)
+
+    return cowatch_count, metadata_count
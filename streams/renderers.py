@@ -0,0 +1,27 @@
+"""
+Sune TV - Binary API format
+MessagePack rendering, chosen with Accept: application/msgpack or ?format=msgpack
+"""
+
+import msgpack
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Renders responses as MessagePack
+
+    Types MessagePack has no encoding for (Decimal, datetime, UUID, ...) go
+    through DRF's JSON encoder, so they come out exactly as in JSON responses
+    (e.g. rating as "8.5", timestamps as ISO 8601 strings).
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=JSONEncoder().default, use_bin_type=True)
@@ -1,11 +1,15 @@
+from django.conf import settings
+from django.urls import reverse
 from rest_framework import serializers
-from .models import Category, Stream, WatchHistory
+from . import icons
+from .models import Category, CategoryStats, Person, Stream, StreamStats, WatchHistory
 
 class CategorySerializer(serializers.ModelSerializer):
     """
     Serializer for Category model
     """
     stream_count = serializers.SerializerMethodField()
+    icon_variants = serializers.SerializerMethodField()
     
     class Meta:
         model = Category
@@ -15,6 +19,7 @@ class CategorySerializer(serializers.ModelSerializer):
             'slug',
             'description',
             'icon',
+            'icon_variants',
             'order',
             'stream_count',
             'created_at',
@@ -23,7 +28,28 @@ class CategorySerializer(serializers.ModelSerializer):
     
     def get_stream_count(self, obj):
         """Get count of active streams in this category"""
+        if hasattr(obj, 'active_stream_count'):
+            return obj.active_stream_count
         return obj.streams.filter(is_active=True).count()
+    
+    def get_icon_variants(self, obj):
+        """
+        Resized icon URLs - {"128": {"webp": url, "jpeg": url}, ...}
+        Built from SITE_URL, not the request, so cached documents match live ones
+        """
+        def build_url(slug, size, fmt):
+            return settings.SITE_URL + reverse('category-icon', kwargs={'slug': slug, 'size': size, 'fmt': fmt})
+        
+        return icons.variant_urls(obj, build_url)
+
+
+class PersonSerializer(serializers.ModelSerializer):
+    """
+    Serializer for cast members and directors
+    """
+    class Meta:
+        model = Person
+        fields = ['id', 'name', 'slug']
 
 
 class StreamListSerializer(serializers.ModelSerializer):
@@ -42,6 +68,7 @@ class StreamListSerializer(serializers.ModelSerializer):
             'url',
             'category',
             'duration',
+            'duration_seconds',
             'rating',
             'is_live',
         ]
@@ -68,6 +95,7 @@ class StreamDetailSerializer(serializers.ModelSerializer):
             'category',
             'category_id',
             'duration',
+            'duration_seconds',
             'release_year',
             'rating',
             'director',
@@ -138,8 +166,21 @@ class WatchHistorySerializer(serializers.ModelSerializer):
             'watched_at',
             'watch_duration',
             'completed',
+            'event_id',
         ]
         read_only_fields = ['watched_at']
+        # Duplicate event_ids are handled by WatchHistoryViewSet.perform_create,
+        # not by a uniqueness query before every insert
+        validators = []
+    
+    def validate_event_id(self, value):
+        return value or None
+    
+    def create(self, validated_data):
+        # Model.save() lets the router put the row on the device's shard
+        instance = WatchHistory(**validated_data)
+        instance.save()
+        return instance
 
 
 class StreamsByCategorySerializer(serializers.Serializer):
@@ -148,4 +189,46 @@ class StreamsByCategorySerializer(serializers.Serializer):
     Matches the Android app's StreamCategory model
     """
     category = serializers.CharField()
-    streams = StreamListSerializer(many=True)
\ No newline at end of file
+    streams = StreamListSerializer(many=True)
+
+
+class StreamStatsSerializer(serializers.ModelSerializer):
+    """
+    Engagement aggregates for a stream
+    """
+    average_watch_duration = serializers.FloatField(read_only=True)
+    completion_rate = serializers.FloatField(read_only=True)
+    
+    class Meta:
+        model = StreamStats
+        fields = [
+            'stream',
+            'plays',
+            'unique_devices',
+            'total_seconds',
+            'average_watch_duration',
+            'completions',
+            'completion_rate',
+            'updated_at',
+        ]
+
+
+class CategoryStatsSerializer(serializers.ModelSerializer):
+    """
+    Engagement aggregates for a category
+    """
+    average_watch_duration = serializers.FloatField(read_only=True)
+    completion_rate = serializers.FloatField(read_only=True)
+    
+    class Meta:
+        model = CategoryStats
+        fields = [
+            'category',
+            'plays',
+            'unique_devices',
+            'total_seconds',
+            'average_watch_duration',
+            'completions',
+            'completion_rate',
+            'updated_at',
+        ]
\ No newline at end of file
@@ -0,0 +1,162 @@
+"""
+Sune TV - WatchHistory sharding
+Watch events live on one of the WATCH_HISTORY_SHARDS databases, picked by a
+stable hash of device_id. Everything else, including the Stream catalog,
+stays on the default database.
+
+device_id hashes to one of SLOTS hash slots and the slots are split into
+contiguous ranges, one per shard. Adding a shard only moves the slot ranges
+whose owner changed (see `python manage.py reshard_watch_history`).
+"""
+
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+SLOTS = 1024
+
+SHARDED_MODEL = 'streams.watchhistory'
+
+
+def get_shards():
+    return settings.WATCH_HISTORY_SHARDS
+
+
+def is_sharded():
+    """True when watch history lives anywhere but the default database alone"""
+    return get_shards() != [DEFAULT_DB_ALIAS]
+
+
+def slot_for(device_id):
+    return zlib.crc32(str(device_id).encode()) % SLOTS
+
+
+def shard_for_slot(slot, shards=None):
+    shards = shards or get_shards()
+    return shards[slot * len(shards) // SLOTS]
+
+
+def shard_for(device_id, shards=None):
+    """Database alias holding a device's watch history"""
+    return shard_for_slot(slot_for(device_id), shards)
+
+
+def history_for(device_id):
+    """One device's watch history, read from its shard"""
+    from .models import WatchHistory
+
+    return WatchHistory.objects.using(shard_for(device_id)).filter(device_id=device_id)
+
+
+def _run_on_shard(fn, alias):
+    try:
+        return fn(alias)
+    finally:
+        connections[alias].close()
+
+
+def fan_out(fn, shards=None):
+    """
+    Call fn(alias) for every shard and return the results in shard order
+
+    With more than one shard each call runs in its own thread on its own
+    connection, so per-shard queries run in parallel.
+    """
+    shards = shards or get_shards()
+    if len(shards) == 1:
+        return [fn(shards[0])]
+    with ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix='shard') as executor:
+        return list(executor.map(lambda alias: _run_on_shard(fn, alias), shards))
+
+
+def copy_history(events, alias):
+    """
+    Insert copies of watch events into another shard
+
+    The copies get new primary keys and keep the original watched_at.
+    Events already there are skipped: by event_id, or for events without one,
+    by a row with the same fields (left by an earlier, interrupted copy).
+    """
+    from .models import WatchHistory
+
+    events = list(events)
+    if not events:
+        return
+    fields = [field.attname for field in WatchHistory._meta.concrete_fields if not field.primary_key]
+    existing = set(
+        WatchHistory.objects.using(alias)
+        .filter(
+            device_id__in={event.device_id for event in events},
+            watched_at__range=(min(event.watched_at for event in events),
+                               max(event.watched_at for event in events)),
+        )
+        .values_list(*fields)
+    )
+    copies = [
+        WatchHistory(**{name: getattr(event, name) for name in fields})
+        for event in events
+        if tuple(getattr(event, name) for name in fields) not in existing
+    ]
+    WatchHistory.objects.using(alias).bulk_create(copies, ignore_conflicts=True)
+
+
+def delete_stream_history(stream_ids):
+    """
+    Delete watch events for deleted streams from the shard databases
+
+    Deleting a Stream only cascades on the default database.
+    """
+    from .models import WatchHistory
+
+    shards = [alias for alias in get_shards() if alias != DEFAULT_DB_ALIAS]
+    if shards:
+        fan_out(lambda alias: WatchHistory.objects.using(alias).filter(stream_id__in=stream_ids).delete(), shards)
+
+
+class WatchHistoryRouter:
+    """
+    Routes WatchHistory to the device's shard and every other model to default
+
+    A new WatchHistory instance is saved to shard_for(instance.device_id);
+    existing ones are written back to the database they were read from.
+    Querysets have no device to route by, so reads go through history_for()
+    or an explicit .using(alias). Shard databases only get the WatchHistory
+    table; the default database keeps the full schema.
+    """
+
+    def _is_sharded_model(self, model):
+        return model._meta.label_lower == SHARDED_MODEL
+
+    def db_for_read(self, model, **hints):
+        if not self._is_sharded_model(model):
+            # Related catalog objects (event.stream) are on default, not the event's shard
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return None
+
+    def db_for_write(self, model, **hints):
+        if not self._is_sharded_model(model):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if isinstance(instance, model):
+            if not instance._state.adding and instance._state.db:
+                # Existing rows are changed where they were read from
+                return instance._state.db
+            if instance.device_id:
+                return shard_for(instance.device_id)
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # WatchHistory.stream points from a shard to the default database
+        if self._is_sharded_model(obj1) or self._is_sharded_model(obj2):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == DEFAULT_DB_ALIAS or db not in get_shards():
+            return None
+        return f'{app_label}.{model_name}' == SHARDED_MODEL
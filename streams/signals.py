@@ -0,0 +1,105 @@
+"""
+Sune TV - Model signal handlers
+Connected in StreamsConfig.ready()
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import analytics, events, feeds, icons, people, publisher, sharding
+from .catalog import bump_catalog_version
+from .jobs import bulk_update_applied
+from .models import Category, Stream, WatchHistory
+
+
+@receiver(post_save, sender=WatchHistory)
+def watch_event_created(sender, instance, created, **kwargs):
+    """Keep stream stats and the device's feed current as events are ingested"""
+    if created:
+        analytics.record_watch_event(instance)
+        feeds.record_watch_event(instance)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Stream)
+@receiver(post_delete, sender=Stream)
+def catalog_changed(sender, instance, **kwargs):
+    """Invalidate cached catalog payloads and republish the affected files"""
+    # After commit, so a payload rebuilt under the new version can't be made
+    # from rows this transaction hasn't committed yet
+    transaction.on_commit(bump_catalog_version, robust=True)
+    if not settings.CATALOG_PUBLISH_ENABLED:
+        return
+    if sender is Stream:
+        publisher.schedule_publish([instance.pk])
+    elif kwargs.get('created') is False:
+        # Stream detail files embed the category name
+        publisher.schedule_publish(publisher.streams_in_categories([instance.pk]))
+
+
+@receiver(post_save, sender=Category)
+def category_icon_uploaded(sender, instance, **kwargs):
+    """Generate the resized icon variants in the background once the upload is saved"""
+    if getattr(instance, '_icon_uploaded', False) and settings.ICON_PREGENERATE:
+        instance._icon_uploaded = False
+        transaction.on_commit(lambda: icons.pregenerate(instance), robust=True)
+
+
+# Fields post_save handlers compare with the row the save replaced
+TRACKED_FIELDS = ('cast', 'director', *events.STATUS_FIELDS)
+
+
+@receiver(pre_save, sender=Stream)
+def stream_saving(sender, instance, using=None, update_fields=None, **kwargs):
+    """
+    Note which tracked fields the save changes
+
+    Only fields being written are read back, in one query; a new stream is
+    compared with the field defaults.
+    """
+    fields = [field for field in TRACKED_FIELDS if update_fields is None or field in update_fields]
+    saved = None
+    if fields and not instance._state.adding:
+        saved = Stream.objects.using(using).filter(pk=instance.pk).values(*fields).first()
+    if saved is None:
+        saved = {field: Stream._meta.get_field(field).get_default() for field in fields}
+    instance._changed_fields = {field for field in fields if getattr(instance, field) != saved[field]}
+
+
+@receiver(post_save, sender=Stream)
+def stream_people_changed(sender, instance, **kwargs):
+    """Keep the people index in step with the cast and director text"""
+    if {'cast', 'director'} & instance._changed_fields:
+        people.sync_people(instance)
+
+
+@receiver(post_save, sender=Stream)
+def stream_status_changed(sender, instance, created, **kwargs):
+    """Push is_live / is_featured / is_active changes to live event clients"""
+    if created:
+        changes = events.status_of(instance)
+    else:
+        changes = {
+            field: getattr(instance, field) for field in events.STATUS_FIELDS
+            if field in instance._changed_fields
+        }
+    events.publish_stream_changes([instance.pk], changes)
+
+
+@receiver(post_delete, sender=Stream)
+def stream_deleted(sender, instance, **kwargs):
+    events.publish_stream_changes([instance.pk], {'is_active': False, 'deleted': True})
+    if sharding.is_sharded():
+        stream_id = instance.pk
+        transaction.on_commit(lambda: sharding.delete_stream_history([stream_id]))
+
+
+@receiver(bulk_update_applied, sender=Stream)
+def streams_bulk_updated(sender, ids, changes, **kwargs):
+    """Invalidate cached catalog payloads after each bulk job batch"""
+    bump_catalog_version()
+    publisher.schedule_publish(ids)
+    events.publish_stream_changes(ids, changes)
@@ -1,3 +1,1196 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from importlib.util import find_spec
+from io import StringIO
+from unittest import mock, skipIf, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import AsyncClient, Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+import msgpack
+from PIL import Image
+from sune_backend import views as project_views
+
+from . import catalog, dedup, events, exports, icons, jobs, paginators, profiling, publisher, recommendations
+from .analytics import rebuild_stats
+from .db import serialized_write
+from .jobs import JobTakenOver, run_job
+from .linkcheck import LinkChecker
+from .models import (
+    BulkJob, Category, CategoryStats, ExportWatermark, Stream, StreamSimilarity, StreamStats, WatchHistory,
+    WatchHistoryDaily,
+)
+from .sharding import copy_history, shard_for
+from .throttling import DeviceRateThrottle
+from .utils import parse_duration
+
+
+class ParseDurationTests(SimpleTestCase):
+    def test_formats(self):
+        cases = {
+            '2h 15m': 8100,
+            '2h15m': 8100,
+            '9m 56s': 596,
+            '9m56s': 596,
+            '1h30min': 5400,
+            '1h 30 mins': 5400,
+            '2 hours, 15 minutes': 8100,
+            '3 Hrs': 10800,
+            '45 min': 2700,
+            '1.5h': 5400,
+            '1:30:00': 5400,
+            '45:10': 2710,
+            '90': 5400,
+        }
+        for value, seconds in cases.items():
+            with self.subTest(value=value):
+                self.assertEqual(parse_duration(value), seconds)
+
+    def test_unrecognised(self):
+        for value in [None, '', '   ', 'N/A', 'about 2h', '2h or so', '2x15', '1:2:3:4']:
+            with self.subTest(value=value):
+                self.assertIsNone(parse_duration(value))
+
+
+class LinkCheckerTests(SimpleTestCase):
+    """The check_stream_urls HTTP client against a local stand-in server"""
+
+    def check(self, paths, delay=0.0, **options):
+        """Check paths on a fresh server; returns (results, server stats)"""
+        stats = {'in_flight': 0, 'max_in_flight': 0, 'requests': []}
+
+        async def handle(reader, writer):
+            stats['in_flight'] += 1
+            stats['max_in_flight'] = max(stats['max_in_flight'], stats['in_flight'])
+            try:
+                head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1')
+                method, path, _ = head.split('\r\n')[0].split(' ')
+                stats['requests'].append((method, path, 'Range: bytes=0-0' in head))
+                await asyncio.sleep(delay)
+                extra = ''
+                if path == '/slow':
+                    await asyncio.sleep(5)
+                if path == '/hangup':
+                    return
+                if path == '/dead':
+                    status = '404 Not Found'
+                elif path == '/nohead':
+                    status = '405 Method Not Allowed' if method == 'HEAD' else '206 Partial Content'
+                elif path == '/redirect':
+                    status, extra = '302 Found', 'Location: /ok\r\n'
+                else:
+                    status = '200 OK'
+                writer.write(f'HTTP/1.1 {status}\r\n{extra}Content-Length: 0\r\n\r\n'.encode())
+                await writer.drain()
+            except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+                pass
+            finally:
+                stats['in_flight'] -= 1
+                writer.close()
+
+        async def run():
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            base = f'http://127.0.0.1:{server.sockets[0].getsockname()[1]}'
+            try:
+                checker = LinkChecker(**options)
+                return await asyncio.gather(*(checker.check(base + path) for path in paths))
+            finally:
+                server.close()
+
+        return asyncio.run(run()), stats
+
+    def test_statuses(self):
+        (ok, dead), _ = self.check(['/ok', '/dead'])
+        self.assertEqual((ok.status, ok.error), (200, ''))
+        self.assertTrue(ok.ok)
+        self.assertEqual(dead.status, 404)
+        self.assertFalse(dead.ok)
+
+    def test_head_rejected_falls_back_to_ranged_get(self):
+        (result,), stats = self.check(['/nohead'])
+        self.assertEqual(result.status, 206)
+        self.assertTrue(result.ok)
+        self.assertEqual(stats['requests'], [('HEAD', '/nohead', False), ('GET', '/nohead', True)])
+
+    def test_redirect_is_followed(self):
+        (result,), stats = self.check(['/redirect'])
+        self.assertEqual(result.status, 200)
+        self.assertEqual([path for _, path, _ in stats['requests']], ['/redirect', '/ok'])
+
+    def test_timeout(self):
+        (result,), _ = self.check(['/slow'], timeout=0.2)
+        self.assertIsNone(result.status)
+        self.assertIn('timed out', result.error)
+        self.assertFalse(result.ok)
+
+    def test_connection_closed_without_a_response(self):
+        (result,), _ = self.check(['/hangup'])
+        self.assertEqual((result.status, result.error), (None, 'connection closed before a response'))
+        self.assertFalse(result.ok)
+
+    def test_connection_refused(self):
+        async def run():
+            # Bind a port, then close it so nothing is listening there
+            server = await asyncio.start_server(lambda r, w: None, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            server.close()
+            await server.wait_closed()
+            return await LinkChecker().check(f'http://127.0.0.1:{port}/')
+
+        result = asyncio.run(run())
+        self.assertIsNone(result.status)
+        self.assertTrue(result.error)
+
+    def test_waiting_for_a_busy_host_does_not_count_against_the_timeout(self):
+        # 10 healthy URLs on one host, 2 at a time, take 5 x 0.3s - longer
+        # than the timeout, though no single request comes close to it
+        started = time.monotonic()
+        results, stats = self.check(['/ok'] * 10, delay=0.3, per_host=2, timeout=1)
+        self.assertGreater(time.monotonic() - started, 1)
+        self.assertEqual([result.status for result in results], [200] * 10)
+        self.assertEqual(stats['max_in_flight'], 2)
+        for result in results:
+            self.assertLess(result.latency_ms, 1000)
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1.0, PROFILING_ROOT=tempfile.mkdtemp())
+class ProfilingMiddlewareTests(TestCase):
+    """Sampled requests are profiled one at a time and never fail because of it"""
+
+    def get(self):
+        with mock.patch.object(profiling, 'queue_report') as queue_report:
+            response = self.client.get('/api/categories/')
+        self.assertEqual(response.status_code, 200)
+        return queue_report
+
+    def test_profiled_request_queues_a_report(self):
+        queue_report = self.get()
+        queue_report.assert_called_once()
+        details, profiler, recorder = queue_report.call_args.args
+        self.assertEqual(details['view_name'], 'CategoryViewSet.list')
+        self.assertEqual(details['status_code'], 200)
+
+    def test_request_is_unprofiled_while_another_is_profiled(self):
+        with profiling._profiling:
+            queue_report = self.get()
+        queue_report.assert_not_called()
+
+    def test_request_is_unprofiled_when_another_profiler_is_active(self):
+        busy = mock.Mock()
+        busy.return_value.enable.side_effect = ValueError('Another profiling tool is already active')
+        with mock.patch.object(profiling.cProfile, 'Profile', busy):
+            queue_report = self.get()
+        queue_report.assert_not_called()
+        self.assertFalse(profiling._profiling.locked())
+
+    @override_settings(PROFILING_ENABLED=False)
+    def test_disabled_middleware_removes_itself(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            profiling.ProfilingMiddleware(lambda request: None)
+
+        User.objects.create_user('admin', is_staff=True)
+        with mock.patch.object(profiling.cProfile, 'Profile') as profile:
+            queue_report = self.get()
+            self.client.get('/api/categories/', headers={profiling.TOKEN_HEADER: profiling.make_token('admin')})
+        profile.assert_not_called()
+        queue_report.assert_not_called()
+
+    def test_save_report(self):
+        profiler = profiling.cProfile.Profile()
+        profiler.enable()
+        sum(range(100))
+        profiler.disable()
+        details = {'method': 'GET', 'path': '/api/x/', 'view_name': 'X', 'status_code': 200, 'duration_ms': 1.0}
+        report = profiling.save_report(details, profiler, profiling.QueryRecorder())
+        self.assertTrue(report.top_functions)
+        self.assertTrue(report.stats_file.endswith('.prof'))
+
+
+class OpenAPISchemaTests(SimpleTestCase):
+    """/swagger.json serves the file written by build_openapi_schema"""
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'swagger.json')
+        self.enterContext(override_settings(OPENAPI_SCHEMA_PATH=self.path, OPENAPI_SCHEMA_MAX_AGE=600))
+        self.enterContext(mock.patch.object(project_views, '_schema_file', None))
+
+    @skipUnless(find_spec('drf_yasg'), 'needs drf_yasg')
+    def test_prebuilt_schema_with_etag(self):
+        call_command('build_openapi_schema', output=self.path, stdout=StringIO())
+        response = self.client.get('/swagger.json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('/streams/', response.json()['paths'])
+        self.assertEqual(response['Cache-Control'], 'public, max-age=600')
+
+        response = self.client.get('/swagger.json', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_rebuilt_file_is_picked_up(self):
+        with open(self.path, 'w') as f:
+            f.write('{"paths": {}}')
+        os.utime(self.path, (1, 1))
+        first = self.client.get('/swagger.json')
+        with open(self.path, 'w') as f:
+            f.write('{"paths": {"/streams/": {}}}')
+        second = self.client.get('/swagger.json')
+        self.assertEqual(second.json(), {'paths': {'/streams/': {}}})
+        self.assertNotEqual(first['ETag'], second['ETag'])
+
+    @override_settings(API_DOCS_ENABLED=False)
+    def test_not_built_and_docs_disabled(self):
+        self.assertEqual(self.client.get('/swagger.json').status_code, 404)
+
+
+class CatalogVersionTests(SimpleTestCase):
+    """Without a shared cache the catalog version lives in a file every process sees"""
+
+    def setUp(self):
+        self.version_file = os.path.join(tempfile.mkdtemp(), 'catalog.version')
+        self.enterContext(override_settings(CATALOG_VERSION_FILE=self.version_file))
+        cache.clear()
+
+    def test_bump_moves_forward(self):
+        version = catalog.catalog_version()
+        catalog.bump_catalog_version()
+        catalog.bump_catalog_version()
+        self.assertGreater(catalog.catalog_version(), version)
+
+    def test_bump_from_another_process_invalidates_this_one(self):
+        builds = []
+
+        def builder():
+            builds.append(1)
+            return len(builds)
+
+        self.assertEqual(catalog.cached('test', builder), 1)
+        self.assertEqual(catalog.cached('test', builder), 1)
+
+        # e.g. run_jobs or another web worker saving a stream
+        subprocess.run(
+            [sys.executable, 'manage.py', 'shell', '-c',
+             'from streams.catalog import bump_catalog_version; bump_catalog_version()'],
+            cwd=settings.BASE_DIR,
+            env={
+                **os.environ,
+                'DJANGO_SETTINGS_MODULE': 'sune_backend.settings',
+                'CATALOG_VERSION_FILE': self.version_file,
+                'REDIS_URL': '',
+            },
+            check=True,
+            capture_output=True,
+        )
+        self.assertEqual(catalog.cached('test', builder), 2)
+
+
+class CatalogInvalidationTests(TestCase):
+    def test_the_version_is_bumped_after_commit(self):
+        stream = create_streams(1)[0]
+        version = catalog.catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            stream.title = 'Renamed'
+            stream.save()
+            # A request rebuilding now would still read the old row
+            self.assertEqual(catalog.catalog_version(), version)
+        self.assertGreater(catalog.catalog_version(), version)
+
+
+def create_streams(count, category=None, **fields):
+    """Streams without going through save() and its signals"""
+    category = category or Category.objects.create(name=f'Category {Category.objects.count()}')
+    start = Stream.objects.count()
+    return Stream.objects.bulk_create([
+        Stream(
+            title=f'Stream {start + i}',
+            slug=f'stream-{start + i}',
+            category=category,
+            url=f'https://cdn.example.com/{start + i}.m3u8',
+            thumbnail=f'https://cdn.example.com/{start + i}.jpg',
+            **fields,
+        )
+        for i in range(count)
+    ])
+
+
+class CatalogStampedeTests(TransactionTestCase):
+    """However many requests miss a payload at once, it is built once"""
+
+    def setUp(self):
+        self.enterContext(override_settings(
+            CATALOG_VERSION_FILE=os.path.join(tempfile.mkdtemp(), 'catalog.version')
+        ))
+        cache.clear()
+        for _ in range(3):
+            create_streams(12)
+
+    def queries_for(self, concurrency):
+        """Total queries run by `concurrency` simultaneous misses on by_category"""
+        catalog.bump_catalog_version()
+        barrier = threading.Barrier(concurrency)
+        counts = []
+
+        def request():
+            try:
+                barrier.wait()
+                with CaptureQueriesContext(connections['default']) as queries:
+                    catalog.by_category_sections()
+                counts.append(len(queries))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=request) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(counts), concurrency)
+        return sum(counts)
+
+    def test_query_count_is_constant_as_concurrency_grows(self):
+        counts = {concurrency: self.queries_for(concurrency) for concurrency in (1, 10, 50)}
+        self.assertGreater(counts[1], 0)
+        self.assertEqual(counts[10], counts[1], counts)
+        self.assertEqual(counts[50], counts[1], counts)
+
+    def test_invalidated_payload_is_not_served_stale(self):
+        sections = catalog.by_category_sections()
+        Stream.objects.filter(pk=sections[0][1]['streams'][0]['id']).update(is_active=False)
+        catalog.bump_catalog_version()
+        refreshed = catalog.by_category_sections()
+        self.assertNotEqual(refreshed[0][1]['streams'][0]['id'], sections[0][1]['streams'][0]['id'])
+
+    def test_search_results_do_not_evict_catalog_payloads(self):
+        catalog.by_category_sections()
+        for i in range(400):
+            catalog.search_results(f'query {i}')
+        self.assertIsNotNone(cache.get('catalog:by_category'))
+
+
+class CatalogPublisherTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.enterContext(override_settings(
+            CATALOG_VERSION_FILE=os.path.join(self.root, 'catalog.version'),
+            CATALOG_PUBLISH_RETAIN=3600,
+        ))
+        self.streams = create_streams(3)
+
+    def manifest(self):
+        return publisher.CatalogPublisher(self.root).manifest
+
+    def test_files_are_named_by_content(self):
+        publisher.CatalogPublisher(self.root).publish()
+        files = self.manifest()['files']
+        self.assertRegex(files['categories'], r'^categories\.[0-9a-f]{16}\.json$')
+        self.assertRegex(files[f'streams/{self.streams[0].pk}'], r'^streams/\d+\.[0-9a-f]{16}\.json$')
+        for path in files.values():
+            self.assertTrue(os.path.exists(os.path.join(self.root, path)))
+            self.assertTrue(os.path.exists(os.path.join(self.root, path + '.gz')))
+
+    def test_replaced_files_are_kept_then_deleted(self):
+        publisher.CatalogPublisher(self.root).publish()
+        old = self.manifest()['files']['trending']
+        Stream.objects.filter(pk=self.streams[-1].pk).update(view_count=100)
+
+        publisher.CatalogPublisher(self.root).publish([])
+        new = self.manifest()['files']['trending']
+        self.assertNotEqual(new, old)
+        self.assertTrue(os.path.exists(os.path.join(self.root, old)))
+
+        with override_settings(CATALOG_PUBLISH_RETAIN=0):
+            publisher.CatalogPublisher(self.root).publish([])
+        self.assertFalse(os.path.exists(os.path.join(self.root, old)))
+        self.assertTrue(os.path.exists(os.path.join(self.root, new)))
+
+    def test_publishers_started_together_do_not_lose_updates(self):
+        # Two processes, each created before the other published
+        first = publisher.CatalogPublisher(self.root)
+        second = publisher.CatalogPublisher(self.root)
+        first.publish()
+        Stream.objects.filter(pk=self.streams[0].pk).update(title='Renamed')
+        second.publish([self.streams[0].pk])
+
+        manifest = self.manifest()
+        self.assertEqual(manifest['version'], 2)
+        # The second publish kept the first one's files for the other streams
+        self.assertIn(f'streams/{self.streams[1].pk}', manifest['files'])
+        with open(os.path.join(self.root, manifest['files'][f'streams/{self.streams[0].pk}'])) as f:
+            self.assertIn('Renamed', f.read())
+
+    def test_view_counts_schedule_a_trending_publish(self):
+        with override_settings(CATALOG_PUBLISH_ENABLED=True), \
+                mock.patch.object(publisher, 'schedule_publish') as schedule_publish:
+            response = self.client.post(
+                f'/api/streams/{self.streams[0].pk}/increment_view/', content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200)
+        schedule_publish.assert_called_once_with([], delay=settings.CATALOG_PUBLISH_TRENDING_INTERVAL)
+
+
+class PublishScheduleTests(SimpleTestCase):
+    def setUp(self):
+        self.enterContext(override_settings(CATALOG_PUBLISH_ENABLED=True, CATALOG_PUBLISH_DEBOUNCE=0.05))
+        self.published = threading.Event()
+        self.publisher = self.enterContext(mock.patch.object(publisher, 'CatalogPublisher'))
+        self.publisher.return_value.publish.side_effect = lambda stream_ids: self.published.set()
+        self.addCleanup(self.cancel_pending)
+
+    def cancel_pending(self):
+        with publisher._pending_lock:
+            if publisher._timer is not None:
+                publisher._timer.cancel()
+            publisher._timer = publisher._deadline = None
+            publisher._pending.clear()
+
+    def test_a_catalog_change_brings_a_pending_trending_refresh_forward(self):
+        publisher.schedule_publish([], delay=300)  # A view was counted
+        publisher.schedule_publish([7])
+        self.assertTrue(self.published.wait(5))
+        self.publisher.return_value.publish.assert_called_once_with([7])
+        time.sleep(0.2)  # The replaced timer never publishes
+        self.publisher.return_value.publish.assert_called_once()
+        self.assertIsNone(publisher._timer)
+
+    def test_a_later_deadline_does_not_delay_a_pending_publish(self):
+        publisher.schedule_publish([7])
+        publisher.schedule_publish([8], delay=300)
+        self.assertTrue(self.published.wait(5))
+        self.assertEqual(sorted(self.publisher.return_value.publish.call_args.args[0]), [7, 8])
+
+
+class HomeBundleTests(TransactionTestCase):
+    """Sections are built on their own connections, so the rows must be committed"""
+
+    def setUp(self):
+        cache.clear()
+        create_streams(3, category=Category.objects.create(name='Movies'), is_featured=True)
+        create_streams(2, category=Category.objects.create(name='Series'), is_live=True, view_count=10)
+
+    def separate_endpoints(self):
+        cache.clear()
+        return {
+            'categories': self.client.get('/api/categories/').json()['results'],
+            'featured': self.client.get('/api/streams/featured/').json(),
+            'by_category': self.client.get('/api/streams/by_category/').json(),
+            'trending': self.client.get('/api/streams/trending/').json(),
+            'live': self.client.get('/api/streams/live/').json(),
+        }
+
+    def test_matches_the_separate_endpoints(self):
+        expected = self.separate_endpoints()
+        for workers in (1, 4):
+            with self.subTest(workers=workers), override_settings(HOME_BUILD_WORKERS=workers):
+                cache.clear()
+                home = self.client.get('/api/home/').json()
+                self.assertEqual(home.pop('version'), catalog.catalog_version())
+                self.assertEqual(home, expected)
+
+    @override_settings(HOME_BUILD_WORKERS=4)
+    def test_sections_are_built_concurrently_once(self):
+        threads = []
+
+        def build_featured():
+            threads.append(threading.current_thread().name)
+            return []
+
+        with mock.patch.object(catalog, 'build_featured', side_effect=build_featured):
+            self.client.get('/api/home/')
+            self.client.get('/api/home/')
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith('home-build'))
+
+
+class WatchHistoryThrottleTests(TestCase):
+    def setUp(self):
+        # DRF reads the rates once, at import
+        self.enterContext(mock.patch.dict(DeviceRateThrottle.THROTTLE_RATES, {'track': '2/min'}))
+        cache.clear()
+        self.stream = create_streams(1)[0]
+
+    def post(self, url):
+        return self.client.post(
+            url, {'stream': self.stream.pk, 'device_id': 'device-1', 'watch_duration': 30},
+            content_type='application/json',
+        )
+
+    def test_create_shares_the_track_limit(self):
+        self.assertEqual(self.post('/api/watch-history/').status_code, 201)
+        self.assertEqual(self.post('/api/watch-history/track/').status_code, 201)
+        self.assertEqual(self.post('/api/watch-history/').status_code, 429)
+        self.assertEqual(self.post('/api/watch-history/track/').status_code, 429)
+
+
+class MessagePackTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.stream = create_streams(1, rating='8.5')[0]
+
+    def test_response_carries_the_same_data_as_json(self):
+        as_json = self.client.get('/api/streams/', HTTP_ACCEPT='application/json')
+        as_msgpack = self.client.get('/api/streams/', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(as_msgpack['Content-Type'], 'application/msgpack')
+        data = msgpack.unpackb(as_msgpack.content)
+        self.assertEqual(data, as_json.json())
+        self.assertEqual(data['results'][0]['rating'], '8.5')
+
+    def test_request_body(self):
+        body = msgpack.packb({'stream': self.stream.pk, 'device_id': 'device-1', 'watch_duration': 30,
+                              'completed': True})
+        response = self.client.post('/api/watch-history/track/', body, content_type='application/msgpack')
+        self.assertEqual(response.status_code, 201)
+        event = WatchHistory.objects.get()
+        self.assertEqual((event.stream_id, event.device_id, event.watch_duration, event.completed),
+                         (self.stream.pk, 'device-1', 30, True))
+
+    def test_malformed_body(self):
+        for body in (b'\xc1', msgpack.packb({'stream': self.stream.pk})[:-1], b'\x93\x01'):
+            with self.subTest(body=body):
+                response = self.client.post('/api/watch-history/track/', body, content_type='application/msgpack')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('MessagePack parse error', response.json()['detail'])
+        self.assertFalse(WatchHistory.objects.exists())
+
+
+class PeopleSyncTests(TestCase):
+    def setUp(self):
+        self.stream = Stream.objects.create(
+            title='Film', category=Category.objects.create(name='Films'), url='https://example.com/film.m3u8',
+            cast='Ann Lee, Bo Park', director='Cy Dean',
+        )
+
+    def test_credits_follow_the_text(self):
+        self.assertEqual([p.name for p in self.stream.cast_members.order_by('cast_credits__billing_order')],
+                         ['Ann Lee', 'Bo Park'])
+        self.stream.cast = 'Bo Park'
+        self.stream.save()
+        self.assertEqual([p.name for p in self.stream.cast_members.all()], ['Bo Park'])
+        self.assertEqual([p.name for p in self.stream.directors.all()], ['Cy Dean'])
+
+    def test_unchanged_people_are_not_rebuilt(self):
+        self.stream.title = 'Film (Remastered)'
+        with mock.patch('streams.people.sync_people') as sync_people:
+            self.stream.save()
+            Stream.objects.get(pk=self.stream.pk).save()
+        sync_people.assert_not_called()
+
+        self.stream.director = 'Di Egan'
+        with mock.patch('streams.people.sync_people') as sync_people:
+            self.stream.save(update_fields=['title', 'director'])
+        sync_people.assert_called_once_with(self.stream)
+
+
+class LiveEventsTests(TestCase):
+    def setUp(self):
+        self.enterContext(override_settings(EVENTS_REDIS_URL='', EVENTS_HEARTBEAT=60))
+        self.broker = events.EventBroker(100)
+        self.enterContext(mock.patch.object(events, '_broker', self.broker))
+        self.stream = create_streams(1)[0]
+
+    def published(self):
+        return [json.loads(data) for _, _, data in self.broker.since(0) or []]
+
+    def test_only_changed_flags_are_published(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            stream = Stream.objects.get(pk=self.stream.pk)
+            stream.title = 'Renamed'
+            stream.save()
+            stream.is_live = True
+            stream.save()
+            Stream.objects.filter(pk=stream.pk).update(is_featured=True)
+            stream = Stream.objects.get(pk=stream.pk)
+            stream.is_featured = False
+            stream.save(update_fields=['is_featured'])
+        self.assertEqual(self.published(), [
+            {'ids': [stream.pk], 'is_live': True},
+            {'ids': [stream.pk], 'is_featured': False},
+        ])
+
+    def read_events(self, chunks, path='/api/streams/events/', **headers):
+        """The first chunks of an SSE response"""
+        async def main():
+            response = await AsyncClient().get(path, headers=headers)
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            received = []
+            async with asyncio.timeout(5):
+                async for chunk in response.streaming_content:
+                    received.append(chunk.decode())
+                    if len(received) == chunks:
+                        break
+            await response.streaming_content.aclose()
+            return received
+
+        return asyncio.run(main())
+
+    def test_reconnect_replays_from_the_ring_buffer(self):
+        self.enterContext(mock.patch.object(events, '_broker', events.EventBroker(3)))
+        for i in range(1, 6):
+            events.publish('stream', {'ids': [i], 'is_live': True})
+
+        retry, replay = self.read_events(2, **{'Last-Event-ID': '3'})
+        self.assertEqual(retry, f'retry: {events.RETRY_MS}\n\n')
+        self.assertEqual(replay, (
+            'id: 4\nevent: stream\ndata: {"ids":[4],"is_live":true}\n\n'
+            'id: 5\nevent: stream\ndata: {"ids":[5],"is_live":true}\n\n'
+        ))
+        self.assertEqual(self.read_events(2, path='/api/streams/events/?last_event_id=4')[1],
+                         'id: 5\nevent: stream\ndata: {"ids":[5],"is_live":true}\n\n')
+
+    def test_reconnect_past_the_ring_buffer_resets(self):
+        self.enterContext(mock.patch.object(events, '_broker', events.EventBroker(3)))
+        for i in range(1, 6):
+            events.publish('stream', {'ids': [i], 'is_live': True})
+        # Event 2 has been pushed out of the buffer
+        self.assertEqual(self.read_events(2, **{'Last-Event-ID': '1'})[1], 'id: 5\nevent: reset\ndata: {}\n\n')
+        # No Last-Event-ID: a fresh client starts from the current event
+        self.assertEqual(self.read_events(2)[1], 'id: 5\nevent: ready\ndata: {}\n\n')
+
+    def test_ten_thousand_idle_connections(self):
+        connections_count = 10000
+
+        async def main():
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            streams = [events.event_stream() for _ in range(connections_count)]
+            for stream in streams:
+                await anext(stream)  # retry
+                await anext(stream)  # ready
+            waiting = [asyncio.ensure_future(anext(stream)) for stream in streams]
+            await asyncio.sleep(0)
+            per_connection = (tracemalloc.get_traced_memory()[0] - before) / connections_count
+            tracemalloc.stop()
+
+            # Idle connections share one wakeup per event loop
+            self.assertEqual(len(self.broker._wakeups), 1)
+            events.publish('stream', {'ids': [1], 'is_live': True})
+            async with asyncio.timeout(30):
+                received = await asyncio.gather(*waiting)
+            for stream in streams:
+                await stream.aclose()
+            return per_connection, received
+
+        per_connection, received = asyncio.run(main())
+        self.assertLess(per_connection, 8192)
+        self.assertEqual(set(received), {'id: 1\nevent: stream\ndata: {"ids":[1],"is_live":true}\n\n'})
+
+
+class RebuildStatsTests(TestCase):
+    def test_pruned_history_is_kept(self):
+        stream, other = create_streams(2)
+        for i in range(6):
+            WatchHistory.objects.create(
+                stream=stream if i % 3 else other, device_id=f'device-{i}', watch_duration=60, completed=i % 2 == 0,
+            )
+        # Half of the events fall out of the retention period
+        WatchHistory.objects.filter(device_id__in=['device-0', 'device-1', 'device-2']).update(
+            watched_at=timezone.now() - timedelta(days=100)
+        )
+        call_command('prune_watch_history', days=90, stdout=StringIO())
+        self.assertEqual(WatchHistory.objects.count(), 3)
+        expected = {
+            stats.stream_id: (stats.plays, stats.total_seconds, stats.completions, stats.unique_devices)
+            for stats in StreamStats.objects.all()
+        }
+        category = CategoryStats.objects.get()
+        self.assertEqual(category.plays, 6)
+
+        rebuild_stats()
+        self.assertEqual({
+            stats.stream_id: (stats.plays, stats.total_seconds, stats.completions, stats.unique_devices)
+            for stats in StreamStats.objects.all()
+        }, expected)
+        self.assertEqual(expected[stream.pk], (4, 240, 2, 4))
+        rebuilt = CategoryStats.objects.get()
+        self.assertEqual((rebuilt.plays, rebuilt.total_seconds, rebuilt.completions, rebuilt.unique_devices),
+                         (category.plays, category.total_seconds, category.completions, category.unique_devices))
+
+
+class PruneWatchHistoryTests(TestCase):
+    def test_retention_boundary(self):
+        stream = create_streams(1)[0]
+        cutoff = timezone.make_aware(datetime.combine(timezone.localdate() - timedelta(days=90), datetime.min.time()))
+        WatchHistory.objects.create(stream=stream, device_id='at-cutoff', watch_duration=30, watched_at=cutoff)
+        WatchHistory.objects.create(stream=stream, device_id='just-before', watch_duration=60, completed=True,
+                                    watched_at=cutoff - timedelta(microseconds=1))
+
+        call_command('prune_watch_history', days=90, stdout=StringIO())
+
+        self.assertEqual(list(WatchHistory.objects.values_list('device_id', flat=True)), ['at-cutoff'])
+        daily = WatchHistoryDaily.objects.get()
+        self.assertEqual((daily.stream_id, daily.date, daily.views, daily.total_seconds, daily.completions),
+                         (stream.pk, cutoff.date() - timedelta(days=1), 1, 60, 1))
+
+
+class ExportWatchHistoryTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.stream = create_streams(1, category=Category.objects.create(name='Films'), release_year=1999)[0]
+        self.hour_ago = timezone.now() - timedelta(hours=1)
+
+    def track(self, count, watched_at):
+        WatchHistory.objects.bulk_create(
+            WatchHistory(stream=self.stream, device_id=f'device-{i}', watch_duration=i, watched_at=watched_at)
+            for i in range(count)
+        )
+
+    def export(self, *args):
+        path = os.path.join(self.directory, f'export-{len(os.listdir(self.directory))}.csv.gz')
+        call_command('export_watch_history', '--output', path, '--chunk-size', '2', *args, stdout=StringIO())
+        with gzip.open(path, 'rt', newline='') as f:
+            return list(csv.DictReader(f))
+
+    def test_csv_columns_and_rows(self):
+        self.track(5, self.hour_ago)
+        rows = self.export()
+        self.assertEqual(list(rows[0]), [name for name, _ in exports.COLUMNS])
+        self.assertEqual([row['device_id'] for row in rows], [f'device-{i}' for i in range(5)])
+        self.assertEqual(
+            {key: rows[3][key] for key in ('shard', 'watch_duration', 'stream_title', 'category_name', 'release_year')},
+            {'shard': 'default', 'watch_duration': '3', 'stream_title': self.stream.title,
+             'category_name': 'Films', 'release_year': '1999'},
+        )
+        self.assertEqual(rows[0]['watched_at'], self.hour_ago.isoformat())
+        self.assertEqual([name for name in os.listdir(self.directory) if name.endswith('.tmp')], [])
+
+    def test_since_and_until(self):
+        self.track(2, self.hour_ago - timedelta(days=2))
+        self.track(3, self.hour_ago)
+        day = (self.hour_ago - timedelta(days=1)).isoformat()
+        self.assertEqual(len(self.export('--since', day)), 3)
+        self.assertEqual(len(self.export('--until', day)), 2)
+
+    def test_incremental_runs_export_each_event_once(self):
+        self.track(3, self.hour_ago)
+        self.assertEqual(len(self.export('--incremental')), 3)
+        self.assertEqual(self.export('--incremental'), [])
+
+        self.track(2, self.hour_ago)
+        # Too recent to be safe to export yet
+        self.track(1, timezone.now())
+        self.assertEqual(len(self.export('--incremental')), 2)
+        self.assertEqual(ExportWatermark.objects.get(name='watch_history').rows_exported, 5)
+
+    @skipUnless(find_spec('pyarrow'), 'needs pyarrow')
+    def test_parquet(self):
+        import pyarrow.parquet as pq
+
+        self.track(5, self.hour_ago)
+        path = os.path.join(self.directory, 'export.parquet')
+        call_command('export_watch_history', '--format', 'parquet', '--output', path, '--chunk-size', '2',
+                     stdout=StringIO())
+        table = pq.read_table(path)
+        self.assertEqual(table.column_names, [name for name, _ in exports.COLUMNS])
+        self.assertEqual(table.column('watch_duration').to_pylist(), list(range(5)))
+
+
+class BulkJobTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Jobs')
+        self.streams = create_streams(7, category=self.category)
+
+    def test_selected_ids_are_copied_in_the_database(self):
+        with CaptureQueriesContext(connections['default']) as queries:
+            job = jobs.enqueue('make_featured', Stream.objects.filter(category=self.category))
+        # Job INSERT, targets INSERT ... SELECT, total UPDATE; no stream rows are read
+        statements = [query['sql'].split()[0] for query in queries]
+        statements = [sql for sql in statements if sql not in ('SAVEPOINT', 'RELEASE')]
+        self.assertEqual(statements, ['INSERT', 'INSERT', 'UPDATE'])
+        self.assertEqual(job.total, 7)
+        self.assertEqual(sorted(job.targets.values_list('stream_id', flat=True)),
+                         [stream.pk for stream in self.streams])
+
+        # The selection is fixed when the job is queued
+        late = create_streams(1, category=self.category)[0]
+        run_job(jobs.claim_next_job(), batch_size=3)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed, job.total), (BulkJob.STATUS_COMPLETED, 7, 7))
+        self.assertEqual(Stream.objects.filter(category=self.category, is_featured=True).count(), 7)
+        self.assertFalse(Stream.objects.get(pk=late.pk).is_featured)
+
+    def test_admin_action_is_queued_then_run(self):
+        other = create_streams(2)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.post(f'/admin/streams/stream/?category__id__exact={self.category.pk}', {
+            'action': 'deactivate',
+            'select_across': '1',
+            'index': '0',
+            '_selected_action': [self.streams[0].pk],
+        })
+        self.assertEqual(response.status_code, 302)
+        job = BulkJob.objects.get()
+        self.assertEqual((job.status, job.total), (BulkJob.STATUS_PENDING, 7))
+        self.assertEqual(Stream.objects.filter(is_active=False).count(), 0)
+
+        call_command('run_jobs', '--once', '--batch-size', '2', stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed), (BulkJob.STATUS_COMPLETED, 7))
+        self.assertEqual(set(Stream.objects.filter(is_active=False)), set(self.streams))
+        self.assertTrue(all(stream.is_active for stream in Stream.objects.filter(pk__in=[s.pk for s in other])))
+
+    def test_a_runner_stops_once_its_job_is_taken_over(self):
+        jobs.enqueue('make_featured', Stream.objects.filter(category=self.category))
+        stalled = jobs.claim_next_job()
+        BulkJob.objects.filter(pk=stalled.pk).update(updated_at=timezone.now() - timedelta(days=1))
+        takeover = jobs.claim_next_job()
+        self.assertEqual(takeover.pk, stalled.pk)
+        self.assertNotEqual(takeover.runner, stalled.runner)
+
+        with self.assertRaises(JobTakenOver):
+            run_job(stalled, batch_size=3)
+        self.assertFalse(Stream.objects.filter(is_featured=True).exists())
+
+        run_job(takeover, batch_size=3)
+        self.assertEqual(Stream.objects.filter(is_featured=True).count(), 7)
+        self.assertEqual(BulkJob.objects.get(pk=takeover.pk).status, BulkJob.STATUS_COMPLETED)
+
+
+class SimilarStreamsTests(TestCase):
+    def setUp(self):
+        self.stream, self.neighbour, self.inactive = create_streams(3)
+        Stream.objects.filter(pk=self.inactive.pk).update(is_active=False)
+        StreamSimilarity.objects.bulk_create([
+            StreamSimilarity(stream=self.stream, similar=self.neighbour, rank=0, score=0.9),
+            StreamSimilarity(stream=self.stream, similar=self.inactive, rank=1, score=0.8),
+            StreamSimilarity(stream=self.inactive, similar=self.neighbour, rank=0, score=0.9),
+        ])
+
+    def test_neighbours_of_active_streams(self):
+        response = self.client.get(f'/api/streams/{self.stream.pk}/similar/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([stream['id'] for stream in response.json()], [self.neighbour.pk])
+
+    def test_inactive_and_unknown_streams_are_not_found(self):
+        for pk in (self.inactive.pk, 999999, 'abc'):
+            with self.subTest(pk=pk):
+                self.assertEqual(self.client.get(f'/api/streams/{pk}/similar/').status_code, 404)
+
+
+@skipUnless(find_spec('numpy') and find_spec('scipy'), 'needs numpy and scipy')
+class BuildSimilarStreamsTests(TestCase):
+    def setUp(self):
+        self.a, self.b, self.c = create_streams(3)
+        # a is watched with b by two devices and with c by one; repeat views count once
+        WatchHistory.objects.bulk_create(
+            WatchHistory(stream=stream, device_id=device_id)
+            for device_id, stream in [
+                ('device-1', self.a), ('device-1', self.a), ('device-1', self.b),
+                ('device-2', self.a), ('device-2', self.b),
+                ('device-3', self.a), ('device-3', self.c),
+            ]
+        )
+
+    def neighbours(self, stream):
+        return [
+            (row.similar_id, round(row.score, 4), row.source)
+            for row in StreamSimilarity.objects.filter(stream=stream).order_by('rank')
+        ]
+
+    def test_cowatch_scores_are_cosine_similarity(self):
+        recommendations.build_similar_streams(k=2)
+        self.assertEqual(self.neighbours(self.a), [
+            (self.b.pk, round(2 / (3 ** 0.5 * 2 ** 0.5), 4), StreamSimilarity.SOURCE_COWATCH),
+            (self.c.pk, round(1 / 3 ** 0.5, 4), StreamSimilarity.SOURCE_COWATCH),
+        ])
+
+    def test_short_neighbour_lists_are_filled_from_metadata(self):
+        Stream.objects.filter(pk=self.a.pk).update(is_active=False)
+        self.assertEqual(recommendations.build_similar_streams(k=2), (0, 2))
+        # b and c were only watched with a, which is inactive now: the category fills in
+        self.assertEqual(self.neighbours(self.b), [(self.c.pk, 0.1, StreamSimilarity.SOURCE_METADATA)])
+
+        Stream.objects.filter(pk=self.a.pk).update(is_active=True)
+        self.assertEqual(recommendations.build_similar_streams(k=2), (3, 2))
+        self.assertEqual(self.neighbours(self.b), [
+            (self.a.pk, round(2 / (3 ** 0.5 * 2 ** 0.5), 4), StreamSimilarity.SOURCE_COWATCH),
+            (self.c.pk, 0.1, StreamSimilarity.SOURCE_METADATA),
+        ])
+
+
+# Defined in sune_backend.test_settings
+TEST_SHARDS = {'history_0', 'history_1'}
+
+
+@skipUnless(TEST_SHARDS <= set(settings.DATABASES), 'run with --settings=sune_backend.test_settings')
+@override_settings(WATCH_HISTORY_SHARDS=sorted(TEST_SHARDS))
+class ReshardTests(TestCase):
+    databases = {'default'} | (TEST_SHARDS & set(settings.DATABASES))
+
+    def setUp(self):
+        self.stream = create_streams(1)[0]
+        self.watched_at = timezone.now() - timedelta(days=30)
+        # Everything starts on history_0, as if it were the only shard
+        WatchHistory.objects.using('history_0').bulk_create(
+            WatchHistory(stream=self.stream, device_id=f'device-{i}', event_id=f'event-{i}',
+                         watch_duration=i, watched_at=self.watched_at)
+            for i in range(40)
+        )
+        self.moving = [f'device-{i}' for i in range(40) if shard_for(f'device-{i}') == 'history_1']
+
+    def test_events_move_with_their_fields(self):
+        call_command('reshard_watch_history', '--from', 'history_0', '--batch-size', '7', stdout=StringIO())
+
+        self.assertEqual(set(WatchHistory.objects.using('history_1').values_list('device_id', flat=True)),
+                         set(self.moving))
+        self.assertEqual(WatchHistory.objects.using('history_0').count(), 40 - len(self.moving))
+        for event in WatchHistory.objects.using('history_1'):
+            i = int(event.device_id.split('-')[1])
+            self.assertEqual((event.event_id, event.watch_duration, event.watched_at),
+                             (f'event-{i}', i, self.watched_at))
+
+    def test_events_already_copied_are_skipped(self):
+        events = list(WatchHistory.objects.using('history_0').filter(device_id__in=self.moving))
+        copy_history(events[:3], 'history_1')
+        copy_history(events, 'history_1')
+        self.assertEqual(WatchHistory.objects.using('history_1').count(), len(self.moving))
+
+    def test_rerun_after_an_interrupted_delete_does_not_duplicate(self):
+        WatchHistory.objects.using('history_0').update(event_id=None)
+        # The batch reached the target, then the run stopped before deleting it
+        copy_history(WatchHistory.objects.using('history_0').filter(device_id__in=self.moving), 'history_1')
+
+        call_command('reshard_watch_history', '--from', 'history_0', '--batch-size', '7', stdout=StringIO())
+
+        self.assertEqual(sorted(WatchHistory.objects.using('history_1').values_list('device_id', flat=True)),
+                         sorted(self.moving))
+        self.assertFalse(WatchHistory.objects.using('history_0').filter(device_id__in=self.moving).exists())
+
+
+class CategoryIconTests(TestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.enterContext(override_settings(MEDIA_ROOT=root, ICON_CACHE_ROOT=os.path.join(root, 'icons')))
+        self.enterContext(mock.patch.object(icons, '_cache', None))
+        self.enterContext(mock.patch.object(icons, '_undecodable', set()))
+        os.makedirs(os.path.join(root, 'categories'))
+        with open(os.path.join(root, 'categories', 'bomb.png'), 'wb') as f:
+            f.write(b'not really an image')
+        Category.objects.create(name='Bombs', slug='bombs')
+        Category.objects.filter(slug='bombs').update(icon='categories/bomb.png', icon_hash='ab' * 32)
+
+    def test_undecodable_icons_are_not_decoded_again(self):
+        url = f'/api/categories/bombs/icon/{settings.ICON_SIZES[0]}/webp/'
+        bomb = Image.DecompressionBombError('Image size exceeds limit')
+        with mock.patch.object(icons, 'render_variant', side_effect=bomb) as render_variant, \
+                self.assertLogs('streams.icons', 'WARNING'):
+            self.assertEqual(self.client.get(url).status_code, 404)
+            self.assertEqual(self.client.get(url).status_code, 404)
+        render_variant.assert_called_once()
+
+    def test_variant_urls_match_with_and_without_a_request(self):
+        for site_url in ('', 'https://api.sunetv.example'):
+            with self.subTest(site_url=site_url), override_settings(SITE_URL=site_url):
+                live = self.client.get('/api/categories/bombs/').json()['icon_variants']
+                cached = next(row for row in catalog.build_categories() if row['slug'] == 'bombs')['icon_variants']
+                self.assertEqual(live, cached)
+                self.assertEqual(live[str(settings.ICON_SIZES[0])]['webp'],
+                                 f'{site_url}/api/categories/bombs/icon/{settings.ICON_SIZES[0]}/webp/?v={"ab" * 6}')
+
+
+class AdminChangelistQueryTests(TestCase):
+    """Changelist pages cost the same number of queries however big the table"""
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    def changelist_queries(self, url):
+        with CaptureQueriesContext(connections['default']) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_stream_changelist(self):
+        create_streams(3)
+        few = self.changelist_queries('/admin/streams/stream/')
+        for _ in range(10):
+            streams = create_streams(10)
+            StreamStats.objects.bulk_create(StreamStats(stream=stream, plays=5) for stream in streams)
+        self.assertEqual(self.changelist_queries('/admin/streams/stream/'), few)
+
+    def test_watch_history_changelist_at_a_million_rows(self):
+        stream = create_streams(1)[0]
+        WatchHistory.objects.bulk_create(
+            WatchHistory(stream=stream, device_id=f'device-{i}') for i in range(10)
+        )
+        few = self.changelist_queries('/admin/streams/watchhistory/')
+
+        with connections['default'].cursor() as cursor:
+            cursor.execute(
+                'WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 1000000) '
+                'INSERT INTO streams_watchhistory (stream_id, device_id, watched_at, watch_duration, completed) '
+                "SELECT %s, 'device-' || (i % 5000), datetime('now', '-' || (i % 90) || ' days'), 60, 0 FROM n",
+                [stream.pk],
+            )
+        self.assertGreater(WatchHistory.objects.count(), 1000000)
+        self.assertEqual(self.changelist_queries('/admin/streams/watchhistory/'), few)
+        # Searches add one indexed lookup of the device ID
+        self.assertEqual(self.changelist_queries('/admin/streams/watchhistory/?q=device-42'), few + 1)
+        self.assertEqual(self.changelist_queries('/admin/streams/watchhistory/?q=Stream'), few + 1)
+
+    def test_large_postgresql_tables_use_the_row_estimate(self):
+        cursor = mock.MagicMock()
+        cursor.fetchone.return_value = (2500000,)
+        connection = mock.MagicMock(vendor='postgresql')
+        connection.cursor.return_value.__enter__.return_value = cursor
+        with mock.patch.object(paginators, 'connections', {'default': connection}):
+            paginator = paginators.EstimatedCountPaginator(WatchHistory.objects.all(), 100)
+            self.assertEqual(paginator.count, 2500000)
+            filtered = paginators.EstimatedCountPaginator(WatchHistory.objects.filter(completed=True), 100)
+            self.assertEqual(filtered.count, 0)  # Filtered lists are counted exactly
+        cursor.execute.assert_called_once()
+
+
+@skipUnless(settings.DATABASES['default'].get('OPTIONS') == settings.SQLITE_TUNING_OPTIONS,
+            'run with --settings=sune_backend.test_settings')
+class SQLiteTuningTests(TransactionTestCase):
+    def test_pragmas_are_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+
+    def test_writers_take_the_lock_when_the_transaction_starts(self):
+        create_streams(1)
+        entered, release = threading.Event(), threading.Event()
+
+        def write():
+            try:
+                with serialized_write():
+                    entered.set()
+                    release.wait(5)
+            finally:
+                connections.close_all()
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        other = sqlite3.connect(connection.settings_dict['NAME'], timeout=0)
+        try:
+            self.assertTrue(entered.wait(5))
+            # Readers carry on next to the open write transaction...
+            self.assertEqual(other.execute('SELECT COUNT(*) FROM streams_stream').fetchone()[0], 1)
+            # ...while another writer has to wait, although nothing was written yet
+            with self.assertRaisesMessage(sqlite3.OperationalError, 'database is locked'):
+                other.execute('BEGIN IMMEDIATE')
+        finally:
+            other.close()
+            release.set()
+            thread.join()
+
+
+def in_memory_test_db():
+    """
+    Whether the default test database is SQLite shared-cache memory
+
+    Concurrent writers there fail at once with "database table is locked"
+    instead of waiting for each other like they do on a database file.
+    """
+    database = settings.DATABASES['default']
+    name = database.get('TEST', {}).get('NAME')
+    return database['ENGINE'] == 'django.db.backends.sqlite3' and (not name or name == ':memory:')
+
+
+@skipIf(in_memory_test_db(), 'concurrent writers need a file-backed test database '
+                             '(run with --settings=sune_backend.test_settings)')
+class EventDedupTests(TransactionTestCase):
+    """Retries of one event racing each other are recorded once"""
+
+    def setUp(self):
+        cache.clear()
+        self.enterContext(mock.patch.object(dedup, '_seen', None))
+        self.stream = create_streams(1)[0]
+
+    def retry_concurrently(self, retries, event_id):
+        barrier = threading.Barrier(retries)
+        responses = [None] * retries
+
+        def send(i):
+            try:
+                barrier.wait()
+                responses[i] = Client().post('/api/watch-history/track/', {
+                    'stream': self.stream.pk, 'device_id': 'device-1', 'watch_duration': 30, 'event_id': event_id,
+                }, content_type='application/json')
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=send, args=(i,)) for i in range(retries)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    def test_concurrent_retries(self):
+        for retries in (2, 10, 25):
+            with self.subTest(retries=retries):
+                responses = self.retry_concurrently(retries, f'event-{retries}')
+                self.assertEqual(sorted(response.status_code for response in responses),
+                                 [200] * (retries - 1) + [201])
+                events = WatchHistory.objects.filter(event_id=f'event-{retries}')
+                self.assertEqual(events.count(), 1)
+                self.assertEqual({response.json()['id'] for response in responses}, {events.get().pk})
+
+        # Stats count each event once
+        stats = StreamStats.objects.get(stream=self.stream)
+        self.assertEqual((stats.plays, stats.total_seconds), (3, 90))
+
+    def test_retries_after_the_filter_is_lost(self):
+        self.retry_concurrently(1, 'event-1')
+        # A restarted worker, or a retry sent to another one
+        with mock.patch.object(dedup, '_seen', None):
+            responses = self.retry_concurrently(5, 'event-1')
+        self.assertEqual({response.status_code for response in responses}, {200})
+        self.assertEqual(WatchHistory.objects.filter(event_id='event-1').count(), 1)
+
+
+class StreamBatchTests(TestCase):
+    def setUp(self):
+        self.streams = create_streams(4)
+        Stream.objects.filter(pk=self.streams[3].pk).update(is_active=False)
+
+    def post(self, ids):
+        return self.client.post('/api/streams/batch/', {'ids': ids}, content_type='application/json')
+
+    def test_results_keep_the_requested_order(self):
+        ids = [self.streams[2].pk, self.streams[0].pk, self.streams[1].pk]
+        for response in (self.post(ids), self.client.get('/api/streams/batch/', {'ids': ','.join(map(str, ids))})):
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([stream['id'] for stream in response.json()['results']], ids)
+            self.assertEqual(response.json()['missing'], [])
+
+    def test_missing_and_inactive_ids_are_omitted(self):
+        response = self.post([self.streams[1].pk, 999999, self.streams[3].pk, self.streams[0].pk])
+        self.assertEqual([stream['id'] for stream in response.json()['results']],
+                         [self.streams[1].pk, self.streams[0].pk])
+        self.assertEqual(response.json()['missing'], [999999, self.streams[3].pk])
+
+    def test_batch_size_is_capped(self):
+        with override_settings(STREAM_BATCH_MAX_IDS=3):
+            self.assertEqual(self.post([1, 2, 3]).status_code, 200)
+            self.assertEqual(self.post([1, 2, 3, 4]).status_code, 400)
+            self.assertEqual(self.post([1, 2, 3, 3, 2]).status_code, 200)  # Duplicates count once
+
+    def test_invalid_ids_are_rejected(self):
+        for ids in ([10 ** 30], [-2 ** 63 - 1], ['abc'], '12', [None]):
+            with self.subTest(ids=ids):
+                response = self.post(ids)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': '"ids" must be a list of integer stream IDs'})
+
+    def test_views_are_not_counted(self):
+        self.post([stream.pk for stream in self.streams])
+        self.assertEqual(set(Stream.objects.values_list('view_count', flat=True)), {0})
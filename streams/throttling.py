@@ -0,0 +1,84 @@
+"""
+Sune TV - Rate limiting
+Per-action limits for public write and search endpoints, keyed by device
+"""
+
+import hashlib
+import time
+
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class DeviceRateThrottle(SimpleRateThrottle):
+    """
+    Sliding-window rate limit per device_id (or client IP), scoped per action
+
+    Actions opt in with a throttle_scope whose rate is configured in
+    REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']; views without a scope are not
+    limited. Counts live in the default cache using atomic add/incr, so the
+    limit holds across worker processes when the cache is Redis.
+
+    The window is approximated from two fixed-window counters, weighting the
+    previous window by how much of it still overlaps - two cache operations
+    per request instead of a list of timestamps.
+    """
+
+    def __init__(self):
+        # The scope comes from the view, so rate parsing waits for allow_request()
+        pass
+
+    def get_cache_key(self, request, view):
+        device_id = request.query_params.get('device_id')
+        if not device_id and request.method in ('POST', 'PUT', 'PATCH'):
+            data = request.data
+            device_id = data.get('device_id') if hasattr(data, 'get') else None
+
+        if device_id:
+            ident = 'device:' + hashlib.blake2b(str(device_id).encode(), digest_size=12).hexdigest()
+        else:
+            ident = 'ip:' + self.get_ident(request)
+        return f'throttle:{self.scope}:{ident}'
+
+    def allow_request(self, request, view):
+        self.scope = getattr(view, 'throttle_scope', None)
+        if not self.scope:
+            return True
+
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        if self.num_requests is None:
+            return True
+
+        key = self.get_cache_key(request, view)
+        now = time.time()
+        window, offset = divmod(now, self.duration)
+        window = int(window)
+        current_key = f'{key}:{window}'
+
+        # add() is a no-op if the counter exists, incr() is atomic
+        self.cache.add(current_key, 0, self.duration * 2)
+        try:
+            current = self.cache.incr(current_key)
+        except ValueError:
+            # Expired between add() and incr()
+            self.cache.set(current_key, 1, self.duration * 2)
+            current = 1
+        previous = self.cache.get(f'{key}:{window - 1}', 0)
+
+        overlap = 1 - offset / self.duration
+        if previous * overlap + current <= self.num_requests:
+            return True
+
+        self._wait = self._time_until_allowed(previous, current, offset)
+        return False
+
+    def _time_until_allowed(self, previous, current, offset):
+        """Seconds until the weighted count drops back under the limit"""
+        remaining = self.duration - offset
+        if current >= self.num_requests or not previous:
+            return remaining
+        needed_overlap = (self.num_requests - current) / previous
+        return max(1.0, (1 - needed_overlap) * self.duration - offset)
+
+    def wait(self):
+        return getattr(self, '_wait', None)
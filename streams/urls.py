@@ -1,14 +1,30 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CategoryViewSet, StreamViewSet, WatchHistoryViewSet
+from .views import (
+    CatalogMetricsView,
+    CategoryViewSet,
+    HomeView,
+    PersonViewSet,
+    StreamViewSet,
+    WatchHistoryViewSet,
+    category_icon,
+    stream_events,
+)
 
 # Create router and register viewsets
 router = DefaultRouter()
 router.register(r'categories', CategoryViewSet, basename='category')
 router.register(r'streams', StreamViewSet, basename='stream')
 router.register(r'watch-history', WatchHistoryViewSet, basename='watch-history')
+router.register(r'people', PersonViewSet, basename='person')
 
 urlpatterns = [
+    # Live status events (SSE) - before the router, which would take "events" as a stream pk
+    path('streams/events/', stream_events, name='stream-events'),
+    
+    # Resized category icons
+    path('categories/<slug:slug>/icon/<int:size>/<str:fmt>/', category_icon, name='category-icon'),
+    
     # Include all router URLs
     path('', include(router.urls)),
     
@@ -22,6 +38,12 @@ from .views import StreamViewSet
 
 urlpatterns += [
     path('stream/<int:pk>/', StreamViewSet.as_view({'get': 'retrieve'}), name='stream-detail-alt'),
+    
+    # Home screen bundle: GET /api/home/
+    path('home/', HomeView.as_view(), name='home'),
+    
+    # Catalog cache metrics (staff only): GET /api/catalog/metrics/
+    path('catalog/metrics/', CatalogMetricsView.as_view(), name='catalog-metrics'),
 ]
 
 
@@ -0,0 +1,54 @@
+"""
+Sune TV - Shared helpers
+"""
+
+import re
+
+# A unit must not run straight into more letters ("1h30min" is h + min, not
+# h + m), and the whole value has to be made of parts, so "2h15m" can't be
+# half-parsed into a wrong number
+_DURATION_PART = r'(\d+(?:\.\d+)?)\s*(h|hrs?|hours?|m|mins?|minutes?|s|secs?|seconds?)(?![a-z])'
+_DURATION_PARTS = re.compile(_DURATION_PART, re.IGNORECASE)
+_DURATION_FULL = re.compile(rf'(?:{_DURATION_PART}[\s,]*)+', re.IGNORECASE)
+_DURATION_CLOCK = re.compile(r'^(?:(\d+):)?(\d{1,2}):(\d{2})$')
+_UNIT_SECONDS = {'h': 3600, 'm': 60, 's': 1}
+
+
+def parse_duration(value):
+    """
+    Parse a display duration into whole seconds
+
+    Accepts "2h 15m", "2h15m", "9m 56s", "1h30min", "45 min", "1:30:00" /
+    "45:10" and a bare number of minutes ("90"). Returns None for blank or
+    unrecognised values, including ones only partly made of durations.
+    """
+    value = (value or '').strip()
+    if not value:
+        return None
+
+    clock = _DURATION_CLOCK.match(value)
+    if clock:
+        hours, minutes, seconds = clock.groups()
+        return int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds)
+
+    if value.isdigit():
+        return int(value) * 60
+
+    if not _DURATION_FULL.fullmatch(value):
+        return None
+    parts = _DURATION_PARTS.findall(value)
+    return int(sum(float(amount) * _UNIT_SECONDS[unit[0].lower()] for amount, unit in parts))
+
+
+_PEOPLE_SEPARATOR = re.compile(r'\s*(?:,|;|&|\band\b)\s*', re.IGNORECASE)
+
+
+def split_people(value):
+    """
+    Split a cast or director string into names, keeping billing order
+
+    "Tom Hanks, Meg Ryan" -> ["Tom Hanks", "Meg Ryan"]. Repeated names are
+    dropped.
+    """
+    names = [name.strip() for name in _PEOPLE_SEPARATOR.split(value or '')]
+    return list(dict.fromkeys(name for name in names if name))
@@ -3,22 +3,64 @@ Sune TV - API Views
 Handles HTTP requests and returns JSON responses
 """
 
+import logging
+import os
+
 from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from rest_framework.permissions import AllowAny
+from rest_framework.views import APIView
+from rest_framework.permissions import AllowAny, IsAdminUser
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
 from django_filters.rest_framework import DjangoFilterBackend
+from django.db import IntegrityError
 from django.db.models import Q
 
-from .models import Category, Stream, WatchHistory
+from . import dedup, icons, publisher
+from .catalog import (
+    active_categories,
+    build_featured,
+    build_live,
+    build_trending,
+    by_category_sections,
+    cache_metrics,
+    cached,
+    home_document,
+    search_results,
+)
+from .db import serialized_write
+from .events import event_stream
+from .feeds import get_device_feed, personalize
+from .filters import StreamFilter
+from .models import (
+    Category,
+    CategoryStats,
+    Person,
+    Stream,
+    StreamCast,
+    StreamDirector,
+    StreamSimilarity,
+    StreamStats,
+    WatchHistory,
+)
 from .serializers import (
     CategorySerializer,
+    CategoryStatsSerializer,
+    PersonSerializer,
+    StreamStatsSerializer,
     StreamListSerializer,
     StreamDetailSerializer,
     StreamCreateSerializer,
     WatchHistorySerializer,
     StreamsByCategorySerializer,
 )
+from .sharding import history_for, is_sharded, shard_for
+
+logger = logging.getLogger(__name__)
 
 
 class CategoryViewSet(viewsets.ModelViewSet):
@@ -31,11 +73,14 @@ class CategoryViewSet(viewsets.ModelViewSet):
     update: Update a category (admin only)
     delete: Delete a category (admin only)
     """
-    queryset = Category.objects.filter(is_active=True)
     serializer_class = CategorySerializer
     permission_classes = [AllowAny]
     lookup_field = 'slug'
     
+    def get_queryset(self):
+        """Active categories with stream counts annotated (no per-row count query)"""
+        return active_categories()
+    
     @action(detail=True, methods=['get'])
     def streams(self, request, slug=None):
         """
@@ -46,6 +91,48 @@ class CategoryViewSet(viewsets.ModelViewSet):
         streams = Stream.objects.filter(category=category, is_active=True)
         serializer = StreamListSerializer(streams, many=True)
         return Response(serializer.data)
+    
+    @action(detail=True, methods=['get'])
+    def stats(self, request, slug=None):
+        """
+        Get engagement stats for a category
+        URL: /api/categories/{slug}/stats/
+        """
+        category = self.get_object()
+        stats = CategoryStats.objects.filter(category=category).first()
+        if stats is None:
+            stats = CategoryStats(category=category)
+        return Response(CategoryStatsSerializer(stats).data)
+
+
+class PersonViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    ViewSet for cast members and directors
+    
+    list: Get all people
+    retrieve: Get a person by slug
+    """
+    queryset = Person.objects.all()
+    serializer_class = PersonSerializer
+    permission_classes = [AllowAny]
+    lookup_field = 'slug'
+    filter_backends = [filters.SearchFilter]
+    search_fields = ['name']
+    
+    @action(detail=True, methods=['get'])
+    def streams(self, request, slug=None):
+        """
+        Get all streams a person appears in or directed
+        URL: /api/people/{slug}/streams/
+        """
+        person = self.get_object()
+        streams = Stream.objects.filter(
+            Q(pk__in=StreamCast.objects.filter(person=person).values('stream_id')) |
+            Q(pk__in=StreamDirector.objects.filter(person=person).values('stream_id')),
+            is_active=True
+        ).select_related('category')
+        serializer = StreamListSerializer(streams, many=True)
+        return Response(serializer.data)
 
 
 class StreamViewSet(viewsets.ModelViewSet):
@@ -60,10 +147,11 @@ class StreamViewSet(viewsets.ModelViewSet):
     queryset = Stream.objects.filter(is_active=True)
     permission_classes = [AllowAny]
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
-    filterset_fields = ['category', 'quality', 'is_featured', 'is_live']
+    filterset_class = StreamFilter
     search_fields = ['title', 'description', 'cast', 'director']
-    ordering_fields = ['created_at', 'view_count', 'rating', 'title']
+    ordering_fields = ['created_at', 'view_count', 'rating', 'title', 'duration_seconds']
     ordering = ['-created_at']
+    throttle_scope = None  # Set per action, see DEFAULT_THROTTLE_RATES
     
     def get_serializer_class(self):
         """Use different serializers for list vs detail"""
@@ -89,15 +177,14 @@ class StreamViewSet(viewsets.ModelViewSet):
         Get featured streams for hero banner
         URL: /api/streams/featured/
         """
-        streams = Stream.objects.filter(is_featured=True, is_active=True)[:5]
-        serializer = StreamListSerializer(streams, many=True)
-        return Response(serializer.data)
+        return Response(cached('featured', build_featured))
     
     @action(detail=False, methods=['get'])
     def by_category(self, request):
         """
         Get streams grouped by category (matches Android app format)
         URL: /api/streams/by_category/
+        URL: /api/streams/by_category/?device_id=xxx (personalised)
         
         Returns:
         [
@@ -111,24 +198,19 @@ class StreamViewSet(viewsets.ModelViewSet):
             }
         ]
         """
-        categories = Category.objects.filter(is_active=True)
-        result = []
+        sections = by_category_sections()
         
-        for category in categories:
-            streams = Stream.objects.filter(
-                category=category,
-                is_active=True
-            )[:10]  # Limit to 10 streams per category
-            
-            if streams.exists():
-                result.append({
-                    'category': category.name,
-                    'streams': StreamListSerializer(streams, many=True).data
-                })
+        # Personalised order for devices with a feed, shared feed otherwise
+        device_id = request.query_params.get('device_id')
+        feed = get_device_feed(device_id) if device_id else None
+        if feed is not None:
+            result = personalize(sections, feed)
+        else:
+            result = [section for _, section in sections]
         
         return Response(result)
     
-    @action(detail=False, methods=['get'])
+    @action(detail=False, methods=['get'], throttle_scope='search')
     def search(self, request):
         """
         Advanced search endpoint
@@ -142,19 +224,11 @@ class StreamViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        streams = Stream.objects.filter(
-            Q(title__icontains=query) |
-            Q(description__icontains=query) |
-            Q(cast__icontains=query) |
-            Q(director__icontains=query),
-            is_active=True
-        )
-        
-        serializer = StreamListSerializer(streams, many=True)
+        results = search_results(query)
         return Response({
             'query': query,
-            'count': streams.count(),
-            'results': serializer.data
+            'count': len(results),
+            'results': results
         })
     
     @action(detail=False, methods=['get'])
@@ -162,10 +236,9 @@ class StreamViewSet(viewsets.ModelViewSet):
         """
         Get all live streams
         URL: /api/streams/live/
+        Clients can follow changes with /api/streams/events/ instead of polling
         """
-        streams = Stream.objects.filter(is_live=True, is_active=True)
-        serializer = StreamListSerializer(streams, many=True)
-        return Response(serializer.data)
+        return Response(cached('live', build_live))
     
     @action(detail=False, methods=['get'])
     def trending(self, request):
@@ -173,11 +246,60 @@ class StreamViewSet(viewsets.ModelViewSet):
         Get trending streams (sorted by view count)
         URL: /api/streams/trending/
         """
-        streams = Stream.objects.filter(is_active=True).order_by('-view_count')[:20]
-        serializer = StreamListSerializer(streams, many=True)
-        return Response(serializer.data)
+        return Response(cached('trending', build_trending))
     
-    @action(detail=True, methods=['post'])
+    @action(detail=False, methods=['get', 'post'])
+    def batch(self, request):
+        """
+        Get up to STREAM_BATCH_MAX_IDS streams by ID in one request
+        Results keep the requested order and do not count as views
+        URL: GET /api/streams/batch/?ids=1,2,3
+        URL: POST /api/streams/batch/  Body: {"ids": [1, 2, 3]}
+        
+        Returns:
+        {
+            "results": [...],
+            "missing": [3]
+        }
+        """
+        if request.method == 'POST':
+            raw_ids = request.data.get('ids', []) if hasattr(request.data, 'get') else []
+        else:
+            raw_ids = request.query_params.get('ids', '').split(',')
+        
+        try:
+            if not isinstance(raw_ids, list):
+                raise TypeError
+            ids = [int(pk) for pk in raw_ids if str(pk).strip()]
+            # Anything outside the 64-bit signed range can't be a stream ID
+            if not all(-2 ** 63 <= pk < 2 ** 63 for pk in ids):
+                raise ValueError
+        except (TypeError, ValueError):
+            return Response(
+                {'error': '"ids" must be a list of integer stream IDs'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        ids = list(dict.fromkeys(ids))  # Drop duplicates, keep order
+        if not ids:
+            return Response(
+                {'error': '"ids" parameter is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(ids) > settings.STREAM_BATCH_MAX_IDS:
+            return Response(
+                {'error': f'At most {settings.STREAM_BATCH_MAX_IDS} ids per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        streams = Stream.objects.filter(is_active=True).select_related('category').in_bulk(ids)
+        found = [streams[pk] for pk in ids if pk in streams]
+        return Response({
+            'results': StreamDetailSerializer(found, many=True).data,
+            'missing': [pk for pk in ids if pk not in streams],
+        })
+    
+    @action(detail=True, methods=['post'], throttle_scope='increment_view')
     def increment_view(self, request, pk=None):
         """
         Manually increment view count
@@ -185,13 +307,45 @@ class StreamViewSet(viewsets.ModelViewSet):
         """
         stream = self.get_object()
         stream.increment_views()
+        # Refresh the published trending.json once views have piled up
+        publisher.schedule_publish([], delay=settings.CATALOG_PUBLISH_TRENDING_INTERVAL)
         return Response({'view_count': stream.view_count})
+    
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        """
+        Get engagement stats (plays, unique devices, average watch
+        duration, completion rate) from the incremental aggregates
+        URL: /api/streams/{id}/stats/
+        """
+        stream = self.get_object()
+        stats = StreamStats.objects.filter(stream=stream).first()
+        if stats is None:
+            stats = StreamStats(stream=stream)
+        return Response(StreamStatsSerializer(stats).data)
+    
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """
+        Get "more like this" streams, precomputed by build_similar_streams
+        URL: /api/streams/{id}/similar/
+        """
+        stream = self.get_object()  # 404 for unknown and inactive streams
+        neighbours = StreamSimilarity.objects.filter(
+            stream=stream,
+            similar__is_active=True,
+        ).select_related('similar__category').order_by('rank')
+        streams = [neighbour.similar for neighbour in neighbours]
+        serializer = StreamListSerializer(streams, many=True)
+        return Response(serializer.data)
 
 
 class WatchHistoryViewSet(viewsets.ModelViewSet):
     """
     ViewSet for Watch History
     Track what users are watching
+    
+    With WATCH_HISTORY_SHARDS set, reads need ?device_id=xxx to find the shard
     """
     queryset = WatchHistory.objects.all()
     serializer_class = WatchHistorySerializer
@@ -199,6 +353,68 @@ class WatchHistoryViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['device_id', 'stream', 'completed']
     ordering = ['-watched_at']
+    throttle_scope = None  # Set per action, see DEFAULT_THROTTLE_RATES
+    
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            # Schema generation (build_openapi_schema) runs without a request
+            return WatchHistory.objects.none()
+        device_id = self.request.query_params.get('device_id')
+        if device_id:
+            history = history_for(device_id)
+        elif is_sharded():
+            raise ValidationError({'device_id': ['This parameter is required.']})
+        else:
+            history = WatchHistory.objects.all()
+        # Streams come from the default database, so prefetch rather than join
+        return history.prefetch_related('stream')
+    
+    def initial(self, request, *args, **kwargs):
+        # POST /api/watch-history/ records events like track does, so it shares its limit
+        if self.action == 'create':
+            self.throttle_scope = 'track'
+        super().initial(request, *args, **kwargs)
+    
+    def create(self, request, *args, **kwargs):
+        """Record a watch event; a retried event_id returns the original with 200"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        original = self.perform_create(serializer)
+        if original is not None:
+            return Response(self.get_serializer(original).data, status=status.HTTP_200_OK)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+    
+    def perform_create(self, serializer):
+        """
+        Queue the insert behind other writers on the device's shard
+        
+        Returns the already recorded event when event_id is a duplicate. Only
+        IDs the Bloom filter may have seen are looked up first; the unique
+        constraint catches the rest (e.g. retries sent to another worker).
+        """
+        device_id = serializer.validated_data['device_id']
+        event_id = serializer.validated_data.get('event_id')
+        if event_id is None:
+            with serialized_write(shard_for(device_id)):
+                serializer.save()
+            return None
+        
+        if dedup.may_have_seen(device_id, event_id):
+            original = history_for(device_id).filter(event_id=event_id).first()
+            if original is not None:
+                return original
+        try:
+            with serialized_write(shard_for(device_id)):
+                serializer.save()
+        except IntegrityError:
+            original = history_for(device_id).filter(event_id=event_id).first()
+            if original is None:
+                raise
+            return original
+        finally:
+            dedup.remember(device_id, event_id)
+        return None
     
     @action(detail=False, methods=['get'])
     def by_device(self, request):
@@ -214,11 +430,11 @@ class WatchHistoryViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        history = WatchHistory.objects.filter(device_id=device_id)
+        history = history_for(device_id).prefetch_related('stream')
         serializer = self.get_serializer(history, many=True)
         return Response(serializer.data)
     
-    @action(detail=False, methods=['post'])
+    @action(detail=False, methods=['post'], throttle_scope='track')
     def track(self, request):
         """
         Track a watch event
@@ -227,10 +443,121 @@ class WatchHistoryViewSet(viewsets.ModelViewSet):
             "stream": 1,
             "device_id": "android-device-123",
             "watch_duration": 120,
-            "completed": false
+            "completed": false,
+            "event_id": "7f0c2b1e-..."  (optional, makes retries safe)
         }
+        The body may also be MessagePack (Content-Type: application/msgpack)
+        Returns 201, or 200 with the original event for a retried event_id
         """
-        serializer = self.get_serializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
\ No newline at end of file
+        return self.create(request)
+
+
+class HomeView(APIView):
+    """
+    Everything the home screen needs in one request
+    URL: /api/home/
+    URL: /api/home/?device_id=xxx (personalised by_category)
+    
+    Returns:
+    {
+        "version": 12,
+        "categories": [...],
+        "featured": [...],
+        "by_category": [...],
+        "trending": [...],
+        "live": [...]
+    }
+    """
+    permission_classes = [AllowAny]
+    
+    def get(self, request):
+        document = home_document()
+        
+        device_id = request.query_params.get('device_id')
+        feed = get_device_feed(device_id) if device_id else None
+        if feed is not None:
+            sections = personalize(document['by_category'], feed)
+        else:
+            sections = [section for _, section in document['by_category']]
+        
+        return Response({**document, 'by_category': sections})
+
+
+class CatalogMetricsView(APIView):
+    """
+    Catalog cache outcomes for the worker process serving the request (staff only)
+    URL: /api/catalog/metrics/
+    
+    "collapsed" and "stale" count requests that did not rebuild a payload
+    because another request was already doing it.
+    """
+    permission_classes = [IsAdminUser]
+    
+    def get(self, request):
+        return Response({'pid': os.getpid(), **cache_metrics()})
+
+
+async def stream_events(request):
+    """
+    Live stream status changes as Server-Sent Events
+    URL: /api/streams/events/
+    
+    Each `stream` event carries {"ids": [...]} plus the changed is_live,
+    is_featured and is_active flags. Reconnecting with Last-Event-ID replays
+    missed events. Needs the ASGI server (sune_backend.asgi).
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'Live events are only served by the ASGI server'}, status=503)
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    
+    response = StreamingHttpResponse(event_stream(last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+    return response
+
+
+@require_GET
+def category_icon(request, slug, size, fmt):
+    """
+    Category icon resized to fit size x size, as WebP or JPEG
+    URL: /api/categories/{slug}/icon/{size}/{webp|jpeg}/
+    
+    Only ICON_SIZES are served. Variants are generated on first request;
+    URLs from CategorySerializer.icon_variants carry the icon hash (?v=),
+    so those responses can be cached for good.
+    """
+    if size not in settings.ICON_SIZES or fmt not in icons.FORMATS:
+        return JsonResponse({'error': f'Icon sizes are {settings.ICON_SIZES}, formats webp or jpeg'}, status=404)
+    
+    category = Category.objects.filter(slug=slug, is_active=True).only('slug', 'icon', 'icon_hash').first()
+    if category is None or not category.icon_hash:
+        return JsonResponse({'error': 'No icon for this category'}, status=404)
+    
+    etag = f'"{category.icon_hash[:16]}-{size}-{fmt}"'
+    if request.GET.get('v') == category.icon_hash[:12]:
+        cache_control = 'public, max-age=31536000, immutable'
+    else:
+        cache_control = 'public, max-age=300'
+    
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+    else:
+        try:
+            f = icons.open_variant(category, size, fmt)
+        except icons.UndecodableIcon:
+            f = None  # Logged once, when it first failed to decode
+        except OSError:
+            # Missing or unreadable source image
+            logger.exception('Could not generate icon variant for category %s', slug)
+            f = None
+        if f is None:
+            return JsonResponse({'error': 'No icon for this category'}, status=404)
+        response = FileResponse(f, content_type=icons.FORMATS[fmt][2])
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    return response
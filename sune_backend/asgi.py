@@ -3,6 +3,9 @@ ASGI config for sune_backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve it with an ASGI server (e.g. uvicorn sune_backend.asgi:application) so
+long-lived responses such as /api/streams/events/ don't hold a worker thread.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
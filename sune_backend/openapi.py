@@ -0,0 +1,25 @@
+"""
+OpenAPI schema for the Sune TV API
+
+Kept out of urls.py so drf_yasg is only imported when the docs UI is enabled
+or the schema is being built (python manage.py build_openapi_schema).
+"""
+
+from rest_framework import permissions
+from drf_yasg.views import get_schema_view
+from drf_yasg import openapi
+
+api_info = openapi.Info(
+    title="Sune TV API",
+    default_version='v1',
+    description="REST API for Sune TV streaming application",
+    terms_of_service="https://www.sunetv.com/terms/",
+    contact=openapi.Contact(email="api@sunetv.com"),
+    license=openapi.License(name="BSD License"),
+)
+
+schema_view = get_schema_view(
+    api_info,
+    public=True,
+    permission_classes=[permissions.AllowAny],
+)
@@ -30,13 +30,22 @@ INSTALLED_APPS = [
     'rest_framework',
     'corsheaders',
     'django_filters',
-    'drf_yasg',
-    'django_extensions',
     
     # Local apps
     'streams',
 ]
 
+# API docs (drf_yasg) - on by default in development only. In production,
+# serve the schema prebuilt by `python manage.py build_openapi_schema`.
+API_DOCS_ENABLED = config('API_DOCS_ENABLED', default=DEBUG, cast=bool)
+
+if API_DOCS_ENABLED:
+    INSTALLED_APPS += ['drf_yasg']
+
+# Dev-only tools (runserver_plus etc.)
+if DEBUG:
+    INSTALLED_APPS += ['django_extensions']
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # CORS - must be before CommonMiddleware
@@ -46,6 +55,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'streams.profiling.ProfilingMiddleware',  # Removes itself unless PROFILING_ENABLED
 ]
 
 ROOT_URLCONF = 'sune_backend.urls'
@@ -76,6 +86,50 @@ DATABASES = {
     }
 }
 
+# SQLite production tuning - WAL journal, relaxed fsync and a larger page cache.
+# Write transactions start with BEGIN IMMEDIATE so concurrent writers wait on
+# the busy timeout instead of failing with "database is locked" mid-transaction.
+# Opt-in: synchronous=NORMAL trades the last commits before a power loss for
+# write speed.
+SQLITE_TUNING = config('SQLITE_TUNING', default=False, cast=bool)
+
+SQLITE_TUNING_OPTIONS = {
+    'init_command': (
+        'PRAGMA journal_mode=WAL;'
+        'PRAGMA synchronous=NORMAL;'
+        f"PRAGMA mmap_size={config('SQLITE_MMAP_SIZE', default=268435456, cast=int)};"
+        f"PRAGMA cache_size={config('SQLITE_CACHE_SIZE', default=-64000, cast=int)};"
+        'PRAGMA temp_store=MEMORY;'
+    ),
+    'transaction_mode': 'IMMEDIATE',
+    # Busy timeout in seconds
+    'timeout': config('SQLITE_BUSY_TIMEOUT', default=20, cast=int),
+}
+
+if SQLITE_TUNING:
+    DATABASES['default']['OPTIONS'] = SQLITE_TUNING_OPTIONS
+
+# WatchHistory sharding - watch events are spread over these database aliases
+# by a stable hash of device_id; the catalog and everything else stay on
+# 'default'. Aliases missing from DATABASES get a local SQLite file
+# (e.g. WATCH_HISTORY_SHARDS=history_0,history_1); define PostgreSQL shards in
+# DATABASES. After changing the list, migrate each new alias and run
+# `python manage.py reshard_watch_history --from <old list>`.
+WATCH_HISTORY_SHARDS = config(
+    'WATCH_HISTORY_SHARDS',
+    default='default',
+    cast=lambda v: [s.strip() for s in v.split(',') if s.strip()]
+)
+
+for alias in WATCH_HISTORY_SHARDS:
+    if alias not in DATABASES:
+        DATABASES[alias] = {
+            **DATABASES['default'],
+            'NAME': BASE_DIR / f'{alias}.sqlite3',
+        }
+
+DATABASE_ROUTERS = ['streams.sharding.WatchHistoryRouter']
+
 # For production, use PostgreSQL:
 # DATABASES = {
 #     'default': {
@@ -117,10 +171,12 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
         'rest_framework.renderers.JSONRenderer',
+        'streams.renderers.MessagePackRenderer',  # Accept: application/msgpack
         'rest_framework.renderers.BrowsableAPIRenderer',
     ],
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
+        'streams.parsers.MessagePackParser',  # Content-Type: application/msgpack
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
@@ -132,8 +188,54 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',  # Change to IsAuthenticated in production
     ],
+    # Only views with a throttle_scope are limited, keyed by device_id or IP
+    'DEFAULT_THROTTLE_CLASSES': [
+        'streams.throttling.DeviceRateThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'track': config('THROTTLE_TRACK', default='120/min'),
+        'increment_view': config('THROTTLE_INCREMENT_VIEW', default='60/min'),
+        'search': config('THROTTLE_SEARCH', default='30/min'),
+    },
 }
 
+# Cache - local memory for a single process. Set REDIS_URL (any Redis-protocol
+# server, requires the redis package) so rate limits and cached payloads are
+# shared across worker processes.
+REDIS_URL = config('REDIS_URL', default='')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'sune-tv',
+        }
+    }
+
+# Cached search results live in their own cache, so the long tail of one-off
+# queries can't evict catalog payloads; locally it holds at most this many
+SEARCH_CACHE_MAX_ENTRIES = config('SEARCH_CACHE_MAX_ENTRIES', default=1000, cast=int)
+
+if REDIS_URL:
+    CACHES['search'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+        'KEY_PREFIX': 'search',
+    }
+else:
+    CACHES['search'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sune-tv-search',
+        'OPTIONS': {'MAX_ENTRIES': SEARCH_CACHE_MAX_ENTRIES},
+    }
+
 # CORS settings - Allow Android app to access API
 CORS_ALLOWED_ORIGINS = config(
     'CORS_ALLOWED_ORIGINS',
@@ -171,4 +273,107 @@ SWAGGER_SETTINGS = {
     },
     'USE_SESSION_AUTH': False,
     'JSON_EDITOR': True,
-}
\ No newline at end of file
+}
+
+# Prebuilt OpenAPI schema served at /swagger.json
+OPENAPI_SCHEMA_PATH = config('OPENAPI_SCHEMA_PATH', default=str(BASE_DIR / 'openapi' / 'swagger.json'))
+OPENAPI_SCHEMA_MAX_AGE = config('OPENAPI_SCHEMA_MAX_AGE', default=86400, cast=int)
+# Seconds the docs UI caches a live-generated schema
+API_DOCS_CACHE_TIMEOUT = config('API_DOCS_CACHE_TIMEOUT', default=3600, cast=int)
+
+# Watch history retention - raw events older than this are rolled up into
+# daily per-stream aggregates and deleted (python manage.py prune_watch_history)
+WATCH_HISTORY_RETENTION_DAYS = config('WATCH_HISTORY_RETENTION_DAYS', default=90, cast=int)
+
+# Background bulk jobs (python manage.py run_jobs)
+BULK_JOB_BATCH_SIZE = config('BULK_JOB_BATCH_SIZE', default=500, cast=int)
+# Running jobs with no progress for this many seconds are taken over by another runner
+BULK_JOB_STALE_AFTER = config('BULK_JOB_STALE_AFTER', default=600, cast=int)
+
+# "More like this" neighbours stored per stream (python manage.py build_similar_streams)
+SIMILAR_STREAMS_COUNT = config('SIMILAR_STREAMS_COUNT', default=12, cast=int)
+
+# Seconds a cached catalog payload (by_category, trending, search etc.) may be
+# served; any category or stream change invalidates them immediately anyway
+CATALOG_CACHE_TIMEOUT = config('CATALOG_CACHE_TIMEOUT', default=300, cast=int)
+# After that, the old payload is kept this much longer and served to concurrent
+# requests while a single request rebuilds it (payloads invalidated by a change
+# are never served stale)
+CATALOG_STALE_TIMEOUT = config('CATALOG_STALE_TIMEOUT', default=600, cast=int)
+# Catalog changes bump a version every process must see. With REDIS_URL it is
+# kept in the shared cache; otherwise each process has its own cache, and the
+# version is the modification time of this file, shared by every web worker and
+# run_jobs on the host. (Several hosts need REDIS_URL.)
+CATALOG_VERSION_FILE = config(
+    'CATALOG_VERSION_FILE',
+    default='' if REDIS_URL else str(BASE_DIR / 'catalog.version'),
+)
+
+# Personalised feeds - evict devices idle this long, and keep at most this many
+DEVICE_FEED_IDLE_DAYS = config('DEVICE_FEED_IDLE_DAYS', default=30, cast=int)
+DEVICE_FEED_MAX = config('DEVICE_FEED_MAX', default=100000, cast=int)
+
+# Maximum stream IDs per /api/streams/batch/ request
+STREAM_BATCH_MAX_IDS = config('STREAM_BATCH_MAX_IDS', default=100, cast=int)
+
+# Threads used to build /api/home/ sections concurrently (1 = sequential)
+HOME_BUILD_WORKERS = config('HOME_BUILD_WORKERS', default=4, cast=int)
+
+# Static catalog publishing (python manage.py publish_catalog). When enabled,
+# catalog changes are republished automatically after a short debounce.
+CATALOG_PUBLISH_ENABLED = config('CATALOG_PUBLISH_ENABLED', default=False, cast=bool)
+CATALOG_PUBLISH_ROOT = config('CATALOG_PUBLISH_ROOT', default=str(BASE_DIR / 'published'))
+CATALOG_PUBLISH_DEBOUNCE = config('CATALOG_PUBLISH_DEBOUNCE', default=5, cast=float)
+# Seconds replaced files stay on disk for clients holding an older manifest
+CATALOG_PUBLISH_RETAIN = config('CATALOG_PUBLISH_RETAIN', default=3600, cast=int)
+# View counts don't change the catalog version; trending is republished this
+# many seconds after the first view that follows a publish
+CATALOG_PUBLISH_TRENDING_INTERVAL = config('CATALOG_PUBLISH_TRENDING_INTERVAL', default=300, cast=float)
+
+# Duplicate watch event detection (per process): event IDs remembered per
+# Bloom filter generation, and its false positive rate
+EVENT_DEDUP_CAPACITY = config('EVENT_DEDUP_CAPACITY', default=1000000, cast=int)
+EVENT_DEDUP_ERROR_RATE = config('EVENT_DEDUP_ERROR_RATE', default=0.001, cast=float)
+
+# Live status events pushed over Server-Sent Events (GET /api/streams/events/,
+# served by the ASGI app). Without EVENTS_REDIS_URL (any Redis-protocol
+# server, requires the redis package) events only reach clients connected to
+# the process that published them: changes made by run_jobs, the admin on
+# another worker or any other process are never pushed. Set it whenever more
+# than one process serves or changes streams.
+EVENTS_REDIS_URL = config('EVENTS_REDIS_URL', default=REDIS_URL)
+EVENTS_BUFFER_SIZE = config('EVENTS_BUFFER_SIZE', default=1000, cast=int)  # Events kept for Last-Event-ID resume
+EVENTS_HEARTBEAT = config('EVENTS_HEARTBEAT', default=15, cast=float)  # Seconds between keep-alive comments
+
+# Request profiling (reports in the admin under Profile reports). Requests are
+# profiled at PROFILING_SAMPLE_RATE (0-1) or when they carry a token from
+# `python manage.py profiling_token`.
+PROFILING_ENABLED = config('PROFILING_ENABLED', default=False, cast=bool)
+PROFILING_SAMPLE_RATE = config('PROFILING_SAMPLE_RATE', default=0.0, cast=float)
+PROFILING_TOKEN_MAX_AGE = config('PROFILING_TOKEN_MAX_AGE', default=3600, cast=int)  # Seconds
+PROFILING_ROOT = config('PROFILING_ROOT', default=str(BASE_DIR / 'profiles'))
+PROFILING_MAX_REPORTS = config('PROFILING_MAX_REPORTS', default=200, cast=int)
+
+# Default directory for python manage.py export_watch_history
+EXPORT_ROOT = config('EXPORT_ROOT', default=str(BASE_DIR / 'exports'))
+
+# Category icon variants (GET /api/categories/<slug>/icon/<size>/<webp|jpeg>/).
+# Generated by ICON_WORKERS threads on upload or first request and cached on
+# disk, least recently used first out once the cache passes ICON_CACHE_MAX_BYTES.
+ICON_SIZES = config('ICON_SIZES', default='64,128,256', cast=lambda v: [int(s) for s in v.split(',') if s.strip()])
+ICON_QUALITY = config('ICON_QUALITY', default=80, cast=int)
+ICON_WORKERS = config('ICON_WORKERS', default=2, cast=int)
+ICON_CACHE_ROOT = config('ICON_CACHE_ROOT', default=str(BASE_DIR / 'icon_cache'))
+ICON_CACHE_MAX_BYTES = config('ICON_CACHE_MAX_BYTES', default=256 * 1024 * 1024, cast=int)
+ICON_PREGENERATE = config('ICON_PREGENERATE', default=True, cast=bool)  # Generate every variant on upload
+# Public origin of the API (e.g. https://api.sunetv.example), prefixed to icon
+# variant URLs so cached and published catalog documents carry the same URLs
+# as live responses. Blank leaves them relative to the API host.
+SITE_URL = config('SITE_URL', default='').rstrip('/')
+
+# Stream URL health checks (python manage.py check_stream_urls): requests in
+# flight overall and per host, and seconds allowed per request (time spent
+# waiting for a free slot on a busy host doesn't count)
+STREAM_CHECK_CONCURRENCY = config('STREAM_CHECK_CONCURRENCY', default=200, cast=int)
+STREAM_CHECK_PER_HOST = config('STREAM_CHECK_PER_HOST', default=8, cast=int)
+STREAM_CHECK_TIMEOUT = config('STREAM_CHECK_TIMEOUT', default=10, cast=float)
@@ -0,0 +1,30 @@
+"""
+Sune TV - Test settings
+The regular settings in the SQLite tuning mode, with runtime state and test
+databases kept out of the checkout
+
+Run with: python manage.py test --settings=sune_backend.test_settings
+"""
+
+import os
+import tempfile
+
+from .settings import *  # noqa: F401,F403
+
+TEST_DIR = tempfile.mkdtemp(prefix='sunetv-tests-')
+
+CATALOG_VERSION_FILE = os.path.join(TEST_DIR, 'catalog.version')
+
+# Test databases are files rather than shared-cache memory, where concurrent
+# writers fail straight away with "database table is locked" instead of
+# waiting their turn
+DATABASES['default']['OPTIONS'] = SQLITE_TUNING_OPTIONS
+DATABASES['default']['TEST'] = {'NAME': os.path.join(TEST_DIR, 'test_db.sqlite3')}
+
+# Two extra watch history shards for the resharding tests
+for alias in ('history_0', 'history_1'):
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'NAME': BASE_DIR / f'{alias}.sqlite3',
+        'TEST': {'NAME': os.path.join(TEST_DIR, f'test_{alias}.sqlite3')},
+    }
@@ -18,23 +18,8 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
-from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
 
-# Swagger/OpenAPI documentation
-schema_view = get_schema_view(
-    openapi.Info(
-        title="Sune TV API",
-        default_version='v1',
-        description="REST API for Sune TV streaming application",
-        terms_of_service="https://www.sunetv.com/terms/",
-        contact=openapi.Contact(email="api@sunetv.com"),
-        license=openapi.License(name="BSD License"),
-    ),
-    public=True,
-    permission_classes=[permissions.AllowAny],
-)
+from .views import openapi_schema
 
 urlpatterns = [
     # Admin
@@ -43,12 +28,19 @@ urlpatterns = [
     # API endpoints
     path('api/', include('streams.urls')),
     
-    # API Documentation
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
-    path('swagger.json', schema_view.without_ui(cache_timeout=0), name='schema-json'),
+    # OpenAPI schema - prebuilt by `python manage.py build_openapi_schema`
+    path('swagger.json', openapi_schema, name='schema-json'),
 ]
 
+# API Documentation UI - drf_yasg is only imported when docs are enabled
+if settings.API_DOCS_ENABLED:
+    from .openapi import schema_view
+
+    urlpatterns += [
+        path('swagger/', schema_view.with_ui('swagger', cache_timeout=settings.API_DOCS_CACHE_TIMEOUT), name='schema-swagger-ui'),
+        path('redoc/', schema_view.with_ui('redoc', cache_timeout=settings.API_DOCS_CACHE_TIMEOUT), name='schema-redoc'),
+    ]
+
 # Serve media files in development
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
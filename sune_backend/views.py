@@ -0,0 +1,53 @@
+"""
+Project-level views for Sune TV Backend API
+"""
+
+import hashlib
+import os
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+
+# (mtime, body, etag) of the last prebuilt schema read from disk
+_schema_file = None
+
+
+def _prebuilt_schema():
+    """The prebuilt schema file, re-read only when it changes on disk"""
+    global _schema_file
+
+    try:
+        mtime = os.stat(settings.OPENAPI_SCHEMA_PATH).st_mtime
+    except OSError:
+        return None
+
+    if _schema_file is None or _schema_file[0] != mtime:
+        with open(settings.OPENAPI_SCHEMA_PATH, 'rb') as f:
+            body = f.read()
+        _schema_file = (mtime, body, '"%s"' % hashlib.sha256(body).hexdigest()[:32])
+    return _schema_file
+
+
+def openapi_schema(request):
+    """
+    Serve /swagger.json
+
+    Uses the file written by build_openapi_schema with long-lived caching;
+    without it, falls back to generating the schema when API docs are enabled.
+    """
+    schema = _prebuilt_schema()
+    if schema is None:
+        if not settings.API_DOCS_ENABLED:
+            raise Http404('OpenAPI schema has not been built')
+        from .openapi import schema_view
+        return schema_view.without_ui(cache_timeout=settings.API_DOCS_CACHE_TIMEOUT)(request)
+
+    _, body, etag = schema
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=settings.OPENAPI_SCHEMA_MAX_AGE)
+    return response